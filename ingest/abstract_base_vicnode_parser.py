@@ -3,10 +3,12 @@ from abc import ABCMeta, abstractmethod
 from django.contrib.auth.models import User
 
 from ingest.abstract_ingest_parser import AbstractIngestParser
-from ingest.models import Alias
+from ingest.reading_writer import make_ingest_row_writer
+from ingest.resolver_cache import get_cached
 from ingest.test_utils import IngestTestCase
-from ingest.utils import get_product_dict, DataSizes, get_current_date
-from storage.models import Ingest, Label, Collection
+from ingest.utils import get_product_dict, DataSizes, get_current_date, \
+    parse_float_column
+from storage.models import Ingest, Label, Collection, LabelsAlias
 
 
 class AbstractBaseVicNodeParser(AbstractIngestParser):
@@ -18,6 +20,13 @@ class AbstractBaseVicNodeParser(AbstractIngestParser):
         self.collection_dict = collection_dict
         self.csv_split_col_size = csv_split_col_size
         self.header_line = None
+        # extracted rows are inserted in batches, set to None to save them
+        # one by one with process_ingest_row_data
+        self.ingest_row_writer = make_ingest_row_writer()
+        # the capacities parsed by process_rows_cols for the batch of rows
+        # being processed, and the index of the current row in the batch
+        self.batch_capacities = None
+        self.batch_row_index = None
         super(AbstractBaseVicNodeParser, self).__init__(extraction_date, user)
 
     @abstractmethod
@@ -60,6 +69,53 @@ class AbstractBaseVicNodeParser(AbstractIngestParser):
         except:
             return None, 'StorageProduct not found for ' + colValue, colValue
 
+    def process_rows_cols(self, rows):
+        """
+        Parses the capacity columns of all of the rows at once with
+        parse_capacity_columns before processing the rows one by one
+        """
+        self.batch_capacities = self.parse_capacity_columns(
+            [cols for curr_store_row, cols in rows])
+        results = []
+        try:
+            for index, (curr_store_row, cols) in enumerate(rows):
+                self.batch_row_index = index
+                results.append(self.process_row_cols(curr_store_row, cols))
+        finally:
+            self.batch_capacities = None
+            self.batch_row_index = None
+        return results
+
+    def parse_capacity_columns(self, rows_cols):
+        """
+        :param rows_cols: the cols of each of the rows of a batch
+        :return: dictionary of the lists of the (value, error) tuples the
+                 rows get from parse_allocated_capacity_in_gb ('allocated'),
+                 parse_used_capacity_in_gb ('used') and
+                 parse_used_replica_in_gb ('replica'), for those that can be
+                 parsed a column at a time
+        """
+        capacities = {}
+        for key, column_details, negative_as_zero in (
+                ('allocated', self.get_allocated_capacity_column_details(),
+                 True),
+                ('used', self.get_used_capacity_column_details(), False)):
+            if column_details and column_details[0] and column_details[0] > 0:
+                column, data_size_fn = column_details
+                capacities[key], invalid = parse_float_column(
+                    [cols[column - 1] for cols in rows_cols], data_size_fn(),
+                    negative_as_zero)
+        return capacities
+
+    def get_batch_capacity(self, key):
+        """
+        :return: the (value, error) tuple parse_capacity_columns gave the
+                 current row of the batch for key, None if there is none
+        """
+        if self.batch_capacities and key in self.batch_capacities:
+            return self.batch_capacities[key][self.batch_row_index]
+        return None
+
     @abstractmethod
     def get_allocated_capacity_column_details(self):
         return 0, lambda x: x
@@ -76,6 +132,9 @@ class AbstractBaseVicNodeParser(AbstractIngestParser):
         :param cols:
         :return: tuple (allocatedCapacity, errorMessage)
         """
+        batch_capacity = self.get_batch_capacity('allocated')
+        if batch_capacity:
+            return batch_capacity
         alloc_col, data_size_fn = self.get_allocated_capacity_column_details()
         if alloc_col and alloc_col > 0:
             alloc_capacity, error = self._parse_float(cols[alloc_col - 1])
@@ -96,6 +155,9 @@ class AbstractBaseVicNodeParser(AbstractIngestParser):
         :param cols:
         :return: tuple (allocatedCapacity, errorMessage)
         """
+        batch_capacity = self.get_batch_capacity('used')
+        if batch_capacity:
+            return batch_capacity
         used_col_num, data_size_fn = self.get_used_capacity_column_details()
         if used_col_num and used_col_num > 0:
             used_capacity, err = self._parse_float(cols[used_col_num - 1])
@@ -135,6 +197,25 @@ class AbstractBaseVicNodeParser(AbstractIngestParser):
             except Exception as e:
                 return False, 'Error persisting data ' + str(e)
 
+    def queue_ingest_row(self, curr_store_row, extracted_ingest_row):
+        if not self.ingest_row_writer:
+            return False
+        self.ingest_row_writer.add(extracted_ingest_row, curr_store_row)
+        return True
+
+    def flush_ingest_rows(self):
+        if not self.ingest_row_writer:
+            return []
+        return [(curr_store_row,
+                 self.complete_ingest_row(curr_store_row, row, success,
+                                          error_message))
+                for row, curr_store_row, success, error_message
+                in self.ingest_row_writer.flush()]
+
+    def discard_ingest_rows(self):
+        if self.ingest_row_writer:
+            self.ingest_row_writer.clear()
+
     def ignore_line(self, line_num, line):
         """
         :param line_num:
@@ -194,24 +275,33 @@ def get_alias_records_for_group(group_label_value, alias_group_value):
                                            group__value='Label')
         sonas_label_record = Label.objects.get(group=alias_constant,
                                                value=alias_group_value)
-        return Alias.objects.filter(source=sonas_label_record,
-                                    label__group=group_label)
-    except (Alias.DoesNotExist, Alias.MultipleObjectsReturned,
+        return LabelsAlias.objects.filter(source=sonas_label_record,
+                                          label__group=group_label)
+    except (LabelsAlias.DoesNotExist, LabelsAlias.MultipleObjectsReturned,
             Label.DoesNotExist, Label.MultipleObjectsReturned):
         return None
 
 
-def get_collection_dict(alias_group_value):
-    sonas_collection_dict = {}
-    for alias in get_alias_records_for_group('Collection Name',
-                                             alias_group_value):
-        try:
-            sonas_collection_dict[alias.value] = Collection.objects.get(
-                name=alias.label)
-        except (Collection.DoesNotExist, Collection.MultipleObjectsReturned):
-            pass  # Ignore, continue
+def build_collection_dict(alias_group_value):
+    aliases = get_alias_records_for_group('Collection Name',
+                                          alias_group_value)
+    if aliases is None:
+        return {}
+    names = {alias.value: alias.label.value
+             for alias in aliases.select_related('label')}
+    # one query finds the collections, names held by more than one
+    # collection are ignored
+    collections = {}
+    for collection in Collection.objects.filter(name__in=set(names.values())):
+        collections[collection.name] = \
+            None if collection.name in collections else collection
+    return {value: collections[name] for value, name in names.items()
+            if collections.get(name)}
+
 
-    return sonas_collection_dict
+def get_collection_dict(alias_group_value):
+    return get_cached('collection_dict:' + alias_group_value,
+                      lambda: build_collection_dict(alias_group_value))
 
 
 class AbstractBaseVicNodeParserTestCase(IngestTestCase):
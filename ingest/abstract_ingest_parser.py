@@ -1,14 +1,11 @@
 from abc import ABCMeta, abstractmethod
 from datetime import timedelta
 
-from django.contrib.auth.models import User
+from django.db import transaction
 
-from ingest.file_parse import set_run_error
-from ingest.parser_manager import get_dummy_ingest_file, get_next_ingest_run, \
-    store_file_row
-from ingest.test_utils import IngestTestCase
-from ingest.utils import get_current_date
-from storage.models import Ingest, Allocation, Label, Collection
+from ingest.run_records import set_run_error
+from ingest.utils import get_current_date, get_allocation_index
+from storage.models import Ingest, Label, Collection
 
 
 def transpose_date(date_to_transpose, by_days):
@@ -27,11 +24,21 @@ def get_collection_status_list():
 
 
 class AbstractIngestParser(metaclass=ABCMeta):
+    # whether the rows the parser extracts are added to the values already
+    # stored for their date, rather than refused if there are some
+    APPENDS_ROWS = False
 
     def __init__(self, extraction_date, user):
         self.user = user
         self.extraction_date = extraction_date
         self.tomorrow_date = increase_date(get_current_date(), 1)
+        # loaded on first use, or shared between the parsers of a request
+        self.allocation_index = None
+        # the collections whose status is moved on by
+        # update_collection_status once the rows have been ingested
+        self.provisioned_collection_ids = set()
+        self.ingesting_collection_ids = set()
+        self.updated_collection_ids = []
 
         # Header data management
         self.required_headers = None
@@ -163,9 +170,9 @@ class AbstractIngestParser(metaclass=ABCMeta):
         return row
 
     def validate_ingest_is_allocated(self, collection, storage_product):
-        return Allocation.objects.filter(
-            collection=collection,
-            storage_product=storage_product).count() > 0
+        if self.allocation_index is None:
+            self.allocation_index = get_allocation_index()
+        return (collection.id, storage_product.id) in self.allocation_index
 
     def parse_extraction_date(self, cols):
         """
@@ -180,7 +187,8 @@ class AbstractIngestParser(metaclass=ABCMeta):
         """
         :param curr_store_row:
         :param cols:
-        :return:
+        :return: True if the row was persisted, False if not, None if it was
+                 queued by queue_ingest_row
         """
         row = Ingest()
         row.extraction_date, error = self.parse_extraction_date(cols)
@@ -234,123 +242,122 @@ class AbstractIngestParser(metaclass=ABCMeta):
             set_run_error(curr_store_row, error)
 
         if not curr_store_row.error:
+            if self.queue_ingest_row(curr_store_row, row):
+                return None  # the outcome is reported by flush_ingest_rows
             success, error_message = self.process_ingest_row_data(row)
-            if success:
-                if self.set_collection_status_on_ingest:
-                    # update Collection status
-                    try:
-                        c = Collection.objects.get(pk=row.collection.id)
-                        old_status = c.status
-                        if c.status == self.coll_status_alloc_approved:
-                            c.status = self.coll_status_provisioned
-                        if row.used_capacity > 0:
-                            if c.status == self.coll_status_provisioned:
-                                c.status = self.coll_status_ingesting
-                        if old_status != c.status:
-                            c.save()
-                    except (Collection.DoesNotExist,
-                            Collection.MultipleObjectsReturned):
-                        error_message = 'Collection Status error, ' \
-                                        'collection id not found ' \
-                                        '%s' % row.collection.id
-                        # should not occur, as collection is guaranteed to be
-                        # present at this stage
-                        pass
-                else:
-                    error_message += ' Collection status could not be set. ' \
-                                     'Collection status label error'
-
-            if error_message:
-                set_run_error(curr_store_row, error_message)
-            elif not success:
-                set_run_error(curr_store_row,
-                              'Error processing extracted data')
-            return success
+            return self.complete_ingest_row(curr_store_row, row, success,
+                                            error_message)
         else:
             return False
 
+    def process_rows_cols(self, rows):
+        """
+        Processes the rows of a chunk of the file. Parsers can override this
+        to parse the columns of all of the rows at once.
+        :param rows: list of (curr_store_row, cols)
+        :return: list of the process_row_cols results of the rows
+        """
+        return [self.process_row_cols(curr_store_row, cols)
+                for curr_store_row, cols in rows]
 
-##########################################################
-#  Automated Tests
-##########################################################
-# from ingest.testUtils import IngestTestCase
-# from django.contrib.auth.models import User
-
-# from ingest.constants import ParserConstants
-# from ingest.modelUtils import get_dummy_ingest_file, get_next_ingest_run, \
-#     store_file_row
-
-
-class DummyAbstractNegativeIngestParser(AbstractIngestParser):
-    def parse_collection_object(self, cols):
-        return None, 'Not implemented', 0
-
-    def parse_storage_product_object(self, cols):
-        return None, 'Not implemented', 0
-
-    def parse_allocated_capacity_in_gb(self, cols):
-        return None, 'Not implemented'
-
-    def parse_used_capacity_in_gb(self, cols):
-        return None, 'Not implemented'
-
-    def parse_used_replica_in_gb(self, cols):
-        return None, 'Not implemented'
-
-    def ignore_line(self, line_num, line):
-        return True
-
-    def process_ingest_row_data(self, extracted_ingest_row):
-        return False, 'Not Implemented'
-
-
-class DummyAbstractPositiveIngestParser(AbstractIngestParser):
-    def parse_collection_object(self, cols):
-        return None, None, 0
-
-    def parse_storage_product_object(self, cols):
-        return None, None, 0
-
-    def parse_allocated_capacity_in_gb(self, cols):
-        return None, None
-
-    def parse_used_capacity_in_gb(self, cols):
-        return None, None
-
-    def parse_used_replica_in_gb(self, cols):
-        return None, None
-
-    def ignore_line(self, line_num, line):
+    def queue_ingest_row(self, curr_store_row, extracted_ingest_row):
+        """
+        Parsers that write their extracted rows in batches queue the row here
+        instead of having process_ingest_row_data write it straight away.
+        :param curr_store_row:
+        :param extracted_ingest_row:
+        :return: True if the row has been queued
+        """
         return False
 
-    def process_ingest_row_data(self, extracted_ingest_row):
-        return True, None
+    def flush_ingest_rows(self):
+        """
+        Writes the rows queued by queue_ingest_row.
+        :return: list of (curr_store_row, success) for the queued rows
+        """
+        return []
 
+    def discard_ingest_rows(self):
+        """
+        Drops the rows queued by queue_ingest_row without writing them.
+        """
+        pass
+
+    def get_chunk_state(self):
+        """
+        :return: the state restore_chunk_state puts back if the transaction
+                 of the chunk being processed is rolled back
+        """
+        return (set(self.provisioned_collection_ids),
+                set(self.ingesting_collection_ids),
+                list(self.updated_collection_ids))
+
+    def restore_chunk_state(self, state):
+        provisioned_ids, ingesting_ids, updated_ids = state
+        self.provisioned_collection_ids = set(provisioned_ids)
+        self.ingesting_collection_ids = set(ingesting_ids)
+        self.updated_collection_ids = list(updated_ids)
+        self.discard_ingest_rows()
+
+    def complete_ingest_row(self, curr_store_row, row, success,
+                            error_message):
+        """
+        Records the outcome of persisting an extracted row.
+        :param curr_store_row:
+        :param row: the extracted Ingest row
+        :param success: whether the row was persisted
+        :param error_message:
+        :return: success
+        """
+        if success:
+            if self.set_collection_status_on_ingest:
+                # the status is moved on for all of the run's collections at
+                # once by update_collection_status
+                self.provisioned_collection_ids.add(row.collection_id)
+                if row.used_capacity > 0:
+                    self.ingesting_collection_ids.add(row.collection_id)
+            else:
+                error_message = (error_message or '') + \
+                    ' Collection status could not be set. ' \
+                    'Collection status label error'
+
+        if error_message:
+            set_run_error(curr_store_row, error_message)
+        elif not success:
+            set_run_error(curr_store_row,
+                          'Error processing extracted data')
+        return success
 
-class AbstractParserTestCase(IngestTestCase):
-    def setUp(self):
-        self.testUser = User.objects.create_user('TestUser',
-                                                 'test@vicnode.org.at')
-        self.negativeParser = DummyAbstractNegativeIngestParser(
-            get_current_date(), self.testUser)
-        self.positiveParser = DummyAbstractPositiveIngestParser(
-            get_current_date(), self.testUser)
-        self.ingestFile = get_dummy_ingest_file()
-        self.ingestFileRun = get_next_ingest_run(self.ingestFile)
-
-    def test_parse_row_cols(self):
-        lineCount = 1
-        data = '2014-12-19,MyTardis,MON-V1,250420,200189,MyTardis'.split(',')
-
-        negativeStoreRow = store_file_row(lineCount, data, self.ingestFileRun)
-        self.negativeParser.process_row_cols(negativeStoreRow, data)
-        self.assertEqual(negativeStoreRow.error,
-                         'Not implemented,Not implemented,Not implemented,'
-                         'Not implemented,Not implemented,Not implemented, '
-                         'Not implemented')
-        lineCount += 1
-        positiveStoreRow = store_file_row(lineCount, data, self.ingestFileRun)
-        self.positiveParser.process_row_cols(positiveStoreRow, data)
-        self.assertEqual(positiveStoreRow.error, None)
-        if positiveStoreRow.error:
-            print("Pos Error : " + positiveStoreRow.error)
+    def update_collection_status(self):
+        """
+        Moves the collections of the rows ingested so far from 'Allocation
+        Approved' to 'Provisioned', and those with capacity in use on from
+        'Provisioned' to 'Ingesting', with one UPDATE per transition.
+        :return: sorted list of the ids of the collections updated, also kept
+                 in updated_collection_ids
+        """
+        if not self.set_collection_status_on_ingest:
+            return []
+        transitions = [
+            (self.provisioned_collection_ids, self.coll_status_alloc_approved,
+             self.coll_status_provisioned),
+            (self.ingesting_collection_ids, self.coll_status_provisioned,
+             self.coll_status_ingesting)]
+        updated_ids = set(self.updated_collection_ids)
+        with transaction.atomic():
+            for collection_ids, from_status, to_status in transitions:
+                if not collection_ids:
+                    continue
+                collections = Collection.objects.filter(id__in=collection_ids,
+                                                        status=from_status)
+                ids = list(collections.select_for_update().values_list(
+                    'id', flat=True))
+                if ids:
+                    Collection.objects.filter(
+                        id__in=ids, status=from_status).update(
+                        status=to_status)
+                    updated_ids.update(ids)
+        self.provisioned_collection_ids = set()
+        self.ingesting_collection_ids = set()
+        self.updated_collection_ids = sorted(updated_ids)
+        return self.updated_collection_ids
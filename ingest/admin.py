@@ -0,0 +1,72 @@
+import json
+
+from django.contrib import admin
+from django.utils.html import format_html
+
+from ingest.file_content import get_content_lines
+from ingest.models import IngestFileContent, IngestFileRun
+
+
+class IngestFileContentAdmin(admin.ModelAdmin):
+    PREVIEW_LINES = 20
+    fields = ['ingest_file', 'sha256', 'size', 'line_count', 'first_lines']
+    list_display = ('ingest_file', 'size', 'line_count')
+    readonly_fields = ('ingest_file', 'sha256', 'size', 'line_count',
+                       'first_lines')
+
+    def first_lines(self, obj):
+        lines = get_content_lines(obj, 1, self.PREVIEW_LINES)
+        return format_html('<pre>{}</pre>', '\n'.join(
+            '%5d  %s' % (n, line) for n, line in sorted(lines.items())))
+
+    first_lines.short_description = 'First lines'
+
+
+class IngestFileRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'parent', 'process_date', 'completed', 'parser',
+                    'lines_read', 'rows_errored', 'queries', 'seconds',
+                    'lines_per_second')
+    list_filter = ('completed', 'process_date')
+    list_select_related = ('parent',)
+    readonly_fields = ('parent', 'process_date', 'committed_line', 'checksum',
+                       'completed', 'run_error', 'metadata', 'metrics_table')
+    exclude = ('metrics',)
+
+    @staticmethod
+    def get_metrics(obj):
+        return json.loads(obj.metrics) if obj.metrics else {}
+
+    def parser(self, obj):
+        return self.get_metrics(obj).get('parser')
+
+    def lines_read(self, obj):
+        return self.get_metrics(obj).get('lines_read')
+
+    def rows_errored(self, obj):
+        return self.get_metrics(obj).get('rows_errored')
+
+    def queries(self, obj):
+        return self.get_metrics(obj).get('queries')
+
+    def seconds(self, obj):
+        seconds = self.get_metrics(obj).get('seconds')
+        return '%.2f' % sum(seconds.values()) if seconds else None
+
+    def lines_per_second(self, obj):
+        metrics = self.get_metrics(obj)
+        seconds = metrics.get('seconds', {})
+        parse_seconds = sum(value for phase, value in seconds.items()
+                            if phase != 'fetch')
+        if not parse_seconds:
+            return None
+        return '%.0f' % (metrics.get('lines_read', 0) / parse_seconds)
+
+    def metrics_table(self, obj):
+        return format_html('<pre>{}</pre>', json.dumps(
+            self.get_metrics(obj), indent=2))
+
+    metrics_table.short_description = 'Metrics'
+
+
+admin.site.register(IngestFileContent, IngestFileContentAdmin)
+admin.site.register(IngestFileRun, IngestFileRunAdmin)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class IngestConfig(AppConfig):
     name = 'ingest'
     verbose_name = 'Reporting Ingest'
+
+    def ready(self):
+        from ingest.resolver_cache import connect_signals
+        connect_signals()
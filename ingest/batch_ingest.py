@@ -0,0 +1,87 @@
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from django import db
+from django.core.management.base import CommandError
+
+from ingest.file_parse import run_ingest, count_errors
+
+
+def parse_date_argument(value):
+    try:
+        return datetime.strptime(value, '%Y%m%d').date()
+    except ValueError:
+        raise CommandError('%s is not a date (format: YYYYMMDD)' % value)
+
+
+def ingest_timed(name, file_url, file_type, file_source, extract_date,
+                 location, metadata, fetcher=None):
+    """
+    Ingests one file of a management command
+    :param name: what the file is reported as
+    :param metadata: recorded against the ingest runs of the file
+    :param fetcher: the SourceFetcher of the file, by default the one for the
+                    source of the file or the scheme of its url
+    :return: tuple (name, success, lines, errors, seconds, message)
+    """
+    lines = [0]
+
+    def progress(lines_processed):
+        lines[0] = lines_processed
+
+    start = time.time()
+    result = run_ingest(file_url, file_type, file_source, extract_date,
+                        location, None, metadata, progress, fetcher)
+    error_count = sum(count_errors(errors) for errors in
+                      result.get('errors', {}).values())
+    return (name, result['success'], lines[0], error_count,
+            time.time() - start, result['message'])
+
+
+def ingest_in_pool(*args):
+    """
+    Ingests one file in a pool process, see ingest_timed
+    """
+    try:
+        return ingest_timed(*args)
+    finally:
+        db.connections.close_all()
+
+
+def ingest_all(files, processes):
+    """
+    Ingests the files, several at a time in a pool of processes if there is
+    more than one of each
+    :param files: list of the arguments of ingest_timed for each file
+    :return: list of the results of ingest_timed, in the order of files
+    """
+    if processes > 1 and len(files) > 1:
+        # the pool processes must each open their own database connection
+        db.connections.close_all()
+        with Pool(processes) as pool:
+            return pool.starmap(ingest_in_pool, files, chunksize=1)
+    return [ingest_timed(*args) for args in files]
+
+
+def write_results(stdout, name_title, results, elapsed, skipped=None):
+    """
+    Writes a table of the results of ingest_timed, followed by their totals
+    :param skipped: the number of files skipped as completed, if any can be
+    """
+    width = max([len(name_title)] + [len(str(r[0])) for r in results])
+    stdout.write('%-*s  %-6s  %9s  %6s  %8s  %s' % (
+        width, name_title, 'Status', 'Lines', 'Errors', 'Seconds',
+        'Message'))
+    for name, success, lines, errors, seconds, message in results:
+        stdout.write('%-*s  %-6s  %9d  %6d  %8.1f  %s' % (
+            width, name, 'ok' if success else 'FAILED', lines, errors,
+            seconds, message))
+    total_lines = sum(r[2] for r in results)
+    stdout.write(
+        '%d files ingested, %d failed%s. %d lines in %.1f seconds '
+        '(%.0f lines/s)' % (
+            len(results), len([r for r in results if not r[1]]),
+            '' if skipped is None else
+            ', %d skipped as completed' % skipped,
+            total_lines, elapsed, total_lines / elapsed if elapsed else 0))
@@ -0,0 +1,185 @@
+import random
+import resource
+import time
+import tracemalloc
+
+from ingest.compute_parser import UOMComputeParser
+from ingest.market_parser import UOMMarketParser
+from ingest.parser_manager import IngestParserManager
+from ingest.run_metrics import QueryCounter
+from ingest.test_utils import IngestTestCase, create_ingest_labels, \
+    create_storage_product, create_allocated_collection, \
+    get_dummy_ingest_file, get_next_ingest_run
+from ingest.utils import get_current_date
+from storage.models import Label, StorageProduct, Collection
+
+PRODUCT_NAMES = ('Computational.Melbourne', 'Vault.Melbourne.Object',
+                 'Market.Melbourne')
+APPLICATION_CODE = 'BM%06d'
+
+
+def get_application_code(tenant):
+    return APPLICATION_CODE % tenant
+
+
+def generate_compute_lines(row_count, tenant_count=None, error_rate=0.0,
+                           seed=0):
+    """
+    :param row_count: the number of data rows
+    :param tenant_count: the rows cycle through this many tenants, so that
+                         rows beyond the first tenant_count repeat an
+                         existing key. Defaults to row_count.
+    :param error_rate: the share of the rows with an unknown vicnode id or a
+                       capacity that is not a number
+    :return: the lines of a UOM compute file, header included
+    """
+    rand = random.Random(seed)
+    tenant_count = tenant_count or row_count
+    yield UOMComputeParser.get_start_after_line(None)
+    for row in range(row_count):
+        tenant = row % tenant_count
+        code = get_application_code(tenant)
+        vault_quota = rand.randint(0, 100) * 1000
+        compute_quota = rand.randint(0, 100) * 1000
+        values = [str(vault_quota), '%.1f' % (vault_quota * rand.random()),
+                  str(compute_quota), '%.1f' % (compute_quota * rand.random())]
+        if rand.random() < error_rate:
+            if rand.random() < 0.5:
+                code = 'UNKNOWN%d' % row
+            else:
+                values[rand.randrange(len(values))] = 'n/a'
+        yield ','.join(['tenant%d' % tenant, code, '%032x' % tenant] + values)
+
+
+def generate_market_lines(row_count, tenant_count=None, error_rate=0.0,
+                          repl_ratio=0.5, seed=0):
+    """
+    :param repl_ratio: the share of the rows that are the '_repl' replica of
+                       the row before them
+    :return: the lines of a UOM market file, header included, see
+             generate_compute_lines for the other parameters
+    """
+    rand = random.Random(seed)
+    tenant_count = tenant_count or row_count
+    yield UOMMarketParser.get_start_after_line(None)
+    # each volume has a replica with this chance, so that repl_ratio of
+    # the rows are replicas
+    repl_chance = repl_ratio / (1 - repl_ratio) if repl_ratio < 1 else 1
+    row = 0
+    volume = 0
+    while row < row_count:
+        tenant = volume % tenant_count
+        total = rand.randint(1, 100) / 10
+        used = round(total * rand.random(), 2)
+        names = ['data%d' % volume]
+        if rand.random() < repl_chance:
+            names.append('data%d_repl' % volume)
+        for name in names[:row_count - row]:
+            code = get_application_code(tenant)
+            values = [str(total), str(used), str(round(total - used, 2))]
+            if rand.random() < error_rate:
+                if rand.random() < 0.5:
+                    code = 'UNKNOWN%d' % row
+                else:
+                    values[rand.randrange(2)] = 'n/a'
+            vserver = 'vs%d' % tenant + ('_repl' if name.endswith('_repl')
+                                         else '')
+            yield ','.join(['tenant%d' % tenant, code, name, vserver,
+                            'aggr1'] + values)
+            row += 1
+        volume += 1
+
+
+def create_benchmark_fixtures(tenant_count):
+    """
+    Creates the labels and storage products the UOM parsers look up, if they
+    are not there already, and an allocated collection for each tenant of
+    the generated files
+    """
+    if Label.objects.filter(value='Storage Product',
+                            group__value='Label').exists():
+        product_group = Label.objects.get(value='Storage Product',
+                                          group__value='Label')
+        labels = {name: Label.objects.get_or_create(
+            value=name, group=product_group)[0] for name in PRODUCT_NAMES}
+    else:
+        labels = create_ingest_labels(PRODUCT_NAMES)
+    products = []
+    for name in PRODUCT_NAMES:
+        product = StorageProduct.objects.filter(
+            product_name=labels[name]).first()
+        products.append(product or create_storage_product(name, labels[name]))
+    for tenant in range(tenant_count):
+        create_allocated_collection('Benchmark %d' % tenant,
+                                    get_application_code(tenant), products)
+
+
+def run_benchmark(parser_class, lines, chunk_size=None, trace_memory=False,
+                  streaming=False):
+    """
+    Parses the lines with a parser_class parser
+    :param trace_memory: measure the peak memory allocated while parsing
+                         with tracemalloc, which slows parsing down
+    :param streaming: parse in the streaming mode of the IngestParserManager
+    :return: dictionary of the measurements
+    """
+    lines = list(lines)
+    parser = parser_class(get_current_date(), None)
+    run = get_next_ingest_run(get_dummy_ingest_file())
+    manager = IngestParserManager(chunk_size=chunk_size, streaming=streaming)
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with QueryCounter() as query_counter:
+        tokens, errors = manager.parse(lines, run, parser)
+    seconds = time.perf_counter() - start
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    rows = len(lines) - 1
+    return {'parser': parser_class.__name__,
+            'rows': rows,
+            'errors': len(errors),
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else 0,
+            'queries': query_counter.count,
+            'queries_per_row': query_counter.count / rows if rows else 0,
+            'peak_memory': peak_memory,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class GeneratorTestCase(IngestTestCase):
+    def test_compute_lines(self):
+        lines = list(generate_compute_lines(20, error_rate=0.5, seed=1))
+        self.assertEqual(len(lines), 21)
+        self.assertEqual(lines[0], UOMComputeParser.get_start_after_line(None))
+        self.assertTrue(all(len(line.split(',')) == UOMComputeParser.COL_SIZE
+                            for line in lines))
+        self.assertTrue(any('UNKNOWN' in line or 'n/a' in line
+                            for line in lines))
+
+    def test_market_lines(self):
+        lines = list(generate_market_lines(30, repl_ratio=0.5, seed=1))
+        self.assertEqual(len(lines), 31)
+        replicas = [line for line in lines if '_repl,' in line]
+        self.assertTrue(5 < len(replicas) < 25)
+        self.assertEqual(lines,
+                         list(generate_market_lines(30, repl_ratio=0.5,
+                                                    seed=1)))
+        self.assertFalse(any('_repl,' in line for line in
+                             generate_market_lines(30, repl_ratio=0)))
+
+    def test_run_benchmark(self):
+        create_benchmark_fixtures(10)
+        self.assertEqual(Collection.objects.count(), 10)
+        result = run_benchmark(UOMMarketParser,
+                               generate_market_lines(10, tenant_count=5))
+        self.assertEqual(result['rows'], 10)
+        self.assertEqual(result['errors'], 0)
+        self.assertGreater(result['queries'], 0)
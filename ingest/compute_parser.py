@@ -2,9 +2,15 @@ from django.contrib.auth.models import User
 
 from ingest.abstract_base_vic_node_uom_parser import \
     AbstractBaseVicNodeUOMParser
-from ingest.test_utils import IngestTestCase
+from ingest.ingest_row_writer import DATA_EXISTS_ERROR
+from ingest.parser_manager import IngestParserManager
+from ingest.resolver_cache import get_cached_collection_appl_id_map, \
+    get_cached_product_dict
+from ingest.test_utils import IngestTestCase, create_ingest_labels, \
+    create_storage_product, create_allocated_collection, \
+    get_dummy_ingest_file, get_next_ingest_run
 from ingest.utils import get_product_dict, get_collection_appl_id_map, \
-    parse_float, DataSizes
+    parse_float, DataSizes, get_current_date
 from storage.models import Ingest
 
 
@@ -12,10 +18,9 @@ class UOMComputeParser(AbstractBaseVicNodeUOMParser):
     COL_SIZE = 7
 
     def __init__(self, extraction_date, user):
-        super(UOMComputeParser, self).__init__(extraction_date, user,
-                                               get_collection_appl_id_map(),
-                                               get_product_dict(),
-                                               self.COL_SIZE)
+        super(UOMComputeParser, self).__init__(
+            extraction_date, user, get_cached_collection_appl_id_map(),
+            get_cached_product_dict(), self.COL_SIZE)
 
     def get_start_after_line(self):
         return 'tenant,vicnode_id,tenant_id,vault_quota,' \
@@ -30,12 +35,23 @@ class UOMComputeParser(AbstractBaseVicNodeUOMParser):
     def get_used_capacity_column_details(self):
         return 7, DataSizes.GIGABYTE.bit_conversion_factor_gig
 
+    @staticmethod
+    def has_zero_capacity(extracted_ingest):
+        return extracted_ingest.allocated_capacity == 0 and \
+            extracted_ingest.used_capacity == 0
+
+    def queue_ingest_row(self, curr_store_row, extracted_ingest_row):
+        if self.has_zero_capacity(extracted_ingest_row):
+            # ignored by process_ingest_row_data without touching the db
+            return False
+        return super(UOMComputeParser, self).queue_ingest_row(
+            curr_store_row, extracted_ingest_row)
+
     def process_ingest_row_data(self, extracted_ingest):
         if not isinstance(extracted_ingest, Ingest):
             return None, 'Expected Instance object, got ' + type(
                 extracted_ingest)
-        if extracted_ingest.allocated_capacity == 0 and \
-                extracted_ingest.used_capacity == 0:
+        if self.has_zero_capacity(extracted_ingest):
             return (True,
                     'Zero values for allocated and used capacity, '
                     'ingest ignored')
@@ -62,6 +78,42 @@ class DummyParserWithoutSave(UOMComputeParser):
         return False, 'No save done'
 
 
+class ParseUOMComputeTestCase(IngestTestCase):
+    def setUp(self):
+        product_name = 'Computational.Melbourne'
+        labels = create_ingest_labels([product_name])
+        product = create_storage_product(product_name, labels[product_name])
+        create_allocated_collection('C4D_Renderfarm', '2014R9.05', [product])
+        self.parser = UOMComputeParser(get_current_date(), None)
+        self.run = get_next_ingest_run(get_dummy_ingest_file())
+
+    def test_existing_rows_are_reported(self):
+        line = 'C4D_Renderfarm,2014R9.05,57fb4d3f,0.0,0.0,100.0,50.0'
+        lines = [self.parser.get_start_after_line(), line, line]
+        tokens, errors = IngestParserManager().parse(lines, self.run,
+                                                     self.parser)
+        self.assertEqual(sorted(tokens.keys()), [2, 3])
+        self.assertEqual(errors, [{'lineNum': 3, 'input': line,
+                                   'error': DATA_EXISTS_ERROR}])
+        self.assertEqual(tokens[3]['error'], DATA_EXISTS_ERROR)
+        ingest = Ingest.objects.get()
+        self.assertEqual(ingest.allocated_capacity, 100)
+        self.assertEqual(ingest.used_capacity, 50)
+
+    def test_batch_capacities_match_row_by_row(self):
+        rows_cols = [line.split(',') for line in [
+            'IMOS,2013R1.4,1,10,5,100,40',
+            'IMOS,2013R1.4,1,10,5,-100,0',
+            'IMOS,2013R1.4,1,10,5,100GB,',
+            'IMOS,2013R1.4,1,10,5, 2.5 ,1e3']]
+        capacities = self.parser.parse_capacity_columns(rows_cols)
+        for index, cols in enumerate(rows_cols):
+            self.assertEqual(
+                (capacities['allocated'][index], capacities['used'][index]),
+                (self.parser.parse_allocated_capacity_in_gb(cols),
+                 self.parser.parse_used_capacity_in_gb(cols)))
+
+
 class ParseUOMComputeWithoutSaveTestCase(IngestTestCase):
     def setUp(self):
         self.testUser = User.objects.create_user('TestUser',
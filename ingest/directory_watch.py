@@ -0,0 +1,385 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime
+from email.utils import formatdate
+from pathlib import Path
+
+from django import db
+from django.conf import settings
+from django.test import override_settings
+from django.utils import timezone
+
+from ingest.file_parse import get_error_dict, appends_rows
+from ingest.ingest_job import run_job
+from ingest.models import IngestJob
+from ingest.test_utils import IngestTestCase
+from storage.models import IngestFile
+
+DEFAULT_DATE_FORMAT = '%Y%m%d'
+
+
+def get_watch_settings():
+    """
+    :return: the INGEST_WATCH_DIRECTORIES settings, a list of dictionaries
+             with the 'path' of a directory, the 'source' and 'location' of
+             its files and the 'patterns' their names are matched with
+    """
+    return getattr(settings, 'INGEST_WATCH_DIRECTORIES', [])
+
+
+class FilePattern:
+    """
+    A regular expression matching the names of the files of a watched
+    directory. Its named group 'date' gives their extract date, and the
+    groups 'source', 'type' and 'location', if it has them, override the
+    values given for the pattern.
+    """
+
+    def __init__(self, regex, type=None, source=None, location=None,
+                 date_format=DEFAULT_DATE_FORMAT):
+        self.regex = re.compile(regex)
+        self.values = {'source': source, 'type': type, 'location': location}
+        self.date_format = date_format
+
+    def match(self, file_name):
+        """
+        :return: dictionary of the extract_date, source, type and location of
+                 the file, or None if the name does not match or lacks one
+                 of them
+        """
+        match = self.regex.match(file_name)
+        if not match:
+            return None
+        groups = match.groupdict()
+        values = {key: groups.get(key) or value
+                  for key, value in self.values.items()}
+        if not all(values.values()) or not groups.get('date'):
+            return None
+        try:
+            values['extract_date'] = datetime.strptime(
+                groups['date'], self.date_format).date()
+            values['location'] = int(values['location'])
+        except ValueError:
+            return None
+        values['source'] = values['source'].upper()
+        return values
+
+
+class WatchedDirectory:
+    """
+    Finds the files of a directory that are new or changed since the last
+    scan. A file is only reported once its inode, size and modification time
+    are the same on two scans in a row, so that files still being written are
+    left for a later scan.
+    """
+
+    def __init__(self, path, source, location=None, patterns=()):
+        self.path = path
+        self.patterns = [FilePattern(**dict(
+            {'source': source, 'location': location}, **pattern))
+            for pattern in patterns]
+        # the stat key of each matching file by name, as last scanned
+        self.scanned = {}
+        # the stat key each file was last reported with
+        self.reported = {}
+
+    def match(self, file_name):
+        for pattern in self.patterns:
+            values = pattern.match(file_name)
+            if values:
+                return values
+        return None
+
+    def scan(self):
+        """
+        :return: list of (path, values, changed) of the files to ingest, with
+                 the values of their name (see FilePattern.match). changed is
+                 set if the file was reported by an earlier scan.
+        """
+        scanned = {}
+        found = []
+        try:
+            entries = list(os.scandir(self.path))
+        except FileNotFoundError:
+            # the mount may not be there yet
+            entries = []
+        for entry in entries:
+            values = self.match(entry.name)
+            if not values:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            scanned[entry.name] = key
+            if self.scanned.get(entry.name) != key or \
+                    self.reported.get(entry.name) == key:
+                continue
+            found.append((entry.path, values, entry.name in self.reported))
+            self.reported[entry.name] = key
+        self.scanned = scanned
+        for name in set(self.reported) - set(scanned):
+            del self.reported[name]
+        return found
+
+    def forget(self, path, changed):
+        """
+        Has the next scans report the file again, once it is unchanged
+        :param changed: what the scan reported the file with
+        """
+        name = os.path.basename(path)
+        if changed:
+            self.reported[name] = None
+        else:
+            self.reported.pop(name, None)
+
+
+def get_watched_directories():
+    return [WatchedDirectory(**watch) for watch in get_watch_settings()]
+
+
+def queue_file(path, values, changed):
+    """
+    Records the ingest of a watched file as a running IngestJob, so that the
+    ingest workers leave it to the watcher unless it stops reporting
+    progress. A file that was ingested since it was last modified, by a job
+    or otherwise, is left alone, so that the files already in the directories
+    are not ingested again when the watcher restarts.
+    A file changed since it was ingested has the IngestFile of its date
+    opened again, the ingest still skipping it if its content was parsed
+    already. The files of parsers that add their rows to those stored are
+    refused instead, as their rows would be counted twice, with a failed job.
+    :param changed: the scan saw the file change since it last reported it
+    :return: the IngestJob, None if the file is left alone
+    """
+    file_url = Path(path).as_uri()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # the inode change time covers files replaced with an older mtime
+    modified = datetime.fromtimestamp(max(stat.st_mtime, stat.st_ctime),
+                                      timezone.utc)
+    if IngestJob.objects.filter(file_url=file_url,
+                                extract_date=values['extract_date'],
+                                created__gte=modified).exists():
+        return None
+    now = timezone.now()
+    job = IngestJob(
+        file_url=file_url, file_source=values['source'],
+        file_type=values['type'], location=values['location'],
+        extract_date=values['extract_date'], status=IngestJob.RUNNING,
+        started=now, progressed=now, attempts=1,
+        metadata=json.dumps({'watch': path}))
+    ingest_file = IngestFile.objects.filter(
+        url=file_url, type=values['type'], source=values['source'],
+        extract_date=values['extract_date'], completed=True).first()
+    if ingest_file:
+        # as recorded by the LocalFetcher, only to the second
+        if not changed and ingest_file.last_modified == formatdate(
+                stat.st_mtime, usegmt=True):
+            return None
+        if appends_rows(values['source'], values['type']):
+            job.status = IngestJob.FAILED
+            job.finished = now
+            job.result = json.dumps(get_error_dict(
+                'File changed after it was ingested. Its rows are added to '
+                'those of the other files of its date, so it is not '
+                'ingested again: remove the rows of the date and ingest it '
+                'by hand.'))
+        else:
+            ingest_file.completed = False
+            ingest_file.save(update_fields=['completed'])
+    job.save()
+    return job
+
+
+def get_outcome(job):
+    """
+    :return: tuple (job id, status, lines processed, error count)
+    """
+    return job.id, job.get_status_display(), job.lines_processed, \
+        job.error_count
+
+
+def ingest_watched_file(job_id):
+    """
+    Runs the ingest of a queued watched file in a pool process
+    :return: see get_outcome
+    """
+    try:
+        job = run_job(IngestJob.objects.get(pk=job_id))
+    finally:
+        db.connections.close_all()
+    return get_outcome(job)
+
+
+class DirectoryWatcher:
+    """
+    Polls the watched directories and ingests their new and changed files,
+    at most as many at once as the pool has processes. Files found while the
+    pool is busy, or while an earlier version of them is being ingested, are
+    picked up by a later scan.
+    """
+
+    def __init__(self, directories, pool=None, processes=1, report=None):
+        """
+        :param pool: the multiprocessing Pool the files are ingested in, if
+                     None they are ingested in this process
+        :param report: called with the path and the outcome of each ingest,
+                       see get_outcome
+        """
+        self.directories = directories
+        self.pool = pool
+        self.processes = processes
+        self.report = report
+        # the job and the AsyncResult of each file being ingested, by path
+        self.running = {}
+
+    def collect(self):
+        for path, (job, result) in list(self.running.items()):
+            if not result.ready():
+                continue
+            del self.running[path]
+            try:
+                outcome = result.get()
+            except Exception as e:
+                job.status = IngestJob.FAILED
+                job.result = json.dumps(get_error_dict(
+                    'Exception:Parse Failed: ' + str(e)))
+                job.finished = timezone.now()
+                job.save()
+                outcome = get_outcome(job)
+            if self.report:
+                self.report(path, outcome)
+
+    def poll(self):
+        """
+        Scans the directories once, starting the ingest of the files found
+        :return: the number of ingests started
+        """
+        self.collect()
+        started = 0
+        for directory in self.directories:
+            for path, values, changed in directory.scan():
+                if path in self.running or \
+                        len(self.running) >= self.processes:
+                    directory.forget(path, changed)
+                    continue
+                job = queue_file(path, values, changed)
+                if not job:
+                    continue
+                if job.status != IngestJob.RUNNING:
+                    if self.report:
+                        self.report(path, get_outcome(job))
+                    continue
+                started += 1
+                if self.pool:
+                    self.running[path] = (job, self.pool.apply_async(
+                        ingest_watched_file, (job.id,)))
+                else:
+                    outcome = get_outcome(run_job(job))
+                    if self.report:
+                        self.report(path, outcome)
+        return started
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class DirectoryWatchTestCase(IngestTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.directory = WatchedDirectory(self.path, 'mon', 1, [
+            {'regex': r'^market_(?P<date>\d{8})\.csv$', 'type': 'M'},
+            {'regex': r'^(?P<type>[CV])_(?P<date>\d{4}-\d\d-\d\d)\.csv$',
+             'date_format': '%Y-%m-%d', 'location': 2}])
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_file(self, name, text):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(text)
+        return os.path.join(self.path, name)
+
+    def test_file_names_give_the_file_values(self):
+        self.assertEqual(self.directory.match('market_20180102.csv'), {
+            'source': 'MON', 'type': 'M', 'location': 1,
+            'extract_date': datetime(2018, 1, 2).date()})
+        self.assertEqual(self.directory.match('V_2018-01-02.csv')['location'],
+                         2)
+        self.assertEqual(self.directory.match('market_20181302.csv'), None)
+        self.assertEqual(self.directory.match('notes.txt'), None)
+
+    def test_files_are_reported_once_settled(self):
+        path = self.write_file('market_20180102.csv', 'a')
+        self.write_file('notes.txt', 'a')
+        self.assertEqual(self.directory.scan(), [])
+        found = self.directory.scan()
+        self.assertEqual([(p, changed) for p, values, changed in found],
+                         [(path, False)])
+        self.assertEqual(self.directory.scan(), [])
+        self.write_file('market_20180102.csv', 'ab')
+        self.assertEqual(self.directory.scan(), [])
+        self.assertEqual([changed for p, values, changed
+                          in self.directory.scan()], [True])
+
+    @override_settings(INGEST_SOURCES={})
+    def test_changed_file_is_ingested_again(self):
+        path = self.write_file('market_20180102.csv', 'a')
+        watcher = DirectoryWatcher([self.directory])
+        self.directory.scan()
+        self.assertEqual(watcher.poll(), 1)
+        IngestFile.objects.update(completed=True)
+        self.write_file('market_20180102.csv', 'ab')
+        self.directory.scan()
+        self.assertEqual(watcher.poll(), 1)
+        jobs = IngestJob.objects.order_by('id')
+        self.assertEqual([job.file_url for job in jobs],
+                         [Path(path).as_uri()] * 2)
+        self.assertEqual({job.status for job in jobs}, {IngestJob.DONE})
+        # the IngestFile of the date was opened again for the changed file
+        self.assertNotEqual(json.loads(jobs[1].result)['message'],
+                            'File Ignored')
+
+    @override_settings(INGEST_SOURCES={})
+    def test_ingested_files_are_not_queued_again_on_restart(self):
+        self.write_file('market_20180102.csv', 'a')
+        self.directory.scan()
+        self.assertEqual(DirectoryWatcher([self.directory]).poll(), 1)
+        directory = WatchedDirectory(self.path, 'mon', 1,
+                                     [{'regex': r'^market_(?P<date>\d{8})',
+                                       'type': 'M'}])
+        directory.scan()
+        self.assertEqual(DirectoryWatcher([directory]).poll(), 0)
+        # nor when ingested by other means
+        IngestJob.objects.all().delete()
+        IngestFile.objects.update(completed=True)
+        directory = WatchedDirectory(self.path, 'mon', 1,
+                                     [{'regex': r'^market_(?P<date>\d{8})',
+                                       'type': 'M'}])
+        directory.scan()
+        self.assertEqual(DirectoryWatcher([directory]).poll(), 0)
+
+    def test_changed_file_of_appending_parser_is_refused(self):
+        path = self.write_file('market_20180102.csv', 'a')
+        values = self.directory.match('market_20180102.csv')
+        values['source'] = 'UOM'
+        IngestFile.objects.create(
+            url=Path(path).as_uri(), type='M', source='UOM', location=1,
+            extract_date=values['extract_date'], completed=True,
+            last_modified='Mon, 01 Jan 2018 00:00:00 GMT')
+        job = queue_file(path, values, False)
+        self.assertEqual(job.status, IngestJob.FAILED)
+        self.assertTrue(IngestFile.objects.get().completed)
+        # the refusal covers this version of the file
+        self.assertEqual(queue_file(path, values, True), None)
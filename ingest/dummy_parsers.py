@@ -0,0 +1,155 @@
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+
+from ingest.abstract_ingest_parser import AbstractIngestParser, \
+    get_collection_status_list
+from ingest.run_records import store_file_row
+from ingest.test_utils import IngestTestCase, create_ingest_labels, \
+    get_dummy_ingest_file, get_next_ingest_run
+from ingest.utils import get_current_date
+from storage.models import Ingest, Collection, StorageProduct
+
+
+class DummyAbstractNegativeIngestParser(AbstractIngestParser):
+    def parse_collection_object(self, cols):
+        return None, 'Not implemented', 0
+
+    def parse_storage_product_object(self, cols):
+        return None, 'Not implemented', 0
+
+    def parse_allocated_capacity_in_gb(self, cols):
+        return None, 'Not implemented'
+
+    def parse_used_capacity_in_gb(self, cols):
+        return None, 'Not implemented'
+
+    def parse_used_replica_in_gb(self, cols):
+        return None, 'Not implemented'
+
+    def ignore_line(self, line_num, line):
+        return True
+
+    def process_ingest_row_data(self, extracted_ingest_row):
+        return False, 'Not Implemented'
+
+
+class DummyAbstractPositiveIngestParser(AbstractIngestParser):
+    def parse_collection_object(self, cols):
+        return None, None, 0
+
+    def parse_storage_product_object(self, cols):
+        return None, None, 0
+
+    def parse_allocated_capacity_in_gb(self, cols):
+        return 0, None
+
+    def parse_used_capacity_in_gb(self, cols):
+        return 0, None
+
+    def parse_used_replica_in_gb(self, cols):
+        return 0, None
+
+    def ignore_line(self, line_num, line):
+        return False
+
+    def process_ingest_row_data(self, extracted_ingest_row):
+        return True, None
+
+
+class DummyIgnoreAllLinesParser(DummyAbstractPositiveIngestParser):
+    def ignore_line(self, line_num, line):
+        return True, None
+
+
+class DummyAcceptAllLinesParser(DummyAbstractPositiveIngestParser):
+    def ignore_line(self, line_num, line):
+        return False, None
+
+    def process_row_cols(self, curr_store_row, cols):
+        return True
+
+
+class DummyUserCreatingParser(DummyAcceptAllLinesParser):
+    """
+    Creates a user for each line, the database refuses the lines 'bad'
+    """
+
+    def get_col_splitter(self, line_num):
+        return ',', 1
+
+    def process_row_cols(self, curr_store_row, cols):
+        User.objects.create_user('user%d' % curr_store_row.line_number)
+        if cols[0] == 'bad':
+            raise IntegrityError('bad line')
+        return True
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class AbstractParserTestCase(IngestTestCase):
+    def setUp(self):
+        create_ingest_labels([])
+        self.testUser = User.objects.create_user('TestUser',
+                                                 'test@vicnode.org.at')
+        self.negativeParser = DummyAbstractNegativeIngestParser(
+            get_current_date(), self.testUser)
+        self.positiveParser = DummyAbstractPositiveIngestParser(
+            get_current_date(), self.testUser)
+        self.ingestFile = get_dummy_ingest_file()
+        self.ingestFileRun = get_next_ingest_run(self.ingestFile)
+
+    def test_parse_row_cols(self):
+        lineCount = 1
+        data = '2014-12-19,MyTardis,MON-V1,250420,200189,MyTardis'.split(',')
+
+        negativeStoreRow = store_file_row(lineCount, data, self.ingestFileRun)
+        self.negativeParser.process_row_cols(negativeStoreRow, data)
+        self.assertEqual(negativeStoreRow.error,
+                         ', '.join(['Not implemented'] * 5))
+        lineCount += 1
+        positiveStoreRow = store_file_row(lineCount, data, self.ingestFileRun)
+        self.positiveParser.process_row_cols(positiveStoreRow, data)
+        self.assertEqual(positiveStoreRow.error, None)
+        if positiveStoreRow.error:
+            print("Pos Error : " + positiveStoreRow.error)
+
+    def test_validate_ingest_is_allocated(self):
+        self.positiveParser.allocation_index = {(1, 2)}
+        collection, product = Collection(id=1), StorageProduct(id=2)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.positiveParser.validate_ingest_is_allocated(
+                collection, product))
+            product.id = 3
+            self.assertFalse(self.positiveParser.validate_ingest_is_allocated(
+                collection, product))
+
+
+class CollectionStatusTestCase(IngestTestCase):
+    def setUp(self):
+        create_ingest_labels([])
+        status_map = get_collection_status_list()
+        self.parser = DummyAbstractPositiveIngestParser(get_current_date(),
+                                                        None)
+        self.collections = [
+            Collection.objects.create(name='Test %s' % i,
+                                      status=status_map[status])
+            for i, status in enumerate(['Allocation Approved',
+                                        'Allocation Approved',
+                                        'Provisioned', 'Ingesting'])]
+
+    def test_update_collection_status(self):
+        with self.assertNumQueries(0):
+            for collection, used_capacity in zip(self.collections,
+                                                 [0, 5, 5, 5]):
+                row = Ingest(collection=collection,
+                             used_capacity=used_capacity)
+                self.parser.complete_ingest_row(None, row, True, None)
+        self.assertEqual(self.parser.update_collection_status(),
+                         sorted(c.id for c in self.collections[:3]))
+        statuses = [Collection.objects.get(pk=c.id).status.value
+                    for c in self.collections]
+        self.assertEqual(statuses, ['Provisioned', 'Ingesting', 'Ingesting',
+                                    'Ingesting'])
@@ -0,0 +1,491 @@
+import http.client
+import io
+import os
+import socket
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.error import URLError, HTTPError
+from urllib.parse import urlsplit, urljoin, unquote
+
+from django.conf import settings
+
+from ingest.test_utils import IngestTestCase
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 1.0
+# the idle connections kept open to each host
+MAX_IDLE_CONNECTIONS = 4
+MAX_REDIRECTS = 5
+# statuses worth asking again for after a pause
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# the source the files of ingest requests for sources without settings of
+# their own are served by this server
+DEFAULT_SOURCE_PATH = '/static/market/'
+
+
+class RetryableError(Exception):
+    """
+    A failure that may not happen again if the fetch is retried
+    """
+
+
+class ConnectionPool:
+    """
+    The idle keep-alive connections of the process, kept by host so that
+    every fetch from the same server reuses them
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc, timeout):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                connection = idle.pop()
+                connection.timeout = timeout
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+                return connection
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=timeout)
+        return http.client.HTTPConnection(netloc, timeout=timeout)
+
+    def put(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+connection_pool = ConnectionPool()
+
+
+class FetchResponse:
+    """
+    The answer to a fetch, read in blocks as it arrives
+    """
+
+    def __init__(self, status, headers, stream=None, release=None):
+        """
+        :param stream: the object the content is read from, None if there is
+                       no content
+        :param release: called instead of closing the stream once the
+                        content has been read or the response is closed
+        """
+        self.status = status
+        self.headers = headers
+        self._stream = stream
+        self._release = release
+
+    def read(self, size):
+        if not self._stream:
+            return b''
+        block = self._stream.read(size)
+        if not block:
+            self.close()
+        return block
+
+    def close(self):
+        if self._stream:
+            if self._release:
+                self._release()
+            else:
+                self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SourceFetcher:
+    """
+    Fetches the files of an ingest source. A failed fetch is retried up to
+    retries times, waiting backoff seconds before the first retry and twice
+    as long before each one after it.
+    """
+    schemes = ()
+
+    def __init__(self, base_url='', timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    def handles(self, url):
+        return urlsplit(url).scheme in self.schemes
+
+    def url_for(self, file_name):
+        return self.base_url + file_name
+
+    def open(self, url, headers):
+        """
+        :param headers: dictionary of the request headers
+        :return: a FetchResponse
+        :raise RetryableError: if the fetch might succeed if tried again
+        :raise URLError: if it will not
+        """
+        raise NotImplementedError
+
+    def fetch(self, url, headers, consume):
+        """
+        Opens url and hands the response to consume, trying again if either
+        fails in a way that might not happen again
+        :param consume: called with the FetchResponse, it must start over
+                        if it is called again
+        :return: the result of consume
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.open(url, headers) as response:
+                    return consume(response)
+            except (RetryableError, socket.timeout, ConnectionError,
+                    http.client.HTTPException) as e:
+                if attempt >= self.retries:
+                    raise URLError('%s failed after %d attempts: %s' % (
+                        url, attempt + 1, e))
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+
+class LocalFetcher(SourceFetcher):
+    """
+    Reads the files of a source on a mounted file system, from file:// urls.
+    The modification time of the file stands in for the Last-Modified header.
+    """
+    schemes = ('file',)
+
+    def open(self, url, headers):
+        path = unquote(urlsplit(url).path)
+        try:
+            last_modified = formatdate(os.stat(path).st_mtime, usegmt=True)
+            if headers.get('If-Modified-Since') == last_modified:
+                return FetchResponse(304, {'Last-Modified': last_modified})
+            stream = open(path, 'rb')
+        except FileNotFoundError as e:
+            raise URLError(e)
+        except OSError as e:
+            # mounts can fail for a moment
+            raise RetryableError(e)
+        return FetchResponse(200, {'Last-Modified': last_modified}, stream)
+
+
+class HttpFetcher(SourceFetcher):
+    """
+    Fetches files over HTTP(S), reusing the keep-alive connections of the
+    process connection pool
+    """
+    schemes = ('http', 'https')
+    # the headers of get_headers only sent to the host of the url asked for,
+    # not to the hosts it redirects to
+    auth_headers = ('Authorization',)
+
+    def __init__(self, base_url='', pool=None, **kwargs):
+        super(HttpFetcher, self).__init__(base_url, **kwargs)
+        self.pool = pool or connection_pool
+
+    def get_headers(self):
+        """
+        :return: dictionary of the headers sent with every request. Servers
+                 may gzip the files they send, FetchedFile decompresses them
+                 as it reads them.
+        """
+        return {'Accept-Encoding': 'gzip'}
+
+    def open(self, url, headers):
+        request_headers = self.get_headers()
+        request_headers.update(headers)
+        origin = urlsplit(url)[:2]
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            if parts[:2] != origin:
+                auth_headers = {name.lower() for name in self.auth_headers}
+                request_headers = {
+                    name: value for name, value in request_headers.items()
+                    if name.lower() not in auth_headers}
+            path = parts.path + ('?' + parts.query if parts.query else '')
+            connection = self.pool.get(parts.scheme, parts.netloc,
+                                       self.timeout)
+            try:
+                connection.request('GET', path or '/', headers=request_headers)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                # an idle connection the server has closed fails at once,
+                # that is retried on a new one
+                raise RetryableError(e)
+            if response.status in REDIRECT_STATUSES and \
+                    response.getheader('Location'):
+                response.read()
+                self.release(parts, connection, response)
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status in RETRY_STATUSES or response.status >= 400:
+                response.read()
+                self.release(parts, connection, response)
+                error = HTTPError(url, response.status, response.reason,
+                                  response.headers, None)
+                if response.status in RETRY_STATUSES:
+                    raise RetryableError(error)
+                raise error
+            return FetchResponse(
+                response.status, response.headers, response,
+                lambda: self.release(parts, connection, response))
+        raise URLError('%s redirected more than %d times' % (url,
+                                                             MAX_REDIRECTS))
+
+    def release(self, parts, connection, response):
+        """
+        Returns the connection to the pool if its response has been read to
+        the end and the server keeps it open, closes it otherwise
+        """
+        if response.isclosed() and not response.will_close:
+            self.pool.put(parts.scheme, parts.netloc, connection)
+        else:
+            response.close()
+            connection.close()
+
+
+class SwiftFetcher(HttpFetcher):
+    """
+    Fetches the objects of a Swift compatible object store container, given
+    as the base url. An auth token is sent if the source has one, public
+    containers need none.
+    """
+
+    auth_headers = HttpFetcher.auth_headers + ('X-Auth-Token',)
+
+    def __init__(self, base_url='', auth_token=None, **kwargs):
+        super(SwiftFetcher, self).__init__(base_url, **kwargs)
+        self.auth_token = auth_token
+
+    def get_headers(self):
+        headers = super(SwiftFetcher, self).get_headers()
+        if self.auth_token:
+            headers['X-Auth-Token'] = self.auth_token
+        return headers
+
+
+class StreamFetcher(SourceFetcher):
+    """
+    Reads a file from an open binary stream, such as standard input, which
+    is left open. As a stream can only be read once, the fetch is not
+    retried.
+    """
+    schemes = ('stdin',)
+
+    def __init__(self, stream, **kwargs):
+        super(StreamFetcher, self).__init__(retries=0, **kwargs)
+        self.stream = stream
+
+    def open(self, url, headers):
+        return FetchResponse(200, {}, self.stream, release=lambda: None)
+
+
+FETCHER_CLASSES = {
+    'local': LocalFetcher,
+    'http': HttpFetcher,
+    'swift': SwiftFetcher,
+}
+_fetchers = {}
+_fetchers_lock = threading.Lock()
+
+
+def get_source_settings():
+    """
+    :return: the INGEST_SOURCES settings, a dictionary keyed by file source
+             of dictionaries with the 'fetcher' (a key of FETCHER_CLASSES)
+             and the keyword arguments it is made with
+    """
+    return getattr(settings, 'INGEST_SOURCES', {})
+
+
+def make_fetcher(source_settings):
+    source_settings = dict(source_settings)
+    fetcher_class = FETCHER_CLASSES[source_settings.pop('fetcher')]
+    return fetcher_class(**source_settings)
+
+
+def get_fetcher(file_source, url=None):
+    """
+    :param url: if given and the fetcher of the source cannot fetch it, the
+                fetcher for the scheme of the url is returned instead
+    :return: the fetcher of file_source, made once per process
+    """
+    source = (file_source or '').upper()
+    with _fetchers_lock:
+        if source not in _fetchers:
+            source_settings = get_source_settings().get(source)
+            _fetchers[source] = make_fetcher(source_settings) \
+                if source_settings else None
+        fetcher = _fetchers[source]
+        if url and not (fetcher and fetcher.handles(url)):
+            scheme = urlsplit(url).scheme
+            key = ':' + scheme
+            if key not in _fetchers:
+                _fetchers[key] = LocalFetcher() if scheme == 'file' \
+                    else HttpFetcher()
+            fetcher = _fetchers[key]
+    return fetcher
+
+
+def clear_fetchers():
+    with _fetchers_lock:
+        _fetchers.clear()
+
+
+def as_url(file_name, file_source, server_url):
+    """
+    :param server_url: the url of this server, which serves the files of
+                       sources without settings of their own
+    :return: the url the file of file_source is fetched from
+    """
+    fetcher = get_fetcher(file_source)
+    if fetcher:
+        return fetcher.url_for(file_name)
+    return server_url + DEFAULT_SOURCE_PATH + file_name
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class DummyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, self.headers.get('X-Auth-Token')))
+        if server.failures:
+            server.failures -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path in ('/moved', '/elsewhere'):
+            self.send_response(302)
+            self.send_header('Location', '/file' if self.path == '/moved'
+                             else 'http://localhost:%d/file' %
+                             server.server_port)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'line 1\nline 2\n'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def setup(self):
+        super(DummyHandler, self).setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+
+class DummyServer(ThreadingMixIn, HTTPServer):
+    # a keep-alive connection left in the pool does not hold up the others
+    daemon_threads = True
+
+
+class FetcherTestCase(IngestTestCase):
+    def setUp(self):
+        self.server = DummyServer(('127.0.0.1', 0), DummyHandler)
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.failures = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        fetcher = SwiftFetcher(self.base_url, auth_token='token',
+                               pool=self.pool)
+        for i in range(3):
+            self.assertEqual(
+                fetcher.fetch(fetcher.url_for('file'), {},
+                              lambda response: response.read(1024)),
+                b'line 1\nline 2\n')
+        self.assertEqual(fetcher.fetch(fetcher.url_for('moved'), {},
+                                       lambda response: response.status),
+                         200)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.server.requests[-1], ('/file', 'token'))
+
+    def test_auth_token_is_not_sent_to_other_hosts(self):
+        fetcher = SwiftFetcher(self.base_url, auth_token='token',
+                               pool=self.pool)
+        self.assertEqual(fetcher.fetch(fetcher.url_for('elsewhere'), {},
+                                       lambda response: response.status),
+                         200)
+        self.assertEqual(self.server.requests, [('/elsewhere', 'token'),
+                                                ('/file', None)])
+
+    def test_failures_are_retried(self):
+        self.server.failures = 2
+        fetcher = HttpFetcher(self.base_url, retries=2, backoff=0,
+                              pool=self.pool)
+        self.assertEqual(fetcher.fetch(fetcher.url_for('file'), {},
+                                       lambda response: response.status),
+                         200)
+        self.server.failures = 3
+        with self.assertRaises(URLError):
+            fetcher.fetch(fetcher.url_for('file'), {},
+                          lambda response: response.status)
+        self.assertEqual(len(self.server.requests), 6)
+
+    def test_local_file_is_not_modified(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            fetcher = get_fetcher('ABC', 'file://' + path)
+            self.assertIsInstance(fetcher, LocalFetcher)
+            with fetcher.open('file://' + path, {}) as response:
+                last_modified = response.headers['Last-Modified']
+            with fetcher.open('file://' + path, {
+                    'If-Modified-Since': last_modified}) as response:
+                self.assertEqual(response.status, 304)
+        finally:
+            os.remove(path)
+        with self.assertRaises(URLError):
+            fetcher.open('file://' + path, {})
+
+    def test_stream_is_read_once_and_left_open(self):
+        stream = io.BytesIO(b'line 1\nline 2\n')
+        fetcher = StreamFetcher(stream)
+        self.assertEqual(fetcher.fetch('stdin:///stdin', {},
+                                       lambda response: response.read(1024)),
+                         b'line 1\nline 2\n')
+        self.assertFalse(stream.closed)
+        self.assertEqual(fetcher.retries, 0)
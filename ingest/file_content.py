@@ -0,0 +1,172 @@
+import zlib
+from array import array
+
+from django.conf import settings
+
+from ingest.models import IngestFileContent, IngestFileContentFrame
+from ingest.test_utils import IngestTestCase
+from ingest.utils import get_current_date
+from storage.models import IngestFile
+
+ROWS = 'rows'
+COMPRESSED = 'compressed'
+# the lines compressed together, the most read to get one line
+FRAME_LINES = 1000
+# the frames written in each insert
+FRAME_BATCH_SIZE = 20
+
+
+def stores_lines_as_rows():
+    """
+    :return: True if every raw line is stored as an IngestFileData row, False
+             if files are kept as IngestFileContent and only the lines with
+             errors are stored as rows
+    """
+    return getattr(settings, 'INGEST_RAW_LINE_STORAGE', ROWS) != COMPRESSED
+
+
+def iter_frames(raw_lines, frame_lines):
+    """
+    :return: iterator of lists of frame_lines of the raw_lines, the last one
+             holding the lines left over
+    """
+    lines = []
+    for line in raw_lines:
+        lines.append(line)
+        if len(lines) == frame_lines:
+            yield lines
+            lines = []
+    if lines:
+        yield lines
+
+
+def make_frame(content, number, lines):
+    """
+    :return: an unsaved IngestFileContentFrame of the lines
+    """
+    offsets = array('Q', [0])
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return IngestFileContentFrame(
+        content=content, number=number, data=zlib.compress(b''.join(lines)),
+        line_offsets=zlib.compress(offsets.tobytes()))
+
+
+def store_file_content(ingest_file_record, fetched_file):
+    """
+    Compresses the content of fetched_file into the IngestFileContent of
+    ingest_file_record, unless it is already stored. The frames are written
+    as the lines are read, so only FRAME_BATCH_SIZE of them are held at once.
+    :return: the IngestFileContent
+    """
+    try:
+        content = ingest_file_record.content
+        if content.sha256 == fetched_file.sha256:
+            return content
+        content.frames.all().delete()
+    except IngestFileContent.DoesNotExist:
+        content = IngestFileContent(ingest_file=ingest_file_record)
+    # the checksum is only set once all of the frames are written, so that
+    # an interrupted store is done again
+    content.sha256 = ''
+    content.size = content.line_count = 0
+    content.frame_lines = FRAME_LINES
+    content.save()
+    frames = []
+    for number, lines in enumerate(iter_frames(fetched_file.raw_lines(),
+                                               FRAME_LINES)):
+        frames.append(make_frame(content, number, lines))
+        content.size += sum(len(line) for line in lines)
+        content.line_count += len(lines)
+        if len(frames) == FRAME_BATCH_SIZE:
+            IngestFileContentFrame.objects.bulk_create(frames)
+            frames = []
+    IngestFileContentFrame.objects.bulk_create(frames)
+    content.sha256 = fetched_file.sha256
+    content.save()
+    return content
+
+
+def get_content_lines(content, first_line, last_line=None):
+    """
+    Decompresses only the frames holding the lines wanted
+    :param content: an IngestFileContent
+    :param first_line: the number of the first line wanted, from 1
+    :param last_line: the number of the last line wanted, first_line if None
+    :return: dictionary of the lines, decoded as the parsers see them, keyed
+             by line number
+    """
+    first_line = max(first_line, 1)
+    last_line = min(last_line or first_line, content.line_count)
+    lines = {}
+    if first_line > last_line:
+        return lines
+    frames = content.frames.filter(
+        number__gte=(first_line - 1) // content.frame_lines,
+        number__lte=(last_line - 1) // content.frame_lines).order_by('number')
+    for frame in frames.iterator():
+        offsets = array('Q')
+        offsets.frombytes(zlib.decompress(frame.line_offsets))
+        data = zlib.decompress(frame.data)
+        frame_first_line = frame.number * content.frame_lines + 1
+        for n in range(max(first_line, frame_first_line),
+                       min(last_line, frame_first_line + len(offsets) - 2) +
+                       1):
+            index = n - frame_first_line
+            lines[n] = data[offsets[index]:offsets[index + 1]].strip().decode(
+                'utf-8')
+    return lines
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class DummyFetchedFile:
+    def __init__(self, content):
+        self.content = content
+        self.sha256 = str(len(content))
+
+    def raw_lines(self):
+        return iter(self.content.splitlines(keepends=True))
+
+
+class FileContentTestCase(IngestTestCase):
+    def test_lines_are_decoded_on_demand(self):
+        ingest_file = IngestFile.objects.create(
+            url='http://localhost:8000/static/testFile', type='M',
+            source='MON', location=2, extract_date=get_current_date())
+        fetched_file = DummyFetchedFile(
+            b'tenant,vicnode_id\r\n  IMOS,2013R1.4 \n\nACFS,2014R7.1')
+        content = store_file_content(ingest_file, fetched_file)
+        self.assertEqual(content.line_count, 4)
+        self.assertEqual(content.size, 50)
+        content = IngestFileContent.objects.get(ingest_file=ingest_file)
+        self.assertEqual(get_content_lines(content, 2),
+                         {2: 'IMOS,2013R1.4'})
+        self.assertEqual(get_content_lines(content, 3, 10),
+                         {3: '', 4: 'ACFS,2014R7.1'})
+
+    def test_lines_are_read_from_their_frames(self):
+        ingest_file = IngestFile.objects.create(
+            url='http://localhost:8000/static/testFile', type='M',
+            source='MON', location=2, extract_date=get_current_date())
+        lines = ['line %d\n' % n for n in range(1, 2 * FRAME_LINES + 2)]
+        fetched_file = DummyFetchedFile(''.join(lines).encode('utf-8'))
+        content = store_file_content(ingest_file, fetched_file)
+        self.assertEqual(content.frames.count(), 3)
+        self.assertEqual(content.line_count, len(lines))
+        self.assertEqual(content.size, len(''.join(lines)))
+        with self.assertNumQueries(1):
+            self.assertEqual(get_content_lines(content, FRAME_LINES + 1),
+                             {FRAME_LINES + 1: 'line %d' % (FRAME_LINES + 1)})
+        spanning = get_content_lines(content, FRAME_LINES, 2 * FRAME_LINES + 5)
+        self.assertEqual(sorted(spanning), list(range(FRAME_LINES,
+                                                      len(lines) + 1)))
+        self.assertEqual(spanning[len(lines)], 'line %d' % len(lines))
+        # changed content replaces the frames
+        fetched_file = DummyFetchedFile(b'other\n')
+        content = store_file_content(ingest_file, fetched_file)
+        self.assertEqual(content.frames.count(), 1)
+        self.assertEqual(get_content_lines(content, 1, 3), {1: 'other'})
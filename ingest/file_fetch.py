@@ -0,0 +1,256 @@
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import re
+import tempfile
+import time
+import zlib
+
+from ingest.fetchers import get_fetcher
+from ingest.test_utils import IngestTestCase
+
+# files smaller than this are held in memory, larger ones go to a temp file
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+COPY_BUFFER_SIZE = 64 * 1024
+# the pattern of the first bytes of the files compressed with each format,
+# the class their lines are read through and the decompressor their content
+# is hashed through. A bz2 stream starts with BZh, the block size digit and
+# the magic of its first block, or of its end if it is empty.
+COMPRESSIONS = (
+    ('gzip', re.compile(b'\x1f\x8b'),
+     lambda stream: gzip.GzipFile(fileobj=stream, mode='rb'),
+     lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)),
+    ('bz2', re.compile(b'BZh[1-9](\x31\x41\x59\x26\x53\x59|'
+                       b'\x17\x72\x45\x38\x50\x90)'),
+     bz2.BZ2File, bz2.BZ2Decompressor),
+    ('xz', re.compile(b'\xfd7zXZ\x00'), lzma.LZMAFile,
+     lzma.LZMADecompressor),
+)
+# the most bytes a pattern looks at
+MAGIC_SIZE = 10
+
+
+def get_compression(head):
+    """
+    :param head: the first bytes of a file
+    :return: the name of the format the file is compressed with, or None
+    """
+    for name, magic, opener, decompressor in COMPRESSIONS:
+        if magic.match(head):
+            return name
+    return None
+
+
+class ContentHash:
+    """
+    The SHA-256 of the content of a file, which is decompressed as it is
+    added if the file is compressed. The same content hashes the same however
+    it was compressed, or if a server sent it uncompressed.
+    """
+
+    def __init__(self, compression=None):
+        self.hash = hashlib.sha256()
+        self.make_decompressor = {
+            name: decompressor for name, magic, opener, decompressor
+            in COMPRESSIONS}.get(compression)
+        self.decompressor = self.make_decompressor() \
+            if self.make_decompressor else None
+
+    def update(self, data):
+        if not self.decompressor:
+            self.hash.update(data)
+            return
+        while data:
+            self.hash.update(self.decompressor.decompress(data))
+            if not self.decompressor.eof:
+                break
+            # files may hold several streams one after the other
+            data = self.decompressor.unused_data
+            self.decompressor = self.make_decompressor()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class FetchedFile:
+    """
+    A file downloaded once from its url so that every parser of an ingest
+    request can read it without fetching it again. The content is spooled in
+    memory until it grows past spool_max_size, after which it is moved to a
+    temporary file on disk. The SHA-256 of the content, decompressed, is
+    computed as it is downloaded.
+
+    Files compressed with gzip, bz2 or xz are kept compressed, and their
+    lines are decompressed as they are read.
+
+    The fetcher of the source retries the download if it fails on the way.
+    Given the etag and last_modified headers of an earlier fetch, the request
+    is made conditional. If the server answers that the file has not been
+    modified, not_modified is set and the file has no content.
+    """
+
+    def __init__(self, url, spool_max_size=SPOOL_MAX_SIZE, etag=None,
+                 last_modified=None, fetcher=None):
+        """
+        :param fetcher: the SourceFetcher of the file source, by default the
+                        one for the scheme of the url
+        """
+        self.url = url
+        self.not_modified = False
+        self.sha256 = None
+        # the size of the file as fetched, compressed if it is
+        self.size = 0
+        self.compression = None
+        self.fetch_seconds = 0.0
+        self.etag = None
+        self.last_modified = None
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        fetcher = fetcher or get_fetcher(None, url)
+        start = time.perf_counter()
+        try:
+            fetcher.fetch(url, headers, self._store)
+        except Exception:
+            self._spool.close()
+            raise
+        self.fetch_seconds = time.perf_counter() - start
+        if self.not_modified:
+            self.etag = self.etag or etag
+            self.last_modified = self.last_modified or last_modified
+
+    def _store(self, response):
+        """
+        Spools the content of the response, starting over if it is called
+        again for a retried fetch
+        """
+        self._spool.seek(0)
+        self._spool.truncate()
+        self.not_modified = response.status == 304
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.compression = None
+        if self.not_modified:
+            return
+        content_hash = None
+        head = b''
+        for block in iter(lambda: response.read(COPY_BUFFER_SIZE), b''):
+            self._spool.write(block)
+            if not content_hash:
+                # the compression is known once the first bytes are in
+                head += block
+                if len(head) < MAGIC_SIZE:
+                    continue
+                self.compression = get_compression(head)
+                content_hash = ContentHash(self.compression)
+                block = head
+            content_hash.update(block)
+        if not content_hash:
+            self.compression = get_compression(head)
+            content_hash = ContentHash(self.compression)
+            content_hash.update(head)
+        self.sha256 = content_hash.hexdigest()
+        self.size = self._spool.tell()
+
+    def lines(self):
+        """
+        :return: a fresh iterator over the decoded, stripped lines of the
+                 file. Each call starts again from the first line, so the
+                 iterators must be consumed one after the other.
+        """
+        for line in self.raw_lines():
+            yield line.strip().decode('utf-8')
+
+    def raw_lines(self):
+        """
+        :return: a fresh iterator over the lines of the file, decompressed if
+                 it is compressed, as bytes including their line ends
+        """
+        self._spool.seek(0)
+        if not self.compression:
+            yield from self._spool
+            return
+        opener = {name: opener for name, magic, opener, decompressor
+                  in COMPRESSIONS}[self.compression]
+        with opener(self._spool) as stream:
+            yield from stream
+
+    def close(self):
+        self._spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class FetchedFileTestCase(IngestTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as f:
+            f.write(b'tenant,vicnode_id\r\n  IMOS,2013R1.4 \nACFS,2014R7.1')
+        self.url = 'file://' + self.path
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_lines_can_be_read_by_each_parser(self):
+        expected = ['tenant,vicnode_id', 'IMOS,2013R1.4', 'ACFS,2014R7.1']
+        with FetchedFile(self.url) as fetched_file:
+            self.assertEqual(list(fetched_file.lines()), expected)
+            self.assertEqual(list(fetched_file.lines()), expected)
+
+    def test_large_file_is_spooled_to_disk(self):
+        with FetchedFile(self.url, spool_max_size=8) as fetched_file:
+            self.assertEqual(fetched_file.size, 49)
+            self.assertEqual(fetched_file.sha256, hashlib.sha256(
+                b'tenant,vicnode_id\r\n  IMOS,2013R1.4 \nACFS,2014R7.1'
+            ).hexdigest())
+            self.assertEqual(len(list(fetched_file.lines())), 3)
+
+    def test_compressed_files_are_decompressed_as_read(self):
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        expected = ['tenant,vicnode_id', 'IMOS,2013R1.4', 'ACFS,2014R7.1']
+        for compression, compress in (('gzip', gzip.compress),
+                                      ('bz2', bz2.compress),
+                                      ('xz', lzma.compress)):
+            with open(self.path, 'wb') as f:
+                f.write(compress(content))
+            with FetchedFile(self.url, spool_max_size=8) as fetched_file:
+                self.assertEqual(fetched_file.compression, compression)
+                self.assertEqual(fetched_file.size,
+                                 os.path.getsize(self.path))
+                self.assertEqual(fetched_file.sha256,
+                                 hashlib.sha256(content).hexdigest())
+                self.assertEqual(list(fetched_file.lines()), expected)
+                self.assertEqual(list(fetched_file.lines()), expected)
+
+    def test_text_starting_like_a_compressed_file_is_read_as_is(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'BZh9,tenant\nIMOS,2013R1.4\n')
+        with FetchedFile(self.url) as fetched_file:
+            self.assertEqual(fetched_file.compression, None)
+            self.assertEqual(list(fetched_file.lines()),
+                             ['BZh9,tenant', 'IMOS,2013R1.4'])
+
+    def test_gzip_members_are_hashed_as_their_content(self):
+        content = b'line 1\n' * 1000
+        with open(self.path, 'wb') as f:
+            f.write(gzip.compress(content[:3000]))
+            f.write(gzip.compress(content[3000:]))
+        with FetchedFile(self.url) as fetched_file:
+            self.assertEqual(fetched_file.sha256,
+                             hashlib.sha256(content).hexdigest())
+            self.assertEqual(len(list(fetched_file.lines())), 1000)
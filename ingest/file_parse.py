@@ -1,22 +1,35 @@
 import json
-import urllib.request
-from datetime import datetime
+import os
+import tempfile
+from datetime import datetime, timedelta
 from urllib.error import URLError
 
+from django.conf import settings
 from django.http import HttpResponse
+from django.test import override_settings
 from django.utils.datastructures import MultiValueDictKeyError
 
 from ingest.compute_parser import UOMComputeParser
+from ingest.file_content import stores_lines_as_rows, store_file_content, \
+    get_content_lines
+from ingest.fetchers import as_url, get_fetcher
+from ingest.file_fetch import FetchedFile
 from ingest.market_parser import UOMMarketParser
-from ingest.models import IngestFileRun
+from ingest.models import IngestFileRun, IngestJob, IngestFileContent
 from ingest.not_implemented_parser import NotImplementedParser
 from ingest.parser_manager import IngestParserManager
+from ingest.run_metrics import RunMetrics, get_throughput
+from ingest.run_records import set_run_error
 from ingest.test_utils import IngestTestCase
-from ingest.utils import get_current_date
+from ingest.utils import get_current_date, get_allocation_index
 from ingest.vault_parser import UOMVaultParser
 from storage.models import IngestFile
 
 
+REQUEST_METADATA_KEYS = ('REMOTE_ADDR', 'HTTP_USER_AGENT', 'PATH_INFO',
+                         'QUERY_STRING')
+
+
 def get_server_url(request):
     server = request.META['SERVER_NAME']
     port = request.META['SERVER_PORT']
@@ -48,14 +61,31 @@ def parse_date(value, date_format, field_name):
         return None, as_json(get_error_dict(error))
 
 
-def set_run_error(run_record, error):
-    if not run_record:
-        return  # TODO burying an unexpected state? At least log this
-    if run_record.run_error:
-        run_record.run_error = run_record.run_error + error
-    else:
-        run_record.run_error = error
-    run_record.save()
+def parses_streaming():
+    """
+    :return: True if files are parsed in the streaming mode of the
+             IngestParserManager, in which the errors are returned as a
+             summary of counts by category and a sample
+    """
+    return getattr(settings, 'INGEST_STREAMING_PARSE', False)
+
+
+def count_errors(errors):
+    """
+    :param errors: the errors of a parser in an ingest result, a list or an
+                   ErrorSummary dictionary
+    """
+    if isinstance(errors, dict) and 'total' in errors:
+        return errors['total']
+    return len(errors)
+
+
+def get_request_metadata(request):
+    """
+    :return: dictionary of the parts of the request worth keeping with the
+             runs of the ingest it asked for
+    """
+    return {key: request.META.get(key) for key in REQUEST_METADATA_KEYS}
 
 
 def ingest_file(request, file_source, file_type, location):
@@ -74,55 +104,173 @@ def ingest_file(request, file_source, file_type, location):
     except MultiValueDictKeyError:
         return as_json(get_error_dict('fileName: multiple value error'))
 
-    server_url = get_server_url(request)
-    file_url = as_url(file_name, file_source, server_url)
+    user = request.user if request.user.is_authenticated() else None
+    job = IngestJob.objects.create(
+        file_url=as_url(file_name, file_source, get_server_url(request)),
+        file_source=file_source, file_type=file_type, location=location,
+        extract_date=extract_date, user=user,
+        metadata=json.dumps(get_request_metadata(request)))
+    ret_dict = get_success_dict('File ingest queued. ')
+    ret_dict['job_id'] = job.id
+    return as_json(ret_dict)
+
+
+def file_lines(request, file_id):
+    """
+    Returns the lines first to last (both 1 if not given) of a file kept as
+    IngestFileContent
+    """
+    try:
+        content = IngestFileContent.objects.get(ingest_file_id=file_id)
+        first_line = int(request.GET.get('first', 1))
+        last_line = int(request.GET.get('last', first_line))
+    except IngestFileContent.DoesNotExist:
+        return as_json(get_error_dict('No content for ingest file ' +
+                                      str(file_id)))
+    except ValueError:
+        return as_json(get_error_dict('first and last must be line numbers'))
+    ret_dict = get_success_dict('%d lines' % content.line_count)
+    ret_dict['lines'] = get_content_lines(content, first_line, last_line)
+    return as_json(ret_dict)
+
+
+def ingest_throughput(request):
+    """
+    Returns the metrics of the ingest runs summed by day, for the last days
+    (30 if not given), of the parser if one is given
+    """
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        return as_json(get_error_dict('days must be a number'))
+    ret_dict = get_success_dict('Ingest throughput by day')
+    ret_dict['days'] = get_throughput(days, request.GET.get('parser'))
+    return as_json(ret_dict)
+
+
+def run_ingest(file_url, file_type, file_source, extract_date, location,
+               user, metadata, progress=None, fetcher=None):
+    """
+    Fetches the file and runs it through the parsers for its source and type
+    :param progress: handed to the IngestParserManager, see there
+    :param fetcher: the SourceFetcher the file is fetched with, by default
+                    the one of the file source
+    :return: the result dictionary of the ingest
+    """
     try:
         ingest_file_record = get_ingest_file(file_url, file_type,
                                              file_source,
                                              extract_date, location)
         if not ingest_file_record:
-            return as_json(get_success_dict('File Ignored'))
+            return get_success_dict('File Ignored')
 
-        parser_manager = IngestParserManager()
-        parser_list = get_parsers_for_request(extract_date, file_source,
-                                              file_type,
-                                              request.user)
-        parser_errors = {}
-        for p in parser_list:
-            run_record = setup_ingest_file_run(ingest_file_record,
-                                               request.META)
-            parse_valid, error = p.is_parse_valid()
-            if error:
-                set_run_error(run_record, error)
-                continue
-
-            try:
-                in_stream = []
-                for word in urllib.request.urlopen(file_url).readlines():
-                    in_stream.append(word.strip().decode('utf-8'))
-                ingest_row_token_list, parser_errors[
-                    p.__class__.__name__] = parser_manager.parse(in_stream,
-                                                                 run_record, p)
-            except URLError as e:
-                set_run_error(run_record, str(e))
-                parser_errors[p.__class__.__name__]['Error'] = str(e)
-
-        ingest_file_record.completed = True
-        for p in parser_errors:
-            if len(p) > 0:
-                ingest_file_record.completed = False
-                break
-        ingest_file_record.save()
-
-        ret_dict = get_success_dict('File ingest completed. ')
-        ret_dict['errors'] = parser_errors
-        return as_json(ret_dict)
+        # the file is fetched and read once, each line going to all of the
+        # parsers
+        fetched_file, fetch_error = None, None
+        previous_fetch = get_previous_fetch(ingest_file_record)
+        try:
+            fetched_file = FetchedFile(
+                file_url,
+                etag=previous_fetch.etag if previous_fetch else None,
+                last_modified=previous_fetch.last_modified
+                if previous_fetch else None,
+                fetcher=fetcher or get_fetcher(file_source, file_url))
+        except URLError as e:
+            fetch_error = str(e)
+        try:
+            return parse_fetched_file(ingest_file_record, fetched_file,
+                                      fetch_error, previous_fetch, user,
+                                      metadata, progress)
+        finally:
+            if fetched_file:
+                fetched_file.close()
     except ValueError as e:
-        return as_json(
-            get_error_dict('ValueError:Parse Failed: ' + str(e)))
+        return get_error_dict('ValueError:Parse Failed: ' + str(e))
     except Exception as e:
-        return as_json(
-            get_error_dict('Exception:Parse Failed: ' + str(e)))
+        return get_error_dict('Exception:Parse Failed: ' + str(e))
+
+
+def parse_fetched_file(ingest_file_record, fetched_file, fetch_error,
+                       previous_fetch, user, metadata, progress):
+    """
+    :param fetched_file: the FetchedFile, None if the fetch failed
+    :param fetch_error: the error the fetch failed with
+    :param previous_fetch: see get_previous_fetch
+    :return: the result dictionary of the ingest
+    """
+    if fetched_file:
+        if fetched_file.not_modified:
+            ingest_file_record.sha256 = previous_fetch.sha256
+        else:
+            ingest_file_record.sha256 = fetched_file.sha256
+        ingest_file_record.etag = fetched_file.etag
+        ingest_file_record.last_modified = fetched_file.last_modified
+        if fetched_file.not_modified or is_content_ingested(
+                ingest_file_record):
+            ingest_file_record.completed = True
+            ingest_file_record.save()
+            return get_success_dict('File unchanged')
+
+    extract_date = ingest_file_record.extract_date
+    file_source = ingest_file_record.source
+    file_type = ingest_file_record.type
+    store_all_lines = stores_lines_as_rows()
+    streaming = parses_streaming()
+    parser_manager = IngestParserManager(
+        chunk_size=getattr(settings, 'INGEST_CHUNK_SIZE', None),
+        progress=progress, store_all_lines=store_all_lines,
+        streaming=streaming,
+        error_sample_size=getattr(settings, 'INGEST_ERROR_SAMPLE_SIZE', None))
+    parser_list = get_parsers_for_request(extract_date, file_source,
+                                          file_type, user)
+    parser_errors = {}
+    parser_run_list = []
+    for p in parser_list:
+        run_record = setup_ingest_file_run(ingest_file_record, metadata)
+        parse_valid, error = p.is_parse_valid()
+        if error:
+            set_run_error(run_record, error)
+            continue
+        parser_run_list.append((p, run_record))
+
+    resume_after_line = 0
+    if parser_run_list:
+        if fetch_error:
+            for p, run_record in parser_run_list:
+                set_run_error(run_record, fetch_error)
+                parser_errors[p.__class__.__name__] = {'Error': fetch_error}
+        else:
+            if not store_all_lines:
+                store_file_content(ingest_file_record, fetched_file)
+            resume_after_line = get_resume_line(ingest_file_record,
+                                                fetched_file.sha256)
+            for index, (p, run_record) in enumerate(parser_run_list):
+                metrics = RunMetrics(p.__class__.__name__)
+                if index == 0:
+                    # the file is fetched once for all of its parsers
+                    metrics.add_fetch(fetched_file)
+                run_record.metrics = metrics.to_json()
+                run_record.checksum = fetched_file.sha256
+                run_record.save(update_fields=['metrics', 'checksum'])
+            results = parser_manager.parse_fan_out(
+                fetched_file.lines(), parser_run_list, resume_after_line)
+            for (p, run_record), result in zip(parser_run_list, results):
+                ingest_row_token_list, errors = result
+                parser_errors[p.__class__.__name__] = \
+                    errors.as_dict() if streaming else errors
+
+    ingest_file_record.completed = not any(
+        count_errors(errors) for errors in parser_errors.values())
+    ingest_file_record.save()
+
+    ret_dict = get_success_dict('File ingest completed. ')
+    ret_dict['errors'] = parser_errors
+    ret_dict['collections_updated'] = {
+        p.__class__.__name__: p.updated_collection_ids
+        for p, run_record in parser_run_list}
+    if resume_after_line:
+        ret_dict['resumed_after_line'] = resume_after_line
+    return ret_dict
 
 
 def get_ingest_file(url, file_type, source, extract_date,
@@ -153,6 +301,45 @@ def get_ingest_file(url, file_type, source, extract_date,
     return row
 
 
+def get_previous_fetch(ingest_file_record):
+    """
+    :return: the latest IngestFile of the same extract date fetched from the
+             same url whose content was parsed to completion, or None. The
+             parsers date the readings with the extract date, so the file of
+             another date must be parsed even if it is unchanged.
+    """
+    return IngestFile.objects.filter(
+        url=ingest_file_record.url, type=ingest_file_record.type,
+        source=ingest_file_record.source,
+        extract_date=ingest_file_record.extract_date, sha256__isnull=False,
+        ingest_runs__completed=True).order_by('-id').first()
+
+
+def is_content_ingested(ingest_file_record):
+    """
+    :return: True if a file of the same source, type and extract date with
+             content identical to that of ingest_file_record was parsed to
+             completion
+    """
+    return IngestFileRun.objects.filter(
+        checksum=ingest_file_record.sha256, completed=True,
+        parent__type=ingest_file_record.type,
+        parent__source=ingest_file_record.source,
+        parent__extract_date=ingest_file_record.extract_date).exists()
+
+
+def get_resume_line(ingest_file_record, checksum):
+    """
+    :return: the line an interrupted earlier run of the same content was
+             committed through, or 0 if the file must be parsed from the start
+    """
+    last_run = ingest_file_record.ingest_runs.filter(
+        checksum=checksum).order_by('-id').first()
+    if last_run and not last_run.completed:
+        return last_run.committed_line
+    return 0
+
+
 def setup_ingest_file_run(ingest_file_record, metadata):
     runRecord = IngestFileRun()
     runRecord.parent = ingest_file_record
@@ -161,30 +348,43 @@ def setup_ingest_file_run(ingest_file_record, metadata):
     return runRecord
 
 
-def as_url(file_name, file_source, server_url):
-    result = server_url + '/static/market/'
-    source = file_source.upper()
-    if source == 'UOM':
-        result = 'https://swift.rc.nectar.org.au/' \
-                 'v1/AUTH_c84359b1de24472bab55ac28607feae4/vicnode_report/'
-    elif source == 'MON':
-        result = 'file:///mnt/sonasrpt/market/'
-    else:
-        pass  # TODO This is unexpected. Surely we should do something?
-    return result + file_name
-
-
-def get_parsers_for_request(extract_date, file_source, file_type, user):
+def get_parser_classes(file_source, file_type):
+    """
+    :return: list of the parser classes the files of file_source and
+             file_type are parsed with, None if they are not parsed
+    """
     file_source_lower = file_source.lower()
     file_type_lower = file_type.lower()
     # we ignore 'mon' and 'mox'
     if file_source_lower == 'uom':
         if file_type_lower == 'm':
-            return [UOMMarketParser(extract_date, user)]
+            return [UOMMarketParser]
         elif file_type_lower == 'c':
-            return [UOMComputeParser(extract_date, user),
-                    UOMVaultParser(extract_date, user)]
-    return [NotImplementedParser(get_current_date(), user)]
+            return [UOMComputeParser, UOMVaultParser]
+    return None
+
+
+def appends_rows(file_source, file_type):
+    """
+    :return: True if a parser of the files of file_source and file_type adds
+             their rows to those already stored, so that ingesting a file
+             again would count its rows twice
+    """
+    return any(parser_class.APPENDS_ROWS for parser_class in
+               get_parser_classes(file_source, file_type) or [])
+
+
+def get_parsers_for_request(extract_date, file_source, file_type, user):
+    parser_classes = get_parser_classes(file_source, file_type)
+    if not parser_classes:
+        return [NotImplementedParser(get_current_date(), user)]
+    parser_list = [parser_class(extract_date, user)
+                   for parser_class in parser_classes]
+    if len(parser_list) > 1:
+        allocation_index = get_allocation_index()
+        for p in parser_list:
+            p.allocation_index = allocation_index
+    return parser_list
 
 
 ##########################################################
@@ -238,3 +438,58 @@ class ParseFileTestCase(IngestTestCase):
                              'by setup_ingest_file_run method')
         except IngestFile.DoesNotExist:
             self.assertEqual(1, 2, 'New file not added to IngestFile table')
+
+    def test_get_resume_line(self):
+        _ingest_file = get_ingest_file('someMonashMarketFile', 'M', 'MON',
+                                       get_current_date(), 1)
+        self.assertEqual(get_resume_line(_ingest_file, 'abc'), 0)
+        IngestFileRun.objects.create(parent=_ingest_file, checksum='abc',
+                                     committed_line=500)
+        self.assertEqual(get_resume_line(_ingest_file, 'abc'), 500)
+        self.assertEqual(get_resume_line(_ingest_file, 'def'), 0)
+        IngestFileRun.objects.create(parent=_ingest_file, checksum='abc',
+                                     committed_line=800, completed=True)
+        self.assertEqual(get_resume_line(_ingest_file, 'abc'), 0)
+
+    def test_unchanged_content_is_not_parsed_again(self):
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as f:
+            f.write('line 1\nline 2\n')
+        url = 'file://' + path
+        try:
+            result = run_ingest(url, 'M', 'ABC', get_current_date(), 1,
+                                None, '')
+            self.assertEqual(result['message'], 'File ingest completed. ')
+            run_count = IngestFileRun.objects.count()
+            # reopened, as the directory watcher does for a file touched
+            # without its content changing
+            IngestFile.objects.update(completed=False)
+            result = run_ingest(url, 'M', 'ABC', get_current_date(), 1,
+                                None, '')
+            self.assertEqual(result['message'], 'File unchanged')
+            self.assertEqual(IngestFileRun.objects.count(), run_count)
+            # the readings of another date come from parsing the file again
+            result = run_ingest(url, 'M', 'ABC',
+                                get_current_date() - timedelta(days=1), 1,
+                                None, '')
+            self.assertEqual(result['message'], 'File ingest completed. ')
+            self.assertEqual(IngestFileRun.objects.count(), run_count + 1)
+            self.assertEqual(IngestFile.objects.filter(
+                sha256__isnull=False).count(), 2)
+        finally:
+            os.remove(path)
+
+    @override_settings(INGEST_RAW_LINE_STORAGE='compressed')
+    def test_content_is_kept_compressed(self):
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as f:
+            f.write('line 1\nline 2\n')
+        try:
+            run_ingest('file://' + path, 'M', 'ABC', get_current_date(), 1,
+                       None, '')
+        finally:
+            os.remove(path)
+        content = IngestFileContent.objects.get()
+        self.assertEqual(content.line_count, 2)
+        self.assertEqual(get_content_lines(content, 1, 2),
+                         {1: 'line 1', 2: 'line 2'})
@@ -0,0 +1,160 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, connection
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+
+from ingest.file_parse import as_json, get_error_dict, run_ingest, \
+    count_errors
+from ingest.models import IngestJob
+from ingest.test_utils import IngestTestCase
+from ingest.utils import get_current_date
+
+
+def requeue_stale_jobs(stale_seconds=None):
+    """
+    Puts the running jobs that have not reported progress for stale_seconds
+    back in the queue, as the worker running them has died. Their ingest
+    resumes from the last line it committed. Jobs started
+    INGEST_JOB_MAX_ATTEMPTS times already are failed instead.
+    :param stale_seconds: defaults to INGEST_JOB_STALE_SECONDS, 0 never
+                          requeues jobs
+    :return: tuple (number of jobs requeued, number of jobs failed)
+    """
+    if stale_seconds is None:
+        stale_seconds = getattr(settings, 'INGEST_JOB_STALE_SECONDS', 3600)
+    if not stale_seconds:
+        return 0, 0
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=stale_seconds)
+    stale = IngestJob.objects.filter(
+        Q(progressed__lt=cutoff) |
+        Q(progressed__isnull=True, started__lt=cutoff),
+        status=IngestJob.RUNNING)
+    max_attempts = getattr(settings, 'INGEST_JOB_MAX_ATTEMPTS', 3)
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=IngestJob.FAILED, finished=now, result=json.dumps(
+            get_error_dict('Exception:Parse Failed: the job stopped '
+                           'without finishing %d times' % max_attempts)))
+    requeued = stale.update(status=IngestJob.QUEUED)
+    return requeued, failed
+
+
+def claim_next_job(stale_seconds=None):
+    """
+    Marks the oldest queued job as running, so that no other worker takes it.
+    Stale running jobs are queued again first, see requeue_stale_jobs.
+    :return: the job claimed, or None if the queue is empty
+    """
+    requeue_stale_jobs(stale_seconds)
+    with transaction.atomic():
+        queued = IngestJob.objects.filter(status=IngestJob.QUEUED)
+        if connection.features.has_select_for_update_skip_locked:
+            queued = queued.select_for_update(skip_locked=True)
+        job = queued.order_by('created', 'id').first()
+        if job:
+            job.status = IngestJob.RUNNING
+            job.started = job.progressed = timezone.now()
+            job.attempts += 1
+            job.save()
+    return job
+
+
+def run_job(job):
+    """
+    Runs the ingest of a claimed job, recording its progress and result
+    against the job as it goes
+    """
+    def progress(lines_processed):
+        IngestJob.objects.filter(pk=job.pk).update(
+            lines_processed=lines_processed, progressed=timezone.now())
+
+    result = run_ingest(job.file_url, job.file_type, job.file_source,
+                        job.extract_date, job.location, job.user,
+                        job.metadata, progress)
+    job.refresh_from_db(fields=['lines_processed'])
+    job.error_count = sum(count_errors(errors) for errors in
+                          result.get('errors', {}).values())
+    job.status = IngestJob.DONE if result['success'] else IngestJob.FAILED
+    job.result = json.dumps(result)
+    job.finished = timezone.now()
+    job.save()
+    return job
+
+
+def get_job_status(job):
+    status = {'job_id': job.id,
+              'status': job.get_status_display(),
+              'file_url': job.file_url,
+              'created': job.created.isoformat(),
+              'started': job.started.isoformat() if job.started else None,
+              'finished': job.finished.isoformat() if job.finished else None,
+              'lines_processed': job.lines_processed,
+              'error_count': job.error_count}
+    if job.result:
+        status['result'] = json.loads(job.result)
+    return status
+
+
+def job_status(request, job_id):
+    try:
+        job = IngestJob.objects.get(pk=job_id)
+    except IngestJob.DoesNotExist:
+        return as_json(get_error_dict('No ingest job ' + str(job_id)))
+    return as_json(get_job_status(job))
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestJobTestCase(IngestTestCase):
+    def create_job(self):
+        return IngestJob.objects.create(
+            file_url='file:///dev/null',
+            file_source='ABC', file_type='M', location=1,
+            extract_date=get_current_date())
+
+    def test_jobs_are_claimed_in_order(self):
+        jobs = [self.create_job() for _ in range(2)]
+        self.assertEqual(claim_next_job(), jobs[0])
+        self.assertEqual(IngestJob.objects.get(pk=jobs[0].pk).status,
+                         IngestJob.RUNNING)
+        self.assertEqual(claim_next_job(), jobs[1])
+        self.assertEqual(claim_next_job(), None)
+
+    def test_status_reports_result(self):
+        self.create_job()
+        job = run_job(claim_next_job())
+        status = get_job_status(job)
+        self.assertEqual(status['status'], 'Done')
+        self.assertEqual(status['result']['success'], True)
+        self.assertNotEqual(status['finished'], None)
+
+    def test_stale_jobs_are_requeued(self):
+        jobs = [self.create_job() for _ in range(3)]
+        for job in jobs:
+            claim_next_job()
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        IngestJob.objects.filter(pk=jobs[0].pk).update(progressed=an_hour_ago)
+        IngestJob.objects.filter(pk=jobs[1].pk).update(progressed=an_hour_ago,
+                                                       attempts=3)
+        with self.settings(INGEST_JOB_MAX_ATTEMPTS=3):
+            self.assertEqual(requeue_stale_jobs(600), (1, 1))
+            self.assertEqual(requeue_stale_jobs(0), (0, 0))
+            job = claim_next_job(600)
+        self.assertEqual((job, job.attempts), (jobs[0], 2))
+        statuses = [IngestJob.objects.get(pk=job.pk).status for job in jobs]
+        self.assertEqual(statuses, [IngestJob.RUNNING, IngestJob.FAILED,
+                                    IngestJob.RUNNING])
+
+    def test_status_is_served(self):
+        job = self.create_job()
+        response = self.client.get(reverse('ingest_job_status',
+                                           args=[job.pk]))
+        self.assertEqual(json.loads(response.content.decode())['status'],
+                         'Queued')
@@ -0,0 +1,249 @@
+from decimal import Decimal
+
+from django.db import connection, transaction, DatabaseError
+
+from ingest.test_utils import IngestTestCase, create_storage_product
+from ingest.utils import get_current_date
+from storage.models import Ingest, Collection
+
+# the unique_together of the Ingest model
+CONFLICT_FIELDS = ('extraction_date', 'collection', 'storage_product')
+VALUE_FIELDS = ('allocated_capacity', 'used_capacity', 'used_replica')
+
+DATA_EXISTS_ERROR = 'ingest row fail: Data exists in DB'
+APPEND_SUCCESSFUL = 'Append successful'
+
+
+def get_ingest_key(ingest):
+    """
+    :return: the (extraction_date, collection_id, storage_product_id) tuple
+             identifying the ingest
+    """
+    date_field = Ingest._meta.get_field('extraction_date')
+    return (date_field.to_python(ingest.extraction_date),
+            ingest.collection_id, ingest.storage_product_id)
+
+
+def build_upsert_sql(row_count, conflict_action):
+    """
+    :param row_count: the number of rows in the VALUES list
+    :param conflict_action: the ON CONFLICT action, e.g. 'DO NOTHING'
+    :return: an INSERT ... ON CONFLICT statement for the ingest table that
+             returns the key of every row it inserted or updated
+    """
+    qn = connection.ops.quote_name
+    fields = [Ingest._meta.get_field(f) for f in
+              CONFLICT_FIELDS + VALUE_FIELDS]
+    row_values = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    conflict_columns = ', '.join(qn(f.column) for f in fields[:3])
+    return 'INSERT INTO {table} ({columns}) VALUES {values} ' \
+           'ON CONFLICT ({conflict_columns}) {action} ' \
+           'RETURNING {id}, {conflict_columns}'.format(
+                table=qn(Ingest._meta.db_table),
+                columns=', '.join(qn(f.column) for f in fields),
+                values=', '.join([row_values] * row_count),
+                conflict_columns=conflict_columns,
+                action=conflict_action,
+                id=qn(Ingest._meta.pk.column))
+
+
+def get_upsert_params(ingest_list):
+    params = []
+    for ingest in ingest_list:
+        for field_name in CONFLICT_FIELDS + VALUE_FIELDS:
+            field = Ingest._meta.get_field(field_name)
+            params.append(field.get_db_prep_save(
+                getattr(ingest, field.attname), connection))
+    return params
+
+
+def execute_upsert(ingest_list, conflict_action):
+    """
+    :return: a dictionary of the ids of the rows written, keyed by ingest key
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(build_upsert_sql(len(ingest_list), conflict_action),
+                       get_upsert_params(ingest_list))
+        return {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+
+
+class IngestRowWriter:
+    """
+    Buffers extracted Ingest rows and inserts them in batches with
+    INSERT ... ON CONFLICT DO NOTHING against the unique_together of the
+    Ingest model. A row the database reports as conflicting gets the same
+    'Data exists in DB' outcome as a row found by a lookup before saving.
+    """
+    DEFAULT_BATCH_SIZE = 500
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        self.pending_rows = []
+
+    def add(self, extracted_ingest, context=None):
+        """
+        :param extracted_ingest: the unsaved Ingest to be written
+        :param context: handed back with the row's outcome by flush
+        """
+        self.pending_rows.append((extracted_ingest, context))
+
+    def clear(self):
+        self.pending_rows = []
+
+    def flush(self):
+        """
+        :return: list of (ingest, context, success, error_message) for each
+                 buffered row, in the order the rows were added
+        """
+        pending_rows, self.pending_rows = self.pending_rows, []
+        results = []
+        for start in range(0, len(pending_rows), self.batch_size):
+            batch = pending_rows[start:start + self.batch_size]
+            try:
+                with transaction.atomic():
+                    results.extend(self._write_batch(batch))
+            except DatabaseError:
+                # find the offending rows by writing the batch row by row
+                for row in batch:
+                    try:
+                        with transaction.atomic():
+                            results.extend(self._write_batch([row]))
+                    except DatabaseError as e:
+                        results.append((row[0], row[1], False,
+                                        'Error persisting data ' + str(e)))
+        return results
+
+    @staticmethod
+    def _write_batch(batch):
+        inserted_ids = execute_upsert([ingest for ingest, _ in batch],
+                                      'DO NOTHING')
+        results = []
+        for ingest, context in batch:
+            # the first of several rows with the same key is the one inserted
+            ingest_id = inserted_ids.pop(get_ingest_key(ingest), None)
+            if ingest_id:
+                ingest.id = ingest_id
+                results.append((ingest, context, True, None))
+            else:
+                results.append((ingest, context, False, DATA_EXISTS_ERROR))
+        return results
+
+
+class IngestRowAggregator:
+    """
+    Sums the capacities of the extracted rows that share an ingest key (the
+    primary and replica volumes of a market tenant), and writes the totals in
+    batches with INSERT ... ON CONFLICT DO UPDATE, which adds them to the
+    values of any row already in the database. Has the same interface as
+    IngestRowWriter.
+    """
+    DEFAULT_BATCH_SIZE = 500
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        # key -> (Ingest holding the totals, [(ingest, context) summed])
+        self.totals = {}
+
+    def add(self, extracted_ingest, context=None):
+        key = get_ingest_key(extracted_ingest)
+        if key not in self.totals:
+            total = Ingest(extraction_date=key[0],
+                           collection_id=extracted_ingest.collection_id,
+                           storage_product_id=key[2],
+                           allocated_capacity=Decimal(0),
+                           used_capacity=Decimal(0),
+                           used_replica=Decimal(0))
+            self.totals[key] = (total, [])
+        total, rows = self.totals[key]
+        for field_name in VALUE_FIELDS:
+            value = getattr(extracted_ingest, field_name)
+            if value:
+                setattr(total, field_name,
+                        getattr(total, field_name) + Decimal(value))
+        rows.append((extracted_ingest, context))
+
+    def clear(self):
+        self.totals = {}
+
+    def flush(self):
+        """
+        :return: list of (ingest, context, success, error_message) for each
+                 added row. The first row of a key not yet in the database has
+                 no message, the rows added to an existing one are reported as
+                 'Append successful'.
+        """
+        totals, self.totals = list(self.totals.values()), {}
+        results = []
+        for start in range(0, len(totals), self.batch_size):
+            batch = totals[start:start + self.batch_size]
+            try:
+                with transaction.atomic():
+                    results.extend(self._write_batch(batch))
+            except DatabaseError:
+                for total in batch:
+                    try:
+                        with transaction.atomic():
+                            results.extend(self._write_batch([total]))
+                    except DatabaseError as e:
+                        results.extend(
+                            (ingest, context, False,
+                             'ingest row update fail: ' + str(e))
+                            for ingest, context in total[1])
+        return results
+
+    @staticmethod
+    def _write_batch(batch):
+        table = connection.ops.quote_name(Ingest._meta.db_table)
+        update = ', '.join(
+            '{col} = COALESCE({table}.{col}, 0) + EXCLUDED.{col}'.format(
+                table=table,
+                col=connection.ops.quote_name(
+                    Ingest._meta.get_field(f).column))
+            for f in VALUE_FIELDS)
+        totals = [total for total, _ in batch]
+        existing_keys = set(Ingest.objects.filter(
+            extraction_date__in={t.extraction_date for t in totals},
+            collection_id__in={t.collection_id for t in totals},
+            storage_product_id__in={t.storage_product_id for t in totals}
+        ).values_list('extraction_date', 'collection_id',
+                      'storage_product_id'))
+        execute_upsert(totals, 'DO UPDATE SET ' + update)
+        results = []
+        for total, rows in batch:
+            message = APPEND_SUCCESSFUL if get_ingest_key(
+                total) in existing_keys else None
+            for ingest, context in rows:
+                results.append((ingest, context, True, message))
+                message = APPEND_SUCCESSFUL
+        return results
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestRowWriterTestCase(IngestTestCase):
+    def setUp(self):
+        self.collections = [Collection.objects.create(name='Test %s' % i)
+                            for i in range(2)]
+        self.product = create_storage_product('Market.Melbourne')
+
+    def get_ingest(self, item_num):
+        return Ingest(extraction_date=get_current_date(),
+                      collection=self.collections[item_num],
+                      storage_product=self.product,
+                      allocated_capacity=10, used_capacity=3, used_replica=1)
+
+    def test_existing_rows_are_reported(self):
+        self.get_ingest(0).save()
+        writer = IngestRowWriter()
+        for context, item_num in enumerate([0, 1, 1]):
+            writer.add(self.get_ingest(item_num), context)
+        results = writer.flush()
+        self.assertEqual([(r[1], r[2], r[3]) for r in results],
+                         [(0, False, DATA_EXISTS_ERROR), (1, True, None),
+                          (2, False, DATA_EXISTS_ERROR)])
+        self.assertEqual(Ingest.objects.count(), 2)
+        self.assertEqual(Ingest.objects.get(
+            collection=self.collections[1]).id, results[1][0].id)
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from ingest.batch_ingest import parse_date_argument, ingest_all, \
+    write_results
+from ingest.fetchers import as_url, DEFAULT_SOURCE_PATH
+from ingest.file_parse import run_ingest
+from ingest.test_utils import IngestTestCase
+from storage.models import IngestFile
+
+
+class Command(BaseCommand):
+    help = 'Ingests the files of a range of dates, several at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='the file source, e.g. UOM')
+        parser.add_argument('location', type=int, help='the data hall')
+        parser.add_argument('type', help='the file type, e.g. M or C')
+        parser.add_argument('start_date', help='first date, YYYYMMDD')
+        parser.add_argument('end_date', help='last date, YYYYMMDD')
+        parser.add_argument('--file-name', required=True,
+                            help='strftime pattern of the file name of a '
+                                 'date, e.g. market_%%Y%%m%%d.csv')
+        parser.add_argument('--server-url', default='http://localhost:8000',
+                            help='used for sources served by this server')
+        parser.add_argument('--processes', type=int, default=4)
+
+    def handle(self, *args, **options):
+        start_date = parse_date_argument(options['start_date'])
+        end_date = parse_date_argument(options['end_date'])
+        if end_date < start_date:
+            raise CommandError('end_date is before start_date')
+        source, file_type = options['source'], options['type']
+        location = options['location']
+
+        files = []
+        extract_date = start_date
+        while extract_date <= end_date:
+            file_name = extract_date.strftime(options['file_name'])
+            files.append((extract_date,
+                          as_url(file_name, source, options['server_url']),
+                          file_type, source, extract_date, location,
+                          'backfill'))
+            extract_date += timedelta(days=1)
+
+        # one query finds the dates ingested to completion already
+        completed = set(IngestFile.objects.filter(
+            url__in=[f[1] for f in files], type=file_type, source=source,
+            extract_date__range=(start_date, end_date),
+            completed=True).values_list('url', 'extract_date'))
+        pending = [f for f in files if (f[1], f[4]) not in completed]
+
+        start = time.time()
+        results = ingest_all(pending, options['processes'])
+        write_results(self.stdout, 'Date', sorted(results),
+                      time.time() - start, len(files) - len(pending))
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestBackfillCommandTestCase(IngestTestCase):
+    def setUp(self):
+        self.server_dir = tempfile.mkdtemp()
+        os.makedirs(self.server_dir + DEFAULT_SOURCE_PATH)
+        self.server_url = 'file://' + self.server_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.server_dir)
+
+    def test_completed_dates_are_skipped(self):
+        extract_date = datetime(2017, 3, 1).date()
+        file_name = extract_date.strftime('market_%Y%m%d.csv')
+        open(self.server_dir + DEFAULT_SOURCE_PATH + file_name, 'w').close()
+        result = run_ingest(as_url(file_name, 'ABC', self.server_url), 'M',
+                            'ABC', extract_date, 1, None, '')
+        self.assertEqual(result['errors'], {'NotImplementedParser': []})
+        self.assertTrue(IngestFile.objects.get().completed)
+        out = StringIO()
+        call_command('ingest_backfill', 'ABC', '1', 'M', '20170301',
+                     '20170301', '--file-name=market_%Y%m%d.csv',
+                     server_url=self.server_url, processes=1, stdout=out)
+        self.assertIn('0 files ingested, 0 failed, 1 skipped as completed',
+                      out.getvalue())
@@ -0,0 +1,100 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ingest.benchmark import generate_compute_lines, generate_market_lines, \
+    create_benchmark_fixtures, run_benchmark
+from ingest.compute_parser import UOMComputeParser
+from ingest.market_parser import UOMMarketParser
+from ingest.test_utils import IngestTestCase
+from ingest.vault_parser import UOMVaultParser
+from storage.models import Collection
+
+
+class Command(BaseCommand):
+    help = 'Parses generated UOM compute, vault and market files and ' \
+           'reports the ingest throughput. Everything written is rolled ' \
+           'back at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='the number of rows of each file')
+        parser.add_argument('--tenants', type=int,
+                            help='the number of tenants the rows are spread '
+                                 'over, one collection each, defaults to '
+                                 'the number of rows')
+        parser.add_argument('--error-rate', type=float, default=0.01,
+                            help='the share of the rows with an error')
+        parser.add_argument('--repl-ratio', type=float, default=0.5,
+                            help='the share of the market rows that are '
+                                 'replicas')
+        parser.add_argument('--chunk-size', type=int,
+                            help='the lines parsed between checkpoints')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--streaming', action='store_true',
+                            help='parse in streaming mode, keeping no '
+                                 'tokens and only a sample of the errors')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='measure the peak memory allocated while '
+                                 'parsing, which slows parsing down')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        tenants = options['tenants'] or rows
+        if rows < 1 or tenants < 1:
+            raise CommandError('--rows and --tenants must be positive')
+        if not 0 <= options['error_rate'] <= 1 or \
+                not 0 <= options['repl_ratio'] <= 1:
+            raise CommandError('--error-rate and --repl-ratio must be '
+                               'between 0 and 1')
+        compute_lines = list(generate_compute_lines(
+            rows, tenants, options['error_rate'], options['seed']))
+        market_lines = list(generate_market_lines(
+            rows, tenants, options['error_rate'], options['repl_ratio'],
+            options['seed']))
+
+        results = []
+        with transaction.atomic():
+            create_benchmark_fixtures(tenants)
+            for parser_class, lines in ((UOMComputeParser, compute_lines),
+                                        (UOMVaultParser, compute_lines),
+                                        (UOMMarketParser, market_lines)):
+                results.append(run_benchmark(parser_class, lines,
+                                             options['chunk_size'],
+                                             options['trace_memory'],
+                                             options['streaming']))
+            transaction.set_rollback(True)
+
+        self.stdout.write('%-18s  %8s  %6s  %8s  %9s  %11s  %10s' % (
+            'Parser', 'Rows', 'Errors', 'Seconds', 'Rows/s', 'Queries/row',
+            'Peak KB'))
+        for result in results:
+            peak_kb = result['max_rss_kb'] if result['peak_memory'] is None \
+                else result['peak_memory'] // 1024
+            self.stdout.write('%-18s  %8d  %6d  %8.2f  %9.0f  %11.2f  %10d' % (
+                result['parser'], result['rows'], result['errors'],
+                result['seconds'], result['rows_per_second'],
+                result['queries_per_row'], peak_kb))
+        if not options['trace_memory']:
+            self.stdout.write('Peak KB is the maximum resident size of the '
+                              'process, --trace-memory measures each parser')
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestBenchmarkCommandTestCase(IngestTestCase):
+    def test_each_parser_is_reported(self):
+        out = StringIO()
+        call_command('ingest_benchmark', rows=20, tenants=5, stdout=out)
+        report = out.getvalue().splitlines()
+        self.assertEqual([line.split()[:2] for line in report[1:4]],
+                         [['UOMComputeParser', '20'],
+                          ['UOMVaultParser', '20'],
+                          ['UOMMarketParser', '20']])
+        # the fixtures are rolled back
+        self.assertEqual(Collection.objects.count(), 0)
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from ingest.reading_writer import compact_ingests
+from ingest.test_utils import IngestTestCase, create_storage_product
+from ingest.utils import get_current_date
+from storage.models import Ingest, IngestReading, Collection
+
+
+class Command(BaseCommand):
+    help = 'Moves the daily Ingest rows into IngestReading ranges, which ' \
+           'only keep a reading when it changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before',
+                            help='only move the rows dated before this date, '
+                                 'YYYYMMDD, defaults to today')
+        parser.add_argument('--collection', type=int, action='append',
+                            help='only move the rows of this collection id, '
+                                 'can be given more than once')
+
+    def handle(self, *args, **options):
+        before = get_current_date()
+        if options['before']:
+            try:
+                before = datetime.strptime(options['before'],
+                                           '%Y%m%d').date()
+            except ValueError:
+                raise CommandError('%s is not a date (format: YYYYMMDD)' %
+                                   options['before'])
+        moved, replaced = compact_ingests(before, options['collection'])
+        self.stdout.write('%d Ingest rows moved into ranges, %d of them '
+                          'replacing the reading of their date' % (moved,
+                                                                   replaced))
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestCompactReadingsCommandTestCase(IngestTestCase):
+    def test_rows_before_the_date_are_moved(self):
+        collection = Collection.objects.create(name='Test')
+        product = create_storage_product('Market.Melbourne')
+        start = datetime(2017, 3, 1).date()
+        for day in range(3):
+            Ingest.objects.create(
+                extraction_date=start + timedelta(days=day),
+                collection=collection, storage_product=product,
+                allocated_capacity=10, used_capacity=1, used_replica=0)
+        out = StringIO()
+        call_command('ingest_compact_readings', before='20170303',
+                     collection=[collection.id], stdout=out)
+        self.assertIn('2 Ingest rows moved into ranges, 0 of them',
+                      out.getvalue())
+        reading = IngestReading.objects.get()
+        self.assertEqual((reading.valid_from, reading.valid_to),
+                         (start, start + timedelta(days=1)))
+        self.assertEqual(Ingest.objects.count(), 1)
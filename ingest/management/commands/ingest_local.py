@@ -0,0 +1,130 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from ingest.batch_ingest import parse_date_argument, ingest_timed, \
+    ingest_all, write_results
+from ingest.directory_watch import FilePattern, DEFAULT_DATE_FORMAT
+from ingest.fetchers import StreamFetcher
+from ingest.test_utils import IngestTestCase
+from storage.models import IngestFile
+
+STDIN = '-'
+
+
+class Command(BaseCommand):
+    help = 'Ingests files from the local file system, or standard input, ' \
+           'without going through the ingest url'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='the file source, e.g. UOM')
+        parser.add_argument('location', type=int, help='the data hall')
+        parser.add_argument('type', help='the file type, e.g. M or C')
+        parser.add_argument('paths', nargs='+',
+                            help='files or glob patterns of files, - reads '
+                                 'a file from standard input')
+        parser.add_argument('--extract-date',
+                            help='the extract date of the files, YYYYMMDD')
+        parser.add_argument('--name-pattern',
+                            help='regular expression the file names are '
+                                 'matched with instead, whose named group '
+                                 '"date" is the extract date')
+        parser.add_argument('--date-format', default=DEFAULT_DATE_FORMAT,
+                            help='the format of the date in the file names')
+        parser.add_argument('--name', default='stdin',
+                            help='the name the file read from standard '
+                                 'input is recorded under')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='the files ingested at once')
+
+    def get_files(self, options):
+        """
+        :return: list of the arguments of ingest_timed for each file
+        """
+        source = options['source'].upper()
+        file_type, location = options['type'], options['location']
+        extract_date = parse_date_argument(options['extract_date']) \
+            if options['extract_date'] else None
+        pattern = FilePattern(options['name_pattern'], file_type, source,
+                              location, options['date_format']) \
+            if options['name_pattern'] else None
+        if not extract_date and not pattern:
+            raise CommandError('Give either --extract-date or '
+                               '--name-pattern')
+
+        files = []
+        for path in options['paths']:
+            if path == STDIN:
+                if not extract_date:
+                    raise CommandError('Standard input needs --extract-date')
+                files.append((STDIN, 'stdin:///' + options['name'],
+                              file_type, source, extract_date, location,
+                              'local'))
+                continue
+            matches = sorted(glob.glob(path))
+            if not matches:
+                raise CommandError('No file matches ' + path)
+            for match in matches:
+                if extract_date:
+                    values = {'type': file_type, 'source': source,
+                              'location': location,
+                              'extract_date': extract_date}
+                else:
+                    values = pattern.match(os.path.basename(match))
+                    if not values:
+                        raise CommandError('%s does not match --name-pattern'
+                                           % match)
+                files.append((match, Path(match).resolve().as_uri(),
+                              values['type'], values['source'],
+                              values['extract_date'], values['location'],
+                              'local'))
+        if len([f for f in files if f[0] == STDIN]) > 1:
+            raise CommandError('Standard input can only be read once')
+        # a file given twice is ingested once
+        return list(dict((f[1:], f) for f in files).values())
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+        files = self.get_files(options)
+
+        start = time.time()
+        results = []
+        for args in [f for f in files if f[0] == STDIN]:
+            results.append(ingest_timed(
+                *args, fetcher=StreamFetcher(sys.stdin.buffer)))
+        results += ingest_all([f for f in files if f[0] != STDIN],
+                              options['workers'])
+        write_results(self.stdout, 'File', results, time.time() - start)
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestLocalCommandTestCase(IngestTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_files_are_ingested(self):
+        file_path = os.path.join(self.path, 'market.csv')
+        open(file_path, 'w').close()
+        out = StringIO()
+        call_command('ingest_local', 'ABC', '1', 'M', file_path,
+                     extract_date='20170301', stdout=out)
+        ingest_file = IngestFile.objects.get()
+        self.assertEqual(ingest_file.url, Path(file_path).resolve().as_uri())
+        self.assertEqual(ingest_file.source, 'ABC')
+        self.assertIn('1 files ingested, 0 failed.', out.getvalue())
@@ -0,0 +1,100 @@
+import os
+from datetime import date
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from ingest.models import IngestFileData, IngestFileRun
+from ingest.retention import supports_partitioning, is_partitioned, \
+    partition_data_table, create_partitions, prune_raw_data, add_months, \
+    month_start, set_extract_dates
+from ingest.test_utils import IngestTestCase
+from ingest.utils import get_current_date
+from storage.models import IngestFile
+
+
+class Command(BaseCommand):
+    help = 'Partitions the raw ingest lines by extract month, and removes ' \
+           'the raw data of the files older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partition', action='store_true',
+            help='convert the raw line table to a partitioned table '
+                 '(Postgres 11 and later)')
+        parser.add_argument(
+            '--months-ahead', type=int, default=3,
+            help='the number of monthly partitions to create ahead of the '
+                 'current month, if the table is partitioned')
+        parser.add_argument(
+            '--max-age-months', type=int,
+            default=getattr(settings, 'INGEST_RAW_LINE_RETENTION_MONTHS', 0),
+            help='remove the raw data of files extracted before this many '
+                 'months ago, 0 keeps everything')
+        parser.add_argument(
+            '--archive-dir',
+            help='write the raw lines of each month removed to a csv.gz file '
+                 'in this directory first')
+
+    def handle(self, *args, **options):
+        if options['archive_dir'] and not os.path.isdir(
+                options['archive_dir']):
+            raise CommandError(options['archive_dir'] + ' is not a directory')
+        this_month = month_start(get_current_date())
+
+        updated = set_extract_dates()
+        if updated:
+            self.stdout.write('Set the extract date of %d raw lines' %
+                              updated)
+
+        if options['partition']:
+            if not supports_partitioning():
+                raise CommandError('The database does not support table '
+                                   'partitioning, rows are deleted instead')
+            if is_partitioned():
+                self.stdout.write('The raw line table is already partitioned')
+            else:
+                partition_data_table()
+                self.stdout.write('Partitioned the raw line table')
+
+        if is_partitioned():
+            months, moved = create_partitions(this_month,
+                                              options['months_ahead'] + 1)
+            for month, rows in sorted(moved.items()):
+                self.stdout.write('Moved %d lines of %s out of the default '
+                                  'partition' % (rows,
+                                                 month.strftime('%Y-%m')))
+            self.stdout.write('Partitions in place up to %s' % months[-1])
+
+        if options['max_age_months'] > 0:
+            cutoff_month = add_months(this_month, -options['max_age_months'])
+            for month, rows in prune_raw_data(cutoff_month,
+                                              options['archive_dir']):
+                self.stdout.write('Removed %s%s' % (
+                    month.strftime('%Y-%m'),
+                    '' if rows is None else ', %d lines' % rows))
+            self.stdout.write('Raw data before %s removed' % cutoff_month)
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestRetentionCommandTestCase(IngestTestCase):
+    def test_old_raw_lines_are_removed(self):
+        extract_date = date(2017, 1, 31)
+        run = IngestFileRun.objects.create(
+            parent=IngestFile.objects.create(
+                url='http://localhost:8000/static/testFile', type='M',
+                source='MON', location=2, extract_date=extract_date))
+        for line_number in range(1, 4):
+            IngestFileData.objects.create(
+                ingest_parent_run=run, line_number=line_number,
+                line_text='line', extract_date=extract_date)
+        out = StringIO()
+        call_command('ingest_retention', max_age_months=1, stdout=out)
+        self.assertIn('Removed 2017-01, 3 lines', out.getvalue())
+        self.assertEqual(IngestFileData.objects.count(), 0)
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from multiprocessing import Pool
+
+from django import db
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from ingest.directory_watch import DirectoryWatcher, get_watched_directories
+from ingest.models import IngestJob
+from ingest.test_utils import IngestTestCase
+
+
+class Command(BaseCommand):
+    help = 'Watches the directories of INGEST_WATCH_DIRECTORIES, ingesting ' \
+           'their files as they arrive or change'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='seconds between the scans of the '
+                                 'directories. A file is ingested once it '
+                                 'is unchanged over a scan.')
+        parser.add_argument('--processes', type=int, default=2,
+                            help='the files ingested at once, 1 ingests '
+                                 'them in this process')
+        parser.add_argument('--scans', type=int,
+                            help='stop after this many scans, once the '
+                                 'ingests started are done. By default the '
+                                 'directories are watched until the command '
+                                 'is stopped.')
+
+    def report(self, path, outcome):
+        job_id, status, lines, errors = outcome
+        self.stdout.write('%s: job %s %s, %d lines, %d errors' % (
+            path, job_id, status, lines, errors))
+
+    def watch(self, watcher, options):
+        scans = 0
+        while True:
+            watcher.poll()
+            scans += 1
+            if options['scans'] and scans >= options['scans']:
+                return
+            time.sleep(options['poll_interval'])
+
+    def handle(self, *args, **options):
+        directories = get_watched_directories()
+        if not directories:
+            raise CommandError('INGEST_WATCH_DIRECTORIES is empty')
+        if options['processes'] < 1:
+            raise CommandError('--processes must be positive')
+        for directory in directories:
+            self.stdout.write('Watching ' + directory.path)
+
+        if options['processes'] == 1:
+            self.watch(DirectoryWatcher(directories, None, 1, self.report),
+                       options)
+            return
+        # the pool processes must each open their own database connection
+        db.connections.close_all()
+        with Pool(options['processes']) as pool:
+            watcher = DirectoryWatcher(directories, pool,
+                                       options['processes'], self.report)
+            self.watch(watcher, options)
+            pool.close()
+            pool.join()
+            watcher.collect()
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestWatchCommandTestCase(IngestTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_settled_files_are_ingested(self):
+        file_path = os.path.join(self.path, 'market_20180102.csv')
+        with open(file_path, 'w') as f:
+            f.write('a\n')
+        out = StringIO()
+        with override_settings(INGEST_SOURCES={}, INGEST_WATCH_DIRECTORIES=[{
+                'path': self.path, 'source': 'ABC', 'location': 1,
+                'patterns': [{'regex': r'^market_(?P<date>\d{8})\.csv$',
+                              'type': 'M'}]}]):
+            # the first scan sees the file, the second finds it settled
+            call_command('ingest_watch', processes=1, scans=2,
+                         poll_interval=0, stdout=out)
+        job = IngestJob.objects.get()
+        self.assertEqual(job.status, IngestJob.DONE)
+        self.assertIn('%s: job %s Done, 1 lines' % (file_path, job.id),
+                      out.getvalue())
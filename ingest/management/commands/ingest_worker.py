@@ -0,0 +1,51 @@
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from ingest.ingest_job import claim_next_job, run_job
+from ingest.models import IngestJob
+from ingest.test_utils import IngestTestCase
+from ingest.utils import get_current_date
+
+
+class Command(BaseCommand):
+    help = 'Runs the file ingests queued through the ingest url'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=10,
+                            help='seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job:
+                self.stdout.write('Running ' + str(job))
+                job = run_job(job)
+                self.stdout.write('%s: %s, %d lines, %d errors' % (
+                    job, job.get_status_display(), job.lines_processed,
+                    job.error_count))
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['poll_interval'])
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestWorkerCommandTestCase(IngestTestCase):
+    def test_queued_jobs_are_run(self):
+        job = IngestJob.objects.create(
+            file_url='file:///dev/null', file_source='ABC', file_type='M',
+            location=1, extract_date=get_current_date())
+        out = StringIO()
+        call_command('ingest_worker', once=True, stdout=out)
+        self.assertEqual(IngestJob.objects.get(pk=job.pk).status,
+                         IngestJob.DONE)
+        self.assertIn('Running ' + str(job), out.getvalue())
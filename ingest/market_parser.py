@@ -4,9 +4,16 @@ from django.contrib.auth.models import User
 
 from ingest.abstract_base_vic_node_uom_parser import \
     AbstractBaseVicNodeUOMParser
-from ingest.test_utils import IngestTestCase
+from ingest.ingest_row_writer import APPEND_SUCCESSFUL
+from ingest.reading_writer import make_ingest_row_writer
+from ingest.parser_manager import IngestParserManager
+from ingest.resolver_cache import get_cached_collection_appl_id_map, \
+    get_cached_product_dict
+from ingest.test_utils import IngestTestCase, create_ingest_labels, \
+    create_storage_product, create_allocated_collection, \
+    get_dummy_ingest_file, get_next_ingest_run
 from ingest.utils import get_collection_appl_id_map, parse_float, \
-    get_product_dict, DataSizes
+    get_product_dict, DataSizes, get_current_date, parse_float_column
 from storage.models import Ingest
 
 
@@ -39,12 +46,20 @@ def append_ingest_row_data(extracted_ingest):
 
 class UOMMarketParser(AbstractBaseVicNodeUOMParser):
     COL_SIZE = 8
+    ALLOC_COLUMN = 6
+    REPL_COLUMN = 3
+    REPL_STRING = '_repl'
+    USED_COLUMN = 7
+    APPENDS_ROWS = True
 
     def __init__(self, extraction_date, user):
-        super(UOMMarketParser, self).__init__(extraction_date, user,
-                                              get_collection_appl_id_map(),
-                                              get_product_dict(),
-                                              self.COL_SIZE)
+        super(UOMMarketParser, self).__init__(
+            extraction_date, user, get_cached_collection_appl_id_map(),
+            get_cached_product_dict(), self.COL_SIZE)
+        # the rows of a tenant's volumes are summed in memory and added to
+        # the database in one write per key
+        self.ingest_row_writer = make_ingest_row_writer(
+            append=self.APPENDS_ROWS)
 
     def get_start_after_line(self):
         return 'tenant,vicnode_id,name,vserver,aggr,total,used,free'
@@ -59,25 +74,41 @@ class UOMMarketParser(AbstractBaseVicNodeUOMParser):
             val *= DataSizes.TERABYTE.bit_conversion_factor_gig()
         return val, err
 
+    def parse_capacity_columns(self, rows_cols):
+        factor = DataSizes.TERABYTE.bit_conversion_factor_gig()
+        allocated, invalid = parse_float_column(
+            [cols[self.ALLOC_COLUMN - 1] for cols in rows_cols], factor)
+        used, invalid = parse_float_column(
+            [cols[self.USED_COLUMN - 1] for cols in rows_cols], factor)
+        is_replica = [cols[self.REPL_COLUMN - 1].endswith(self.REPL_STRING)
+                      for cols in rows_cols]
+        return {'allocated': allocated,
+                'used': [(0, None) if replica else value
+                         for replica, value in zip(is_replica, used)],
+                'replica': [value if replica else (0, None)
+                            for replica, value in zip(is_replica, used)]}
+
     def parse_allocated_capacity_in_gb(self, cols):
-        allocColumn = 6
-        return self.convert_tb_to_gb(parse_float(cols[allocColumn - 1]))
+        batch_capacity = self.get_batch_capacity('allocated')
+        if batch_capacity:
+            return batch_capacity
+        return self.convert_tb_to_gb(parse_float(cols[self.ALLOC_COLUMN - 1]))
 
     def parse_used_capacity_in_gb(self, cols):
-        repl_column = 3
-        repl_string = "_repl"
-        used_column = 7
-
-        if cols[repl_column - 1].endswith(repl_string):
+        batch_capacity = self.get_batch_capacity('used')
+        if batch_capacity:
+            return batch_capacity
+        if cols[self.REPL_COLUMN - 1].endswith(self.REPL_STRING):
             return 0, None
-        return self.convert_tb_to_gb(parse_float(cols[used_column - 1]))
+        return self.convert_tb_to_gb(parse_float(cols[self.USED_COLUMN - 1]))
 
     def parse_used_replica_in_gb(self, cols, **kwargs):
-        repl_column = 3
-        repl_string = "_repl"
-        used_column = 7
-        if cols[repl_column - 1].endswith(repl_string):
-            return self.convert_tb_to_gb(parse_float(cols[used_column - 1]))
+        batch_capacity = self.get_batch_capacity('replica')
+        if batch_capacity:
+            return batch_capacity
+        if cols[self.REPL_COLUMN - 1].endswith(self.REPL_STRING):
+            return self.convert_tb_to_gb(
+                parse_float(cols[self.USED_COLUMN - 1]))
         return 0, None
 
     def process_ingest_row_data(self, extracted_ingest):
@@ -94,6 +125,64 @@ class DummyParserWithoutSave(UOMMarketParser):
         return False, 'No save done'
 
 
+class ParseUOMMarketTestCase(IngestTestCase):
+    def setUp(self):
+        product_name = 'Market.Melbourne'
+        labels = create_ingest_labels([product_name])
+        self.product = create_storage_product(product_name,
+                                              labels[product_name])
+        self.collection = create_allocated_collection('IMOS', '2013R1.4',
+                                                      [self.product])
+        self.parser = UOMMarketParser(get_current_date(), None)
+        self.run = get_next_ingest_run(get_dummy_ingest_file())
+        self.lines = [self.parser.get_start_after_line(),
+                      'IMOS,2013R1.4,data01,os_c76b_01,aggr1,5.4,1.0,4.4',
+                      'IMOS,2013R1.4,data01_repl,os_c76b_01_repl,aggr1,'
+                      '5.4,2.0,3.4']
+
+    def test_volumes_are_summed(self):
+        tokens, errors = IngestParserManager().parse(self.lines, self.run,
+                                                     self.parser)
+        self.assertEqual(errors, [])
+        self.assertEqual(tokens[2].get('error'), None)
+        self.assertEqual(tokens[3]['error'], APPEND_SUCCESSFUL)
+        ingest = Ingest.objects.get()
+        self.assertEqual(ingest.allocated_capacity, 10800)
+        self.assertEqual(ingest.used_capacity, 1000)
+        self.assertEqual(ingest.used_replica, 2000)
+
+    def test_volumes_are_added_to_existing_row(self):
+        Ingest.objects.create(extraction_date=get_current_date(),
+                              collection=self.collection,
+                              storage_product=self.product,
+                              allocated_capacity=1, used_capacity=1,
+                              used_replica=1)
+        tokens, errors = IngestParserManager().parse(self.lines, self.run,
+                                                     self.parser)
+        self.assertEqual(tokens[2]['error'], APPEND_SUCCESSFUL)
+        ingest = Ingest.objects.get()
+        self.assertEqual(ingest.allocated_capacity, 10801)
+        self.assertEqual(ingest.used_capacity, 1001)
+        self.assertEqual(ingest.used_replica, 2001)
+
+    def test_batch_capacities_match_row_by_row(self):
+        rows_cols = [line.split(',') for line in [
+            'IMOS,2013R1.4,data01,vs,aggr1,5.4,1.0,4.4',
+            'IMOS,2013R1.4,data01_repl,vs,aggr1,-2, 0 ,1',
+            'IMOS,2013R1.4,data02,vs,aggr1,1.5TB,x,1',
+            'IMOS,2013R1.4,data02_repl,vs,aggr1,0,y,1']]
+        capacities = self.parser.parse_capacity_columns(rows_cols)
+        for index, cols in enumerate(rows_cols):
+            self.assertEqual(
+                (capacities['allocated'][index], capacities['used'][index],
+                 capacities['replica'][index]),
+                (self.parser.parse_allocated_capacity_in_gb(cols),
+                 self.parser.parse_used_capacity_in_gb(cols),
+                 self.parser.parse_used_replica_in_gb(cols)))
+        self.assertEqual(capacities['allocated'][2],
+                         (None, 'Error parsing numeric value 1.5TB'))
+
+
 class ParseUOMMarketWithoutSaveTestCase(IngestTestCase):
     def setUp(self):
         self.test_user = User.objects.create_user('TestUser',
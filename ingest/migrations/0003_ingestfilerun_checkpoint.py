@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0002_ingestjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestfilerun',
+            name='checksum',
+            field=models.CharField(blank=True, db_index=True, help_text='the SHA-256 of the content of the file parsed', max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestfilerun',
+            name='committed_line',
+            field=models.IntegerField(default=0, help_text='the line of the file the run has been written through'),
+        ),
+        migrations.AddField(
+            model_name='ingestfilerun',
+            name='completed',
+            field=models.BooleanField(default=False, help_text='whether the run parsed the whole file'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0022_ingestfile_fetch_headers'),
+        ('ingest', '0003_ingestfilerun_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestFileContent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('size', models.BigIntegerField(help_text='the size of the uncompressed content')),
+                ('line_count', models.IntegerField()),
+                ('frame_lines', models.IntegerField(help_text='the number of lines in each frame')),
+                ('ingest_file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='content', to='storage.IngestFile')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IngestFileContentFrame',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('data', models.BinaryField(help_text='the zlib compressed lines')),
+                ('line_offsets', models.BinaryField(help_text='the zlib compressed array of the offsets the lines start at in the frame, followed by the size of the frame')),
+                ('content', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='frames', to='ingest.IngestFileContent')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingestfilecontentframe',
+            unique_together=set([('content', 'number')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 07:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Only adds the column, which is instant. The extract dates of the existing
+    rows are filled in by the ingest_retention command in batches, and the
+    index is built without locking the table by 0012.
+    """
+
+    dependencies = [
+        ('ingest', '0004_ingestfilecontent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestfiledata',
+            name='extract_date',
+            field=models.DateField(null=True),
+        ),
+    ]
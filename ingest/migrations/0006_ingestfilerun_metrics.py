@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 07:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0005_ingestfiledata_extract_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestfilerun',
+            name='metrics',
+            field=models.TextField(blank=True, help_text='JSON of the counts and phase timings of the run', null=True),
+        ),
+    ]
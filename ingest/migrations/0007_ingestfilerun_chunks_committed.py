@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 07:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0006_ingestfilerun_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestfilerun',
+            name='chunks_committed',
+            field=models.IntegerField(default=0, help_text='the number of chunks of lines the run has committed'),
+        ),
+    ]
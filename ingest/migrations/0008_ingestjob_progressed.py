@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0007_ingestfilerun_chunks_committed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestjob',
+            name='attempts',
+            field=models.SmallIntegerField(default=0, help_text='the number of times the job has been started'),
+        ),
+        migrations.AddField(
+            model_name='ingestjob',
+            name='progressed',
+            field=models.DateTimeField(blank=True, help_text='when the running job last reported the lines processed', null=True),
+        ),
+    ]
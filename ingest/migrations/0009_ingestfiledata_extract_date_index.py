@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def get_index_field():
+    field = models.DateField(null=True, db_index=True)
+    field.set_attributes_from_name('extract_date')
+    return field
+
+
+def add_extract_date_index(apps, schema_editor):
+    """
+    Builds the index concurrently on Postgres, so that the raw line table
+    stays writable meanwhile. A partitioned table already has its own index,
+    and a table migrated before the index moved here has this one.
+    """
+    model = apps.get_model('ingest', 'IngestFileData')
+    table = model._meta.db_table
+    if schema_editor.connection.vendor != 'postgresql':
+        field = get_index_field()
+        field.model = model
+        schema_editor.alter_field(model, model._meta.get_field(
+            'extract_date'), field)
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s",
+                       [table])
+        if cursor.fetchone()[0] == 'p':
+            return
+    schema_editor.execute(
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} '
+        '(extract_date)'.format(
+            name=schema_editor.quote_name(schema_editor._create_index_name(
+                model, ['extract_date'])),
+            table=schema_editor.quote_name(table)))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('ingest', '0008_ingestjob_progressed'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(add_extract_date_index,
+                                     migrations.RunPython.noop),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='ingestfiledata',
+                    name='extract_date',
+                    field=models.DateField(db_index=True, null=True),
+                ),
+            ]),
+    ]
@@ -42,6 +42,20 @@ class IngestFileRun(models.Model):
                                         auto_now_add=True, editable=False,
                                         blank=False, null=False)
     run_error = models.TextField(null=True)
+    committed_line = models.IntegerField(
+        default=0,
+        help_text='the line of the file the run has been written through')
+    checksum = models.CharField(
+        max_length=64, null=True, blank=True, db_index=True,
+        help_text='the SHA-256 of the content of the file parsed')
+    completed = models.BooleanField(
+        default=False, help_text='whether the run parsed the whole file')
+    chunks_committed = models.IntegerField(
+        default=0,
+        help_text='the number of chunks of lines the run has committed')
+    metrics = models.TextField(
+        null=True, blank=True,
+        help_text='JSON of the counts and phase timings of the run')
 
     def __str__(self):
         return 'Run ' + str(self.id) + ': ' + self.parent.__str__()
@@ -53,6 +67,45 @@ class IngestFileData(models.Model):
     line_number = models.SmallIntegerField(null=False)
     line_text = models.TextField(null=False)
     error = models.TextField(null=True)
+    # copied from the IngestFile of the run, as the key the table is
+    # partitioned on by the ingest_retention command
+    extract_date = models.DateField(null=True, db_index=True)
+
+
+class IngestFileContent(models.Model):
+    """
+    The content of an ingested file, kept once as zlib compressed frames of
+    frame_lines lines each, when the raw lines are not stored as an
+    IngestFileData row each (see INGEST_RAW_LINE_STORAGE)
+    """
+    ingest_file = models.OneToOneField('storage.IngestFile', null=False,
+                                       related_name='content')
+    sha256 = models.CharField(max_length=64, null=False)
+    size = models.BigIntegerField(
+        null=False, help_text='the size of the uncompressed content')
+    line_count = models.IntegerField(null=False)
+    frame_lines = models.IntegerField(
+        null=False, help_text='the number of lines in each frame')
+
+    def __str__(self):
+        return 'Content of ' + self.ingest_file.__str__()
+
+
+class IngestFileContentFrame(models.Model):
+    """
+    The lines number * frame_lines + 1 onwards of an IngestFileContent,
+    compressed on their own so that they can be read without the rest
+    """
+    content = models.ForeignKey('ingest.IngestFileContent', null=False,
+                                related_name='frames')
+    number = models.IntegerField(null=False)
+    data = models.BinaryField(help_text='the zlib compressed lines')
+    line_offsets = models.BinaryField(
+        help_text='the zlib compressed array of the offsets the lines start '
+                  'at in the frame, followed by the size of the frame')
+
+    class Meta:
+        unique_together = ('content', 'number')
 
 
 class IngestCollectionError(models.Model):
@@ -70,3 +123,41 @@ class IngestCollectionError(models.Model):
     def __str__(self):
         return self.collKey + ' / ' + self.spKey + ' / ' + _get_date_str(
             self.extract_date)
+
+
+class IngestJob(models.Model):
+    """
+    A file ingest requested through the ingest url, queued to be run by the
+    ingest_worker management command
+    """
+    QUEUED = 'Q'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+    STATUS_CHOICES = ((QUEUED, 'Queued'), (RUNNING, 'Running'),
+                      (DONE, 'Done'), (FAILED, 'Failed'))
+    file_url = models.TextField(null=False)
+    file_source = models.CharField(max_length=3, null=False)
+    file_type = models.CharField(max_length=1, null=False)
+    location = models.SmallIntegerField(null=False)
+    extract_date = models.DateField(null=False, db_index=True)
+    user = models.ForeignKey('auth.User', null=True, blank=True,
+                             on_delete=models.SET_NULL)
+    metadata = models.TextField(null=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES,
+                              default=QUEUED, db_index=True)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    started = models.DateTimeField(null=True, blank=True)
+    progressed = models.DateTimeField(
+        null=True, blank=True,
+        help_text='when the running job last reported the lines processed')
+    finished = models.DateTimeField(null=True, blank=True)
+    attempts = models.SmallIntegerField(
+        default=0, help_text='the number of times the job has been started')
+    lines_processed = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    result = models.TextField(null=True, blank=True,
+                              help_text='the JSON result of the ingest')
+
+    def __str__(self):
+        return 'Job ' + str(self.id) + ': ' + self.file_url
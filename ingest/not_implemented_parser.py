@@ -46,7 +46,7 @@ class NotImplementedParser(AbstractIngestParser):
         :param line:
         :return: True if the line must not be processed
         """
-        return True
+        return True, None
 
     def process_ingest_row_data(self, extracted_ingest_row):
         """
@@ -1,27 +1,199 @@
+import copy
+import json
+import re
+from collections import Counter
 from datetime import datetime
 
 from django.contrib.auth.models import User
+from django.db import transaction, DatabaseError
+from django.db.models import F
 
-from ingest.abstract_ingest_parser import DummyAbstractPositiveIngestParser
+from ingest.dummy_parsers import DummyAbstractPositiveIngestParser, \
+    DummyIgnoreAllLinesParser, DummyAcceptAllLinesParser, \
+    DummyUserCreatingParser
 from ingest.models import IngestFileData, IngestFileRun
-from ingest.test_utils import IngestTestCase
-from storage.models import IngestFile
+from ingest.run_metrics import RunMetrics, QueryCounter, get_peak_rss_kb, \
+    TOKENIZE, RESOLVE, PERSIST
+from ingest.run_records import record_error
+from ingest.test_utils import IngestTestCase, get_dummy_ingest_file, \
+    get_next_ingest_run
 
 
-def record_error(data_record, error_msg):
-    if data_record.error and error_msg:
-        data_record.error = data_record.error + ', ' + error_msg
-    elif error_msg:
-        data_record.error = error_msg
-    data_record.save()
+class IngestFileDataWriter:
+    """
+    Buffers the IngestFileData rows of an ingest run, along with any error
+    text recorded against them, until flush writes them with bulk_create in
+    batches of chunk_size. If errors_only is set, only the rows that have an
+    error recorded against them are written.
+    """
+    DEFAULT_CHUNK_SIZE = 500
 
+    def __init__(self, ingest_file_run_record, chunk_size=None,
+                 errors_only=False):
+        self.ingest_file_run_record = ingest_file_run_record
+        self.extract_date = ingest_file_run_record.parent.extract_date
+        self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        self.errors_only = errors_only
+        self.pending_rows = []
+        # (line number, error) of the lines the database refused
+        self.failed_lines = []
 
-def store_file_row(count, line_text, ingest_file_record):
-    dataRecord = IngestFileData(ingest_parent_run=ingest_file_record)
-    dataRecord.line_number = count
-    dataRecord.line_text = line_text
-    dataRecord.save()
-    return dataRecord
+    def store_row(self, count, line_text):
+        """
+        :param count: the line number of the row
+        :param line_text: the text of the line
+        :return: an unsaved IngestFileData record that is written on the next
+                 flush
+        """
+        data_record = IngestFileData(
+            ingest_parent_run=self.ingest_file_run_record,
+            extract_date=self.extract_date)
+        data_record.line_number = count
+        data_record.line_text = line_text
+        self.pending_rows.append(data_record)
+        return data_record
+
+    def flush(self):
+        """
+        Writes the buffered rows. Rows a parser has already saved on its own
+        (they have a primary key) are not inserted again.
+        :return: the number of rows written
+        """
+        unsaved_rows = [r for r in self.pending_rows if not r.pk and (
+            r.error or not self.errors_only)]
+        self.pending_rows = []
+        if not unsaved_rows:
+            return 0
+        try:
+            with transaction.atomic():
+                IngestFileData.objects.bulk_create(unsaved_rows,
+                                                   batch_size=self.chunk_size)
+            return len(unsaved_rows)
+        except DatabaseError:
+            for row in unsaved_rows:
+                row.pk = None
+        # find the lines that cannot be stored by writing them one by one
+        written = 0
+        for row in unsaved_rows:
+            try:
+                with transaction.atomic():
+                    row.save()
+                written += 1
+            except DatabaseError as e:
+                row.pk = None
+                self.failed_lines.append((row.line_number, str(e)))
+        return written
+
+
+# the quoted values and the words with digits in them, the keys and counts
+# that differ between errors of the same kind
+ERROR_DETAIL = re.compile(r'\'[^\']*\'|"[^"]*"|\S*\d\S*')
+
+
+def get_error_category(error):
+    return ERROR_DETAIL.sub('#', error or '').strip()
+
+
+class ErrorSummary:
+    """
+    Stands in for the list of parse errors when parsing in streaming mode.
+    The errors appended are counted by category, with only the first
+    sample_size of them kept.
+    """
+    DEFAULT_SAMPLE_SIZE = 20
+
+    def __init__(self, sample_size=None):
+        self.sample_size = sample_size or self.DEFAULT_SAMPLE_SIZE
+        self.total = 0
+        self.categories = Counter()
+        self.sample = []
+
+    def append(self, error):
+        self.total += 1
+        self.categories[get_error_category(error['error'])] += 1
+        if len(self.sample) < self.sample_size:
+            self.sample.append(error)
+
+    def __len__(self):
+        return self.total
+
+    def as_dict(self):
+        return {'total': self.total,
+                'by_category': dict(self.categories),
+                'sample': self.sample}
+
+
+class ParserRun:
+    """
+    The state kept for each parser while IngestParserManager parses a file
+    """
+
+    def __init__(self, parser, row_writer, streaming=False,
+                 error_sample_size=None):
+        self.parser = parser
+        self.row_writer = row_writer
+        self.streaming = streaming
+        self.input_stream_token_array = {}
+        self.parse_error_list = ErrorSummary(error_sample_size) \
+            if streaming else []
+        # the lines waiting to be processed by the parser as a batch at the
+        # end of the chunk, as (line number, store row, cols, out record)
+        self.pending_rows = []
+        # the lines whose extracted row has been queued by the parser, keyed
+        # by line number
+        self.queued_lines = {}
+        run_record = row_writer.ingest_file_run_record
+        self.metrics = RunMetrics.from_json(
+            run_record.metrics,
+            parser.__class__.__name__ if parser else None)
+
+    def checkpoint(self):
+        """
+        :return: the state of the chunk being parsed, which rollback puts
+                 back if the transaction writing the chunk fails
+        """
+        errors = self.parse_error_list
+        run_record = self.row_writer.ingest_file_run_record
+        return {
+            'pending_rows': list(self.pending_rows),
+            'store_rows': [(row, row.pk, row.error)
+                           for row in self.row_writer.pending_rows],
+            'failed_lines': len(self.row_writer.failed_lines),
+            'run_record': (run_record.committed_line, run_record.completed,
+                           run_record.chunks_committed, run_record.metrics),
+            'out_errors': [(out_record, out_record.get('error'))
+                           for count, row, cols, out_record
+                           in self.pending_rows if out_record is not None],
+            'counts': dict(self.metrics.counts),
+            'errors': copy.deepcopy(errors)
+            if isinstance(errors, ErrorSummary) else len(errors),
+            'parser': self.parser.get_chunk_state() if self.parser else None}
+
+    def rollback(self, state):
+        self.pending_rows = list(state['pending_rows'])
+        for row, pk, error in state['store_rows']:
+            row.pk = pk
+            row.error = error
+        self.row_writer.pending_rows = [
+            row for row, pk, error in state['store_rows']]
+        del self.row_writer.failed_lines[state['failed_lines']:]
+        run_record = self.row_writer.ingest_file_run_record
+        run_record.committed_line, run_record.completed, \
+            run_record.chunks_committed, run_record.metrics = \
+            state['run_record']
+        for out_record, error in state['out_errors']:
+            if error is None:
+                out_record.pop('error', None)
+            else:
+                out_record['error'] = error
+        self.metrics.counts.update(state['counts'])
+        if isinstance(self.parse_error_list, ErrorSummary):
+            self.parse_error_list = copy.deepcopy(state['errors'])
+        else:
+            del self.parse_error_list[state['errors']:]
+        self.queued_lines = {}
+        if self.parser:
+            self.parser.restore_chunk_state(state['parser'])
 
 
 def remove_line_feed_at_end(target):
@@ -31,82 +203,349 @@ def remove_line_feed_at_end(target):
 
 
 class IngestParserManager:
+    def __init__(self, chunk_size=None, progress=None, store_all_lines=True,
+                 streaming=False, error_sample_size=None):
+        """
+        :param chunk_size: the number of lines parsed before the buffered
+                           raw lines and extracted rows are written to the
+                           database
+        :param progress: called with the number of lines parsed so far each
+                         time a chunk has been written
+        :param store_all_lines: if False, only the lines with errors are
+                                stored, the file content being kept elsewhere
+        :param streaming: if set, the tokens of the lines are not kept and
+                          the errors are summarised by an ErrorSummary, so
+                          that only a chunk of the file is held in memory at
+                          a time
+        :param error_sample_size: the errors an ErrorSummary keeps in full
+        """
+        self.chunk_size = chunk_size or IngestFileDataWriter.DEFAULT_CHUNK_SIZE
+        self.progress = progress
+        self.store_all_lines = store_all_lines
+        self.streaming = streaming
+        self.error_sample_size = error_sample_size
+
     @staticmethod
     def tokenize_line(line, col_splitter, cols_expected, parser_name):
         cols = line.split(col_splitter)
+        return IngestParserManager.check_col_count(cols, col_splitter,
+                                                   cols_expected, parser_name)
+
+    @staticmethod
+    def check_col_count(cols, col_splitter, cols_expected, parser_name):
         if not cols_expected or len(cols) < cols_expected:
             return cols, parser_name + ': expected a minimum of ' + str(
                 cols_expected) + ' columns for splitter "' + str(
                 col_splitter) + '" got ' + str(len(cols))
         return cols, None
 
-    def parse(self, line_stream, ingest_file_run_record, parser):
+    def parse(self, line_stream, ingest_file_run_record, parser,
+              resume_after_line=0):
         """
         :param parser:
         :param line_stream:
         :param ingest_file_run_record:
+        :param resume_after_line: see parse_fan_out
         :return:
         """
+        return self.parse_fan_out(line_stream,
+                                  [(parser, ingest_file_run_record)],
+                                  resume_after_line)[0]
+
+    def parse_fan_out(self, line_stream, parser_run_list,
+                      resume_after_line=0):
+        """
+        Reads line_stream once, handing each line to every parser in turn.
+        A line is split once for each distinct column splitter, and its raw
+        text is stored once, against the run of the first parser. The runs of
+        the other parsers, and all of the runs if store_all_lines is not set,
+        only store the lines they record an error for.
+        Each chunk is written in one transaction that also moves on the
+        status of the collections the parsers ingested rows for (see
+        update_collection_status) and records the line the runs are committed
+        through, from which an interrupted run can be resumed.
+        The time and queries each parser takes to tokenize, resolve and
+        persist its rows, and the count of its lines and rows, are kept as the
+        metrics of its run (see RunMetrics).
+
+        :param line_stream:
+        :param parser_run_list: list of (parser, ingest_file_run_record)
+        :param resume_after_line: the lines up to this one were committed by
+                                  an earlier run of the file. They are only
+                                  shown to the parsers' ignore_line, so that
+                                  the parsers see the headers.
+        :return: list of (input_stream_token_array, parse_error_list), in the
+                 order of parser_run_list. In streaming mode the token arrays
+                 are empty and the error lists are ErrorSummary.
+        """
+        parser_runs = []
+        for parser, ingest_file_run_record in parser_run_list:
+            errors_only = bool(parser_runs) or not self.store_all_lines
+            row_writer = IngestFileDataWriter(ingest_file_run_record,
+                                              self.chunk_size,
+                                              errors_only=errors_only)
+            parser_runs.append(ParserRun(parser, row_writer, self.streaming,
+                                         self.error_sample_size))
+
         count = 0
-        input_stream_token_array = {}
-
-        parse_error_list = []
-        for line in line_stream:
-            out_record = {'input': line}
-            line = remove_line_feed_at_end(line)
-            count += 1
-            curr_store_row = store_file_row(count, line,
-                                            ingest_file_run_record)
-            if not parser:
-                record_error(curr_store_row, 'No parser, row ignored')
-                continue
-
-            ignore, error_msg = parser.ignore_line(count, line)
-            if error_msg:
-                parse_error_list.append(
-                    {'lineNum': count, 'input': line, 'error': error_msg})
-            if ignore:
-                error_msg = 'Row Ignored ' + (error_msg if error_msg else '')
-                record_error(curr_store_row, error_msg)
-                continue
-
-            parser_name = parser.__class__.__name__
-            col_splitter, expect_col_size = parser.get_col_splitter(count)
-            cols, error_msg = self.tokenize_line(line, col_splitter,
-                                                 expect_col_size, parser_name)
-            if error_msg:
-                record_error(curr_store_row, error_msg)
-                parse_error_list.append(
-                    {'lineNum': count, 'input': line, 'error': error_msg})
-            else:
+        with QueryCounter() as query_counter:
+            for line in line_stream:
+                input_line = line
+                line = remove_line_feed_at_end(line)
+                count += 1
+                if count <= resume_after_line:
+                    for parser_run in parser_runs:
+                        if parser_run.parser:
+                            parser_run.parser.ignore_line(count, line)
+                    continue
+                line_cols = {}
+                for parser_run in parser_runs:
+                    with parser_run.metrics.timer(TOKENIZE, query_counter):
+                        self.parse_line(count, input_line, line, line_cols,
+                                        parser_run)
+                if count % self.chunk_size == 0:
+                    self.commit_chunk(parser_runs, count,
+                                      query_counter=query_counter)
+                    if self.progress:
+                        self.progress(count)
+            self.commit_chunk(parser_runs, count, completed=True,
+                              query_counter=query_counter)
+        for parser_run in parser_runs:
+            if parser_run.row_writer.failed_lines:
+                set_failed_lines_error(parser_run.row_writer)
+        if self.progress:
+            self.progress(count)
+
+        return [(parser_run.input_stream_token_array,
+                 parser_run.parse_error_list) for parser_run in parser_runs]
+
+    def parse_line(self, count, input_line, line, line_cols, parser_run):
+        """
+        :param count: the line number
+        :param input_line: the line as read from the stream
+        :param line: the line without its line feed
+        :param line_cols: the columns of the line already split, keyed by
+                          column splitter
+        :param parser_run: the ParserRun of the parser to be given the line
+        """
+        parser = parser_run.parser
+        parse_error_list = parser_run.parse_error_list
+        counts = parser_run.metrics.counts
+        counts['lines_read'] += 1
+        curr_store_row = parser_run.row_writer.store_row(count, line)
+        # the lines are not kept in streaming mode
+        out_record = None if parser_run.streaming else {'input': input_line}
+        if not parser:
+            record_error(curr_store_row, 'No parser, row ignored')
+            counts['rows_ignored'] += 1
+            return
+
+        ignore, error_msg = parser.ignore_line(count, line)
+        if error_msg:
+            parse_error_list.append(
+                {'lineNum': count, 'input': line, 'error': error_msg})
+        if ignore:
+            error_msg = 'Row Ignored ' + (error_msg if error_msg else '')
+            record_error(curr_store_row, error_msg)
+            counts['rows_ignored'] += 1
+            return
+
+        parser_name = parser.__class__.__name__
+        col_splitter, expect_col_size = parser.get_col_splitter(count)
+        if col_splitter not in line_cols:
+            line_cols[col_splitter] = line.split(col_splitter)
+        cols, error_msg = self.check_col_count(line_cols[col_splitter],
+                                               col_splitter, expect_col_size,
+                                               parser_name)
+        if error_msg:
+            record_error(curr_store_row, error_msg)
+            parse_error_list.append(
+                {'lineNum': count, 'input': line, 'error': error_msg})
+            counts['rows_errored'] += 1
+        else:
+            # processed with the other rows of the chunk by process_rows
+            parser_run.pending_rows.append((count, curr_store_row, cols,
+                                            out_record))
+        if out_record is not None:
+            if not error_msg:
                 out_record[col_splitter] = cols
-                success = parser.process_row_cols(curr_store_row, cols)
-                if not success:
-                    parse_error_list.append({'lineNum': count, 'input': line,
-                                             'error': curr_store_row.error})
             if curr_store_row.error:
                 out_record['error'] = curr_store_row.error
-            input_stream_token_array[count] = out_record
-        return input_stream_token_array, parse_error_list
+            parser_run.input_stream_token_array[count] = out_record
 
+    @staticmethod
+    def commit_chunk(parser_runs, line_count, completed=False,
+                     query_counter=None):
+        """
+        Writes the chunk parsed, and records against the runs that they are
+        committed through line_count, all in one transaction. Once completed,
+        the metrics of the runs are written with them.
+        If the transaction fails, the chunk is written again a row at a time,
+        each row in a savepoint of its own, so that the rows the database
+        refuses are reported as errors instead of failing the whole chunk.
+        :param query_counter: the QueryCounter the queries of each parser are
+                              counted with
+        """
+        states = [parser_run.checkpoint() for parser_run in parser_runs]
+        try:
+            with transaction.atomic():
+                IngestParserManager.flush_chunk(parser_runs, query_counter)
+                IngestParserManager.finish_chunk(parser_runs, line_count,
+                                                 completed, query_counter)
+            return
+        except DatabaseError:
+            for parser_run, state in zip(parser_runs, states):
+                parser_run.rollback(state)
+                parser_run.metrics.counts['chunks_retried'] += 1
+        with transaction.atomic():
+            IngestParserManager.flush_chunk(parser_runs, query_counter,
+                                            row_by_row=True)
+            IngestParserManager.finish_chunk(parser_runs, line_count,
+                                             completed, query_counter)
 
-##########################################################
-#  Automated Tests
-##########################################################
+    @staticmethod
+    def finish_chunk(parser_runs, line_count, completed, query_counter):
+        """
+        Moves on the status of the collections of the chunk, and records the
+        chunk as committed against the runs
+        """
+        for parser_run in parser_runs:
+            if parser_run.parser:
+                with parser_run.metrics.timer(PERSIST, query_counter):
+                    parser_run.parser.update_collection_status()
+            parser_run.metrics.counts['chunks_committed'] += 1
+            run_record = parser_run.row_writer.ingest_file_run_record
+            run_record.committed_line = line_count
+            run_record.completed = completed
+            run_record.chunks_committed += 1
+        IngestFileRun.objects.filter(pk__in=[
+            parser_run.row_writer.ingest_file_run_record.pk
+            for parser_run in parser_runs]).update(
+            committed_line=line_count, completed=completed,
+            chunks_committed=F('chunks_committed') + 1)
+        if completed:
+            peak_rss_kb = get_peak_rss_kb()
+            for parser_run in parser_runs:
+                parser_run.metrics.peak_rss_kb = peak_rss_kb
+                run_record = parser_run.row_writer.ingest_file_run_record
+                run_record.metrics = parser_run.metrics.to_json()
+                IngestFileRun.objects.filter(pk=run_record.pk).update(
+                    metrics=run_record.metrics)
+
+    @staticmethod
+    def process_rows(parser_run):
+        """
+        Has the parser process the rows of the chunk, in one batch, and
+        records the outcome against their lines
+        """
+        pending_rows, parser_run.pending_rows = parser_run.pending_rows, []
+        if not pending_rows:
+            return
+        results = parser_run.parser.process_rows_cols(
+            [(curr_store_row, cols)
+             for count, curr_store_row, cols, out_record in pending_rows])
+        for (count, curr_store_row, cols, out_record), success in zip(
+                pending_rows, results):
+            if success is None:
+                parser_run.queued_lines[count] = out_record
+            else:
+                IngestParserManager.record_outcome(parser_run, curr_store_row,
+                                                   success, out_record)
+
+    @staticmethod
+    def record_outcome(parser_run, curr_store_row, success, out_record):
+        """
+        Records whether the row of a line was ingested against the line
+        """
+        if not success:
+            parser_run.parse_error_list.append(
+                {'lineNum': curr_store_row.line_number,
+                 'input': curr_store_row.line_text,
+                 'error': curr_store_row.error})
+            parser_run.metrics.counts['rows_errored'] += 1
+        else:
+            parser_run.metrics.counts['rows_accepted'] += 1
+        if curr_store_row.error and out_record is not None:
+            out_record['error'] = curr_store_row.error
+
+    @staticmethod
+    def write_rows(parser_run, query_counter):
+        """
+        Processes the pending rows of the parser, and writes the extracted
+        rows it has queued
+        """
+        metrics = parser_run.metrics
+        with metrics.timer(RESOLVE, query_counter):
+            IngestParserManager.process_rows(parser_run)
+        with metrics.timer(PERSIST, query_counter):
+            flushed_rows = parser_run.parser.flush_ingest_rows()
+        for curr_store_row, success in flushed_rows:
+            out_record = parser_run.queued_lines.pop(
+                curr_store_row.line_number)
+            IngestParserManager.record_outcome(parser_run, curr_store_row,
+                                               success, out_record)
+
+    @staticmethod
+    def write_rows_one_by_one(parser_run, query_counter):
+        """
+        Writes the pending rows of the parser a row at a time, each in a
+        savepoint. A row the database refuses is rolled back on its own and
+        reported as an error.
+        """
+        pending_rows, parser_run.pending_rows = parser_run.pending_rows, []
+        for row in pending_rows:
+            parser_run.pending_rows = [row]
+            state = parser_run.checkpoint()
+            try:
+                with transaction.atomic():
+                    IngestParserManager.write_rows(parser_run, query_counter)
+            except DatabaseError as e:
+                parser_run.rollback(state)
+                parser_run.pending_rows = []
+                count, curr_store_row, cols, out_record = row
+                record_error(curr_store_row,
+                             'Error persisting data ' + str(e))
+                IngestParserManager.record_outcome(
+                    parser_run, curr_store_row, False, out_record)
 
+    @staticmethod
+    def flush_chunk(parser_runs, query_counter=None, row_by_row=False):
+        """
+        Processes the rows of the chunk, writes the extracted rows the
+        parsers have queued, records their outcome against their lines, and
+        then writes the buffered raw lines.
+        :param row_by_row: write the rows of each parser one at a time, see
+                           write_rows_one_by_one
+        """
+        for parser_run in parser_runs:
+            metrics = parser_run.metrics
+            if parser_run.parser:
+                if row_by_row:
+                    IngestParserManager.write_rows_one_by_one(parser_run,
+                                                              query_counter)
+                else:
+                    IngestParserManager.write_rows(parser_run, query_counter)
+            with metrics.timer(PERSIST, query_counter):
+                metrics.counts['lines_stored'] += \
+                    parser_run.row_writer.flush()
 
-def get_next_ingest_run(ingest_file):
-    ingestFileRun = IngestFileRun(parent=ingest_file)
-    ingestFileRun.save()
-    return ingestFileRun
 
+def set_failed_lines_error(row_writer):
+    """
+    Records the lines the database refused to store against their run
+    """
+    run_record = row_writer.ingest_file_run_record
+    error = 'Lines not stored: ' + ', '.join(
+        '%d (%s)' % failed_line for failed_line in row_writer.failed_lines)
+    run_record.run_error = run_record.run_error + ', ' + error \
+        if run_record.run_error else error
+    IngestFileRun.objects.filter(pk=run_record.pk).update(
+        run_error=run_record.run_error)
 
-def get_dummy_ingest_file():
-    url = 'http://localhost:8000/static/testFile'
-    extract_date = datetime.now().date()
-    return IngestFile.objects.create(url=url, type='M',
-                                     source='MON', location=2,
-                                     extract_date=extract_date)
+
+##########################################################
+#  Automated Tests
+##########################################################
 
 
 class IngestParserManagerTestCase(IngestTestCase):
@@ -163,3 +602,113 @@ class IngestParserManagerTestCase(IngestTestCase):
         savedLines = IngestFileData.objects.filter(
             ingest_parent_run=self.ingestFileRun)
         self.assertEqual(len(savedLines), len(lines))
+
+    def test_parse_in_chunks(self):
+        lines = ['line %d' % i for i in range(1, 8)]
+        chunked_manager = IngestParserManager(chunk_size=3)
+        ignore_parser = DummyIgnoreAllLinesParser(datetime.now().date(),
+                                                  self.testUser)
+        parseResult, errCountMap = chunked_manager.parse(lines,
+                                                         self.ingestFileRun,
+                                                         ignore_parser)
+        self.assertEqual(len(parseResult), 0)
+        # every line is persisted once, with the error recorded against it
+        savedLines = IngestFileData.objects.filter(
+            ingest_parent_run=self.ingestFileRun).order_by('line_number')
+        self.assertEqual([l.line_number for l in savedLines],
+                         list(range(1, 8)))
+        for savedLine in savedLines:
+            self.assertEqual(savedLine.error, 'Row Ignored ')
+
+    def test_parse_fan_out(self):
+        lines = ['sdasf,dfdsfd,5656,a34,tesss',
+                 'dafdsf, 43e3d, sdasf,dfdsfd,5656,a34,tesss',
+                 '1, 3,5,6,7,8']
+        runs = [get_next_ingest_run(self.ingestFile) for _ in range(3)]
+        today = datetime.now().date()
+        parsers = [DummyAcceptAllLinesParser(today, self.testUser),
+                   DummyAcceptAllLinesParser(today, self.testUser),
+                   DummyIgnoreAllLinesParser(today, self.testUser)]
+        results = self.ingestManager.parse_fan_out(lines,
+                                                   list(zip(parsers, runs)))
+        self.assertEqual([len(r[0]) for r in results], [3, 3, 0])
+        self.assertEqual(results[0][0][2][','],
+                         ['dafdsf', ' 43e3d', ' sdasf', 'dfdsfd', '5656',
+                          'a34', 'tesss'])
+        # the raw lines are only stored once, against the first run, the
+        # other runs keep just the lines they recorded an error for
+        saved_counts = [IngestFileData.objects.filter(
+            ingest_parent_run=run).count() for run in runs]
+        self.assertEqual(saved_counts, [3, 0, 3])
+
+    def test_parse_resumes_after_line(self):
+        lines = ['line,%d' % i for i in range(1, 8)]
+        chunked_manager = IngestParserManager(chunk_size=3)
+        parser = DummyAcceptAllLinesParser(datetime.now().date(),
+                                           self.testUser)
+        parseResult, errCountMap = chunked_manager.parse(
+            lines, self.ingestFileRun, parser, resume_after_line=4)
+        self.assertEqual(sorted(parseResult), [5, 6, 7])
+        savedLines = IngestFileData.objects.filter(
+            ingest_parent_run=self.ingestFileRun).order_by('line_number')
+        self.assertEqual([l.line_number for l in savedLines], [5, 6, 7])
+        run = IngestFileRun.objects.get(pk=self.ingestFileRun.pk)
+        self.assertEqual(run.committed_line, 7)
+        self.assertTrue(run.completed)
+
+    def test_streaming_keeps_no_tokens(self):
+        lines = ['line,%d' % i for i in range(1, 51)] + ['short'] * 50
+        parser = DummyAcceptAllLinesParser(datetime.now().date(),
+                                           self.testUser)
+        parser.get_col_splitter = lambda line_num: (',', 2)
+        tokens, errors = IngestParserManager(
+            chunk_size=10, streaming=True, error_sample_size=5).parse(
+            lines, self.ingestFileRun, parser)
+        self.assertEqual(tokens, {})
+        self.assertEqual(len(errors), 50)
+        self.assertEqual(errors.as_dict()['by_category'], {
+            'DummyAcceptAllLinesParser: expected a minimum of # columns for '
+            'splitter # got #': 50})
+        self.assertEqual([e['lineNum'] for e in errors.sample],
+                         [51, 52, 53, 54, 55])
+
+    def test_refused_rows_are_retried_one_by_one(self):
+        lines = ['good', 'good', 'bad', 'good', 'good']
+        parser = DummyUserCreatingParser(datetime.now().date(), self.testUser)
+        tokens, errors = IngestParserManager(chunk_size=2).parse(
+            lines, self.ingestFileRun, parser)
+        self.assertEqual([e['lineNum'] for e in errors], [3])
+        self.assertEqual(errors[0]['error'],
+                         'Error persisting data bad line')
+        self.assertEqual(tokens[3]['error'], errors[0]['error'])
+        self.assertEqual(sorted(User.objects.filter(
+            username__startswith='user').values_list(
+            'username', flat=True)), ['user1', 'user2', 'user4', 'user5'])
+        self.assertEqual(IngestFileData.objects.filter(
+            ingest_parent_run=self.ingestFileRun).count(), 5)
+        run = IngestFileRun.objects.get(pk=self.ingestFileRun.pk)
+        self.assertEqual(run.chunks_committed, 3)
+        self.assertTrue(run.completed)
+        metrics = json.loads(run.metrics)
+        self.assertEqual(metrics['chunks_retried'], 1)
+        self.assertEqual(metrics['rows_accepted'], 4)
+        self.assertEqual(metrics['rows_errored'], 1)
+
+    def test_run_metrics(self):
+        lines = ['header', 'line,1', 'line', 'line,3']
+        parser = DummyAcceptAllLinesParser(datetime.now().date(),
+                                           self.testUser)
+        parser.get_col_splitter = lambda line_num: (',', 2)
+        parser.ignore_line = lambda line_num, line: (line_num == 1, None)
+        IngestParserManager(chunk_size=2).parse(lines, self.ingestFileRun,
+                                                parser)
+        metrics = json.loads(IngestFileRun.objects.get(
+            pk=self.ingestFileRun.pk).metrics)
+        self.assertEqual(metrics['parser'], 'DummyAcceptAllLinesParser')
+        self.assertEqual(
+            [metrics[counter] for counter in (
+                'lines_read', 'lines_stored', 'rows_accepted',
+                'rows_ignored', 'rows_errored')], [4, 4, 2, 1, 1])
+        self.assertGreater(metrics['queries'], 0)
+        self.assertGreater(metrics['seconds']['tokenize'], 0)
+        self.assertGreater(metrics['peak_rss_kb'], 0)
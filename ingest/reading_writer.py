@@ -0,0 +1,427 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+
+from ingest.ingest_row_writer import IngestRowWriter, IngestRowAggregator, \
+    VALUE_FIELDS, DATA_EXISTS_ERROR, APPEND_SUCCESSFUL, get_ingest_key
+from ingest.test_utils import IngestTestCase, create_storage_product
+from storage.models import Ingest, IngestReading, Collection
+from storage.models.applications import stores_readings_as_ranges
+
+ONE_DAY = timedelta(days=1)
+CENT = Decimal('0.01')
+
+READING_REPLACED = 'Reading replaced'
+
+
+def get_reading_values(reading):
+    """
+    :param reading: an Ingest or IngestReading
+    :return: tuple of its capacities, as the database stores them
+    """
+    return tuple(None if getattr(reading, field_name) is None
+                 else Decimal(getattr(reading, field_name)).quantize(CENT)
+                 for field_name in VALUE_FIELDS)
+
+
+def set_reading_values(reading, values):
+    for field_name, value in zip(VALUE_FIELDS, values):
+        setattr(reading, field_name, value)
+
+
+def add_values(values, other_values):
+    return tuple((value or 0) + (other or 0)
+                 for value, other in zip(values, other_values))
+
+
+class ReadingTimeline:
+    """
+    The readings of a collection and storage product over the dates being
+    written, to which the daily values are added in date order
+    """
+
+    def __init__(self, collection_id, storage_product_id, readings):
+        self.collection_id = collection_id
+        self.storage_product_id = storage_product_id
+        self.readings = sorted(readings, key=lambda r: r.valid_from)
+        # the state of the readings as loaded, to find the ones changed
+        self.loaded = {reading.pk: (reading.valid_from, reading.valid_to,
+                                    get_reading_values(reading))
+                       for reading in self.readings}
+
+    def find(self, date):
+        """
+        :return: tuple (index of the first reading ending on or after date,
+                 or the number of readings, and that reading or None)
+        """
+        for index, reading in enumerate(self.readings):
+            if reading.valid_to >= date:
+                return index, reading
+        return len(self.readings), None
+
+    def new_reading(self, valid_from, valid_to, values):
+        reading = IngestReading(
+            collection_id=self.collection_id,
+            storage_product_id=self.storage_product_id,
+            valid_from=valid_from, valid_to=valid_to)
+        set_reading_values(reading, values)
+        return reading
+
+    def add(self, date, values, append, replace=False):
+        """
+        Records values as the reading of date, extending the reading of the
+        day before if it is the same, and joining it to the reading of the
+        day after if that is the same too
+        :param append: add the values to a reading already covering date,
+                       splitting its range around the date
+        :param replace: take date out of the range of a reading already
+                        covering it with different values, and record values
+                        in its place
+        :return: tuple (success, error or message)
+        """
+        message = None
+        index, reading = self.find(date)
+        if reading and reading.valid_from <= date:
+            if replace:
+                if get_reading_values(reading) == values:
+                    return True, None
+                self.remove(index, date)
+                message = READING_REPLACED
+                index, reading = self.find(date)
+            elif append:
+                self.split(index, date, add_values(
+                    get_reading_values(reading), values))
+                return True, APPEND_SUCCESSFUL
+            else:
+                return False, DATA_EXISTS_ERROR
+        before = self.readings[index - 1] if index else None
+        if before and before.valid_to == date - ONE_DAY and \
+                get_reading_values(before) == values:
+            before.valid_to = date
+            current = before
+        else:
+            current = self.new_reading(date, date, values)
+            self.readings.insert(index, current)
+        if reading and reading.valid_from == date + ONE_DAY and \
+                get_reading_values(reading) == values:
+            current.valid_to = reading.valid_to
+            self.readings.remove(reading)
+        return True, message
+
+    def remove(self, index, date):
+        """
+        Takes date out of the range of the reading at index
+        """
+        reading = self.readings[index]
+        if reading.valid_from == reading.valid_to:
+            del self.readings[index]
+        elif reading.valid_from == date:
+            reading.valid_from = date + ONE_DAY
+        elif reading.valid_to == date:
+            reading.valid_to = date - ONE_DAY
+        else:
+            self.readings.insert(index + 1, self.new_reading(
+                date + ONE_DAY, reading.valid_to,
+                get_reading_values(reading)))
+            reading.valid_to = date - ONE_DAY
+
+    def split(self, index, date, values):
+        """
+        Gives date values of its own within the range of the reading at index
+        """
+        reading = self.readings[index]
+        old_values = get_reading_values(reading)
+        valid_to = reading.valid_to
+        pieces = []
+        if reading.valid_from < date:
+            reading.valid_to = date - ONE_DAY
+            pieces.append(self.new_reading(date, date, values))
+        else:
+            reading.valid_to = date
+            set_reading_values(reading, values)
+        if valid_to > date:
+            pieces.append(self.new_reading(date + ONE_DAY, valid_to,
+                                           old_values))
+        self.readings[index + 1:index + 1] = pieces
+
+    def get_changes(self):
+        """
+        :return: tuple (list of the new readings, list of the readings
+                 changed, list of the ids of the readings joined to others)
+        """
+        kept = {reading.pk for reading in self.readings if reading.pk}
+        deleted_ids = [pk for pk in self.loaded if pk not in kept]
+        changed = [reading for reading in self.readings
+                   if reading.pk and self.loaded[reading.pk] != (
+                       reading.valid_from, reading.valid_to,
+                       get_reading_values(reading))]
+        new_readings = [reading for reading in self.readings
+                        if not reading.pk]
+        return new_readings, changed, deleted_ids
+
+
+def save_readings(timelines):
+    """
+    Writes the changes to the readings of the timelines: the readings joined
+    to others are deleted, the ones changed are updated and the new ones
+    inserted. The readings whose range was only extended are updated with
+    one query for each new end date.
+    """
+    new_readings, changed, deleted_ids = [], [], []
+    for timeline in timelines:
+        changes = timeline.get_changes()
+        new_readings += changes[0]
+        changed += [(timeline, reading) for reading in changes[1]]
+        deleted_ids += changes[2]
+    if deleted_ids:
+        IngestReading.objects.filter(pk__in=deleted_ids).delete()
+    extended = {}
+    for timeline, reading in changed:
+        valid_from, valid_to, values = timeline.loaded[reading.pk]
+        if (valid_from, values) == (reading.valid_from,
+                                    get_reading_values(reading)):
+            extended.setdefault(reading.valid_to, []).append(reading.pk)
+        else:
+            reading.save()
+    for valid_to, reading_ids in extended.items():
+        IngestReading.objects.filter(pk__in=reading_ids).update(
+            valid_to=valid_to)
+    IngestReading.objects.bulk_create(new_readings)
+
+
+def write_readings(totals, append, replace=False):
+    """
+    Adds the daily values to the readings of their collection and storage
+    product, loading the readings the dates could touch in one query. The
+    dates that still have an Ingest row, recorded before the readings were
+    stored as ranges, are not given a reading as well: their values are
+    added to the Ingest row if append is set, otherwise they are reported as
+    existing.
+    :param totals: list of Ingest with the daily values
+    :param append: see ReadingTimeline.add
+    :param replace: see ReadingTimeline.add. The totals are the Ingest rows
+                    being moved into the readings, so they are not checked
+                    against the Ingest rows.
+    :return: list of (success, error or message) for each of totals
+    """
+    if not totals:
+        return []
+    min_date = min(total.extraction_date for total in totals)
+    max_date = max(total.extraction_date for total in totals)
+    ingests = {}
+    if not replace:
+        ingests = {get_ingest_key(ingest): ingest for ingest in
+                   Ingest.objects.select_for_update().filter(
+                       collection_id__in={t.collection_id for t in totals},
+                       storage_product_id__in={t.storage_product_id
+                                               for t in totals},
+                       extraction_date__range=(min_date, max_date))}
+    readings = IngestReading.objects.select_for_update().filter(
+        collection_id__in={total.collection_id for total in totals},
+        storage_product_id__in={t.storage_product_id for t in totals},
+        valid_from__lte=max_date + ONE_DAY,
+        valid_to__gte=min_date - ONE_DAY)
+    key_readings = {}
+    for reading in readings:
+        key = (reading.collection_id, reading.storage_product_id)
+        key_readings.setdefault(key, []).append(reading)
+    timelines = {key: ReadingTimeline(key[0], key[1],
+                                      key_readings.get(key, []))
+                 for key in {(t.collection_id, t.storage_product_id)
+                             for t in totals}}
+    results = {}
+    appended = {}
+    for index in sorted(range(len(totals)),
+                        key=lambda i: totals[i].extraction_date):
+        total = totals[index]
+        ingest = ingests.get(get_ingest_key(total))
+        if ingest and append:
+            set_reading_values(ingest, add_values(
+                get_reading_values(ingest), get_reading_values(total)))
+            appended[ingest.pk] = ingest
+            results[index] = True, APPEND_SUCCESSFUL
+            continue
+        if ingest:
+            results[index] = False, DATA_EXISTS_ERROR
+            continue
+        timeline = timelines[(total.collection_id, total.storage_product_id)]
+        results[index] = timeline.add(total.extraction_date,
+                                      get_reading_values(total), append,
+                                      replace)
+    for ingest in appended.values():
+        ingest.save(update_fields=VALUE_FIELDS)
+    save_readings(timelines.values())
+    return [results[index] for index in range(len(totals))]
+
+
+class IngestReadingWriter(IngestRowAggregator):
+    """
+    Writes the extracted rows as IngestReading ranges, see
+    INGEST_READING_STORAGE. A reading only adds a row when it differs from
+    the reading of the day before, otherwise it extends its range.
+    Has the same interface as IngestRowWriter. If append is set, the rows
+    sharing an ingest key are summed and added to the reading already
+    recorded for their date, as the IngestRowAggregator does. Otherwise the
+    first row of a key is written and the others, and the rows of a date
+    already recorded, are reported as existing.
+    """
+
+    def __init__(self, batch_size=None, append=False):
+        super(IngestReadingWriter, self).__init__(batch_size)
+        self.append = append
+        # the rows of the keys already added, if they are not summed
+        self.duplicate_rows = []
+
+    def add(self, extracted_ingest, context=None):
+        if not self.append and \
+                get_ingest_key(extracted_ingest) in self.totals:
+            self.duplicate_rows.append((extracted_ingest, context))
+            return
+        super(IngestReadingWriter, self).add(extracted_ingest, context)
+
+    def clear(self):
+        super(IngestReadingWriter, self).clear()
+        self.duplicate_rows = []
+
+    def flush(self):
+        duplicate_rows, self.duplicate_rows = self.duplicate_rows, []
+        results = super(IngestReadingWriter, self).flush()
+        return results + [(ingest, context, False, DATA_EXISTS_ERROR)
+                          for ingest, context in duplicate_rows]
+
+    def _write_batch(self, batch):
+        results = []
+        for (total, rows), (success, message) in zip(
+                batch, write_readings([total for total, _ in batch],
+                                      self.append)):
+            for ingest, context in rows:
+                results.append((ingest, context, success, message))
+                if success:
+                    message = APPEND_SUCCESSFUL
+        return results
+
+
+def compact_ingests(before, collection_ids=None):
+    """
+    Moves the Ingest rows dated before a date into IngestReading ranges, a
+    collection and storage product at a time, each in its own transaction.
+    A row whose date is already covered by a reading was recorded first, so
+    as for any reading written twice its values are the ones kept: they
+    replace the reading of that date.
+    :param collection_ids: only move the rows of these collections
+    :return: tuple (number of rows moved, number of them that replaced a
+             reading)
+    """
+    ingests = Ingest.objects.filter(extraction_date__lt=before)
+    if collection_ids:
+        ingests = ingests.filter(collection_id__in=collection_ids)
+    keys = ingests.order_by('collection_id', 'storage_product_id').values_list(
+        'collection_id', 'storage_product_id').distinct()
+    moved = replaced = 0
+    for collection_id, storage_product_id in keys:
+        with transaction.atomic():
+            rows = list(ingests.select_for_update().filter(
+                collection_id=collection_id,
+                storage_product_id=storage_product_id).order_by(
+                'extraction_date'))
+            results = write_readings(rows, append=False, replace=True)
+            Ingest.objects.filter(pk__in=[row.pk for row in rows]).delete()
+        moved += len(rows)
+        replaced += len([message for success, message in results
+                         if message == READING_REPLACED])
+    return moved, replaced
+
+
+def make_ingest_row_writer(append=False):
+    """
+    :param append: sum the rows sharing an ingest key, adding them to the
+                   values already recorded for it
+    :return: the writer of the extracted rows of a parser, for the storage
+             of the readings set by INGEST_READING_STORAGE
+    """
+    if stores_readings_as_ranges():
+        return IngestReadingWriter(append=append)
+    if append:
+        return IngestRowAggregator()
+    return IngestRowWriter()
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class IngestReadingWriterTestCase(IngestTestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(name='Test')
+        self.product = create_storage_product('Market.Melbourne')
+        self.start = Ingest._meta.get_field('extraction_date').default()
+
+    def write(self, day, used, append=False):
+        writer = IngestReadingWriter(append=append)
+        writer.add(Ingest(extraction_date=self.start + timedelta(days=day),
+                          collection=self.collection,
+                          storage_product=self.product,
+                          allocated_capacity=10, used_capacity=used,
+                          used_replica=0))
+        return writer.flush()[0][2:]
+
+    def get_ranges(self):
+        return [((r.valid_from - self.start).days,
+                 (r.valid_to - self.start).days, r.used_capacity)
+                for r in IngestReading.objects.order_by('valid_from')]
+
+    def test_unchanged_readings_extend_their_range(self):
+        for day, used in ((0, 1), (1, 1), (2, 1), (3, 2), (5, 2)):
+            self.assertEqual(self.write(day, used), (True, None))
+        self.assertEqual(self.get_ranges(), [(0, 2, 1), (3, 3, 2),
+                                             (5, 5, 2)])
+        self.assertEqual(self.write(1, 5), (False, DATA_EXISTS_ERROR))
+        # the missing day joins the ranges either side of it
+        self.write(4, 2)
+        self.assertEqual(self.get_ranges(), [(0, 2, 1), (3, 5, 2)])
+        daily = list(IngestReading.objects.daily(
+            self.start + ONE_DAY, self.start + timedelta(days=4)))
+        self.assertEqual([(i.extraction_date - self.start).days
+                          for i in daily], [1, 2, 3, 4])
+        self.assertEqual([i.used_capacity for i in daily], [1, 1, 2, 2])
+
+    def test_appended_values_split_the_range(self):
+        for day in range(3):
+            self.write(day, 1)
+        self.assertEqual(self.write(1, 2, append=True),
+                         (True, APPEND_SUCCESSFUL))
+        self.assertEqual(self.get_ranges(), [(0, 0, 1), (1, 1, 3),
+                                             (2, 2, 1)])
+        self.assertEqual(IngestReading.objects.on_date(
+            self.start + ONE_DAY).get().used_capacity, 3)
+
+    def test_daily_rows_are_compacted(self):
+        for day, used in ((0, 1), (1, 1), (2, 2), (3, 2), (9, 2)):
+            Ingest.objects.create(
+                extraction_date=self.start + timedelta(days=day),
+                collection=self.collection, storage_product=self.product,
+                allocated_capacity=10, used_capacity=used, used_replica=0)
+        # a reading recorded alongside the row of its date
+        IngestReading.objects.create(
+            valid_from=self.start + timedelta(days=3),
+            valid_to=self.start + timedelta(days=4),
+            collection=self.collection, storage_product=self.product,
+            allocated_capacity=10, used_capacity=5, used_replica=0)
+        self.assertEqual(compact_ingests(self.start + timedelta(days=9)),
+                         (4, 1))
+        self.assertEqual(self.get_ranges(), [(0, 1, 1), (2, 3, 2),
+                                             (4, 4, 5)])
+        self.assertEqual(Ingest.objects.count(), 1)
+
+    def test_dates_with_an_ingest_row_are_not_given_a_reading(self):
+        Ingest.objects.create(
+            extraction_date=self.start, collection=self.collection,
+            storage_product=self.product, allocated_capacity=10,
+            used_capacity=1, used_replica=0)
+        self.assertEqual(self.write(0, 2), (False, DATA_EXISTS_ERROR))
+        self.assertEqual(self.write(0, 2, append=True),
+                         (True, APPEND_SUCCESSFUL))
+        self.assertEqual(self.get_ranges(), [])
+        self.assertEqual(Ingest.objects.get().used_capacity, 3)
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from ingest.test_utils import IngestTestCase, create_ingest_labels, \
+    create_storage_product, create_allocated_collection
+from ingest.utils import get_product_dict, get_collection_appl_id_map
+from storage.models import Collection, Allocation, Request, StorageProduct, \
+    Label, LabelsAlias
+
+# the lookups change when any of these are saved or deleted
+RESOLVER_MODELS = (Collection, Allocation, Request, StorageProduct, Label,
+                   LabelsAlias)
+COLLECTION_APPL_ID_MAP = 'collection_appl_id_map'
+PRODUCT_DICT = 'product_dict'
+DISPATCH_UID = 'ingest.resolver_cache.invalidate'
+
+_lock = threading.Lock()
+_version = 0
+_cache = {'version': None, 'built': 0, 'maps': {}}
+
+
+def get_max_age():
+    """
+    :return: the seconds a map is reused for, as the changes made by other
+             processes send no signal to this one. 0 reuses it until a
+             change in this process invalidates it.
+    """
+    return getattr(settings, 'INGEST_RESOLVER_CACHE_SECONDS', 300)
+
+
+def invalidate(**kwargs):
+    """
+    Signal receiver, makes the next lookup rebuild its map
+    """
+    global _version
+    with _lock:
+        _version += 1
+
+
+def connect_signals():
+    for model in RESOLVER_MODELS:
+        post_save.connect(invalidate, sender=model,
+                          dispatch_uid=DISPATCH_UID)
+        post_delete.connect(invalidate, sender=model,
+                            dispatch_uid=DISPATCH_UID)
+
+
+def get_cached(name, build):
+    """
+    :param name: the key of the map in the cache
+    :param build: called without arguments to build the map if the cache does
+                  not hold a current one
+    :return: the map, shared by every caller until it is invalidated, so it
+             must not be modified
+    """
+    with _lock:
+        max_age = get_max_age()
+        if _cache['version'] != _version or \
+                (max_age and time.time() - _cache['built'] > max_age):
+            _cache['version'] = _version
+            _cache['built'] = time.time()
+            _cache['maps'] = {}
+        version = _version
+        maps = _cache['maps']
+        if name in maps:
+            return maps[name]
+    value = build()
+    with _lock:
+        # a change made while building leaves the map out of the cache
+        if version == _version and maps is _cache['maps']:
+            maps[name] = value
+    return value
+
+
+def get_cached_collection_appl_id_map():
+    return get_cached(COLLECTION_APPL_ID_MAP, get_collection_appl_id_map)
+
+
+def get_cached_product_dict():
+    return get_cached(PRODUCT_DICT, get_product_dict)
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class ResolverCacheTestCase(IngestTestCase):
+    def setUp(self):
+        labels = create_ingest_labels(['Market.Melbourne'])
+        self.product = create_storage_product('Market.Melbourne',
+                                              labels['Market.Melbourne'])
+        create_allocated_collection('First', 'CODE1', [self.product])
+
+    def test_maps_are_reused_until_invalidated(self):
+        collection_map = get_cached_collection_appl_id_map()
+        product_dict = get_cached_product_dict()
+        self.assertEqual(set(collection_map), {'CODE1'})
+        self.assertEqual(product_dict, {'Market.Melbourne': self.product})
+        with self.assertNumQueries(0):
+            self.assertIs(get_cached_collection_appl_id_map(), collection_map)
+            self.assertIs(get_cached_product_dict(), product_dict)
+        create_allocated_collection('Second', 'CODE2', [self.product])
+        self.assertEqual(set(get_cached_collection_appl_id_map()),
+                         {'CODE1', 'CODE2'})
+
+    def test_delete_invalidates(self):
+        self.assertEqual(len(get_cached_collection_appl_id_map()), 1)
+        Collection.objects.get(name='First').delete()
+        self.assertEqual(get_cached_collection_appl_id_map(), {})
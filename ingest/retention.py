@@ -0,0 +1,340 @@
+import csv
+import gzip
+import os
+import re
+from datetime import date, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Min, Max
+
+from ingest.models import IngestFileData, IngestFileRun, IngestFileContent
+from ingest.test_utils import IngestTestCase
+from storage.models import IngestFile
+
+DATA_TABLE = IngestFileData._meta.db_table
+DEFAULT_PARTITION = DATA_TABLE + '_default'
+PARTITION_NAME = re.compile(r'^' + DATA_TABLE + r'_y(\d{4})m(\d{2})$')
+DELETE_BATCH_SIZE = 10000
+# the ids of the raw lines whose extract date is set in each statement
+UPDATE_BATCH_SIZE = 50000
+# sets the extract date of the raw lines stored before it was recorded
+SET_EXTRACT_DATE_SQL = \
+    'UPDATE ingest_ingestfiledata SET extract_date = (' \
+    'SELECT f.extract_date FROM ingest_ingestfile f ' \
+    'JOIN ingest_ingestfilerun r ON r.parent_id = f.id ' \
+    'WHERE r.id = ingest_ingestfiledata.ingest_parent_run_id) ' \
+    'WHERE extract_date IS NULL'
+ARCHIVE_FIELDS = ('id', 'ingest_parent_run_id', 'line_number', 'line_text',
+                  'error', 'extract_date')
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return month_start(month_start(day) + timedelta(days=32))
+
+
+def add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return '%s_y%04dm%02d' % (DATA_TABLE, month.year, month.month)
+
+
+def supports_partitioning():
+    """
+    :return: True if the database supports partitioning the raw line table
+             (Postgres 11 and later)
+    """
+    return connection.vendor == 'postgresql' and \
+        connection.pg_version >= 110000
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s",
+                       [DATA_TABLE])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def get_partition_months():
+    """
+    :return: sorted list of the months the raw line table has a partition for
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s",
+            [DATA_TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+def create_partition(cursor, month):
+    qn = connection.ops.quote_name
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} '
+        'FOR VALUES FROM (%s) TO (%s)'.format(
+            partition=qn(partition_name(month)), table=qn(DATA_TABLE)),
+        [month, next_month(month)])
+
+
+def create_partition_from_default(month):
+    """
+    Creates the partition of month, moving the rows of the month that went to
+    the default partition meanwhile (backfills, or months the partitions were
+    not created ahead for) into it, as Postgres refuses to create it while
+    the default partition holds rows in its range
+    :return: the number of rows moved
+    """
+    qn = connection.ops.quote_name
+    moved_table = qn(DATA_TABLE + '_moved')
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE {moved} (LIKE {table}) '
+            'ON COMMIT DROP'.format(moved=moved_table,
+                                    table=qn(DATA_TABLE)))
+        cursor.execute(
+            'WITH moved_rows AS (DELETE FROM {default} '
+            'WHERE extract_date >= %s AND extract_date < %s RETURNING *) '
+            'INSERT INTO {moved} SELECT * FROM moved_rows'.format(
+                default=qn(DEFAULT_PARTITION), moved=moved_table),
+            [month, next_month(month)])
+        moved = cursor.rowcount
+        create_partition(cursor, month)
+        cursor.execute('INSERT INTO {table} SELECT * FROM {moved}'.format(
+            table=qn(DATA_TABLE), moved=moved_table))
+    return moved
+
+
+def create_partitions(first_month, month_count):
+    """
+    Creates the monthly partitions of the raw line table from first_month on,
+    along with those of the earlier months the default partition has rows for
+    :return: tuple (the months in place, dictionary of the rows moved out of
+             the default partition by month)
+    """
+    months = [add_months(month_start(first_month), i)
+              for i in range(month_count)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', extract_date)::date "
+            "FROM {default} WHERE extract_date IS NOT NULL".format(
+                default=connection.ops.quote_name(DEFAULT_PARTITION)))
+        default_months = {row[0] for row in cursor.fetchall()}
+    existing = set(get_partition_months())
+    moved = {}
+    for month in sorted(default_months | set(months)):
+        if month not in existing:
+            moved[month] = create_partition_from_default(month)
+    return months, {month: rows for month, rows in moved.items() if rows}
+
+
+def set_extract_dates():
+    """
+    Sets the extract date of the raw lines stored before it was recorded, a
+    range of ids at a time, each in a statement of its own so that no
+    statement holds its locks for long
+    :return: the number of rows updated
+    """
+    if not IngestFileData.objects.filter(extract_date__isnull=True).exists():
+        return 0
+    bounds = IngestFileData.objects.aggregate(Min('id'), Max('id'))
+    updated = 0
+    with connection.cursor() as cursor:
+        for first_id in range(bounds['id__min'], bounds['id__max'] + 1,
+                              UPDATE_BATCH_SIZE):
+            cursor.execute(SET_EXTRACT_DATE_SQL + ' AND id >= %s AND id < %s',
+                           [first_id, first_id + UPDATE_BATCH_SIZE])
+            updated += cursor.rowcount
+    return updated
+
+
+def partition_data_table():
+    """
+    Converts the raw line table into a table partitioned by extract month,
+    with a partition for each month it holds data for, a default partition
+    for the rows without a partition of their own, and copies its rows over.
+    """
+    qn = connection.ops.quote_name
+    table = qn(DATA_TABLE)
+    old_table = qn(DATA_TABLE + '_unpartitioned')
+    run_table = qn(IngestFileRun._meta.db_table)
+    set_extract_dates()
+    with transaction.atomic(), connection.cursor() as cursor:
+        # any rows stored since
+        cursor.execute(SET_EXTRACT_DATE_SQL)
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')",
+                       [DATA_TABLE])
+        sequence = cursor.fetchone()[0]
+        cursor.execute('ALTER TABLE {table} RENAME TO {old}'.format(
+            table=table, old=old_table))
+        cursor.execute(
+            'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (extract_date)'.format(table=table,
+                                                       old=old_table))
+        cursor.execute('ALTER SEQUENCE {seq} OWNED BY {table}.id'.format(
+            seq=sequence, table=table))
+        cursor.execute('ALTER TABLE {table} ADD PRIMARY KEY '
+                       '(id, extract_date)'.format(table=table))
+        cursor.execute(
+            'ALTER TABLE {table} ADD FOREIGN KEY (ingest_parent_run_id) '
+            'REFERENCES {runs} (id) DEFERRABLE INITIALLY DEFERRED'.format(
+                table=table, runs=run_table))
+        cursor.execute('CREATE INDEX {name} ON {table} '
+                       '(ingest_parent_run_id)'.format(
+                           name=qn(DATA_TABLE + '_run_idx'), table=table))
+        cursor.execute('CREATE INDEX {name} ON {table} (extract_date)'.format(
+            name=qn(DATA_TABLE + '_extract_date_idx'), table=table))
+        cursor.execute(
+            "SELECT DISTINCT date_trunc('month', extract_date)::date "
+            "FROM {old}".format(old=old_table))
+        for row in cursor.fetchall():
+            create_partition(cursor, row[0])
+        cursor.execute('CREATE TABLE {name} PARTITION OF {table} '
+                       'DEFAULT'.format(name=qn(DEFAULT_PARTITION),
+                                        table=table))
+        cursor.execute('INSERT INTO {table} SELECT * FROM {old}'.format(
+            table=table, old=old_table))
+        cursor.execute('DROP TABLE {old}'.format(old=old_table))
+
+
+def archive_rows(queryset, path):
+    """
+    Writes the rows of the IngestFileData queryset to a gzipped csv file
+    :return: the number of rows written
+    """
+    count = 0
+    with gzip.open(path, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(ARCHIVE_FIELDS)
+        for row in queryset.values_list(*ARCHIVE_FIELDS).iterator():
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def delete_rows(queryset):
+    """
+    Deletes the rows of the queryset in batches, so that no statement holds
+    its locks for long
+    :return: the number of rows deleted
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:DELETE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        # filtered on the queryset too, for the partitions to be pruned
+        deleted += queryset.filter(id__in=ids).delete()[0]
+
+
+def prune_raw_data(cutoff_month, archive_dir=None):
+    """
+    Removes the raw lines, content and runs of the files extracted before
+    cutoff_month. A partitioned raw line table has the partitions of those
+    months dropped. The rows of a plain one, and those of the months left in
+    the default partition of a partitioned one, are deleted in batches.
+    :param archive_dir: if given, the raw lines of each month are first
+                        written there as <table>_yYYYYmMM.csv.gz
+    :return: list of (month, raw lines removed or None if the partition was
+             dropped uncounted)
+    """
+    cutoff_month = month_start(cutoff_month)
+    pruned = []
+    if is_partitioned():
+        qn = connection.ops.quote_name
+        for month in get_partition_months():
+            if month >= cutoff_month:
+                continue
+            rows = None
+            if archive_dir:
+                rows = archive_rows(
+                    IngestFileData.objects.filter(
+                        extract_date__gte=month,
+                        extract_date__lt=next_month(month)),
+                    os.path.join(archive_dir,
+                                 partition_name(month) + '.csv.gz'))
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    'ALTER TABLE {table} DETACH PARTITION {partition}'.format(
+                        table=qn(DATA_TABLE),
+                        partition=qn(partition_name(month))))
+                cursor.execute('DROP TABLE {partition}'.format(
+                    partition=qn(partition_name(month))))
+            pruned.append((month, rows))
+    old_rows = IngestFileData.objects.filter(extract_date__lt=cutoff_month)
+    months = sorted({month_start(d) for d in old_rows.values_list(
+        'extract_date', flat=True).distinct()})
+    for month in months:
+        month_rows = IngestFileData.objects.filter(
+            extract_date__gte=month, extract_date__lt=next_month(month))
+        if archive_dir:
+            archive_rows(month_rows, os.path.join(
+                archive_dir, partition_name(month) + '.csv.gz'))
+        pruned.append((month, delete_rows(month_rows)))
+    pruned.sort(key=lambda month_rows: month_rows[0])
+    # any rows without an extract date left behind by the runs go with them
+    delete_rows(IngestFileData.objects.filter(
+        extract_date__isnull=True,
+        ingest_parent_run__parent__extract_date__lt=cutoff_month))
+    IngestFileContent.objects.filter(
+        ingest_file__extract_date__lt=cutoff_month).delete()
+    IngestFileRun.objects.filter(
+        parent__extract_date__lt=cutoff_month).delete()
+    return pruned
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class RetentionTestCase(IngestTestCase):
+    def setUp(self):
+        self.runs = []
+        for extract_date in (date(2017, 1, 31), date(2017, 2, 1),
+                             date(2017, 3, 1)):
+            ingest_file = IngestFile.objects.create(
+                url='http://localhost:8000/static/testFile', type='M',
+                source='MON', location=2, extract_date=extract_date)
+            run = IngestFileRun.objects.create(parent=ingest_file)
+            for line_number in range(1, 4):
+                IngestFileData.objects.create(
+                    ingest_parent_run=run, line_number=line_number,
+                    line_text='line', extract_date=extract_date)
+            self.runs.append(run)
+
+    def test_month_arithmetic(self):
+        self.assertEqual(next_month(date(2017, 12, 31)), date(2018, 1, 1))
+        self.assertEqual(add_months(date(2017, 11, 1), -11), date(2016, 12, 1))
+        self.assertEqual(partition_name(date(2017, 2, 1)),
+                         DATA_TABLE + '_y2017m02')
+
+    def test_prune_raw_data(self):
+        pruned = prune_raw_data(date(2017, 3, 15))
+        self.assertEqual(pruned, [(date(2017, 1, 1), 3),
+                                  (date(2017, 2, 1), 3)])
+        self.assertEqual(list(IngestFileRun.objects.all()), self.runs[2:])
+        self.assertEqual(IngestFileData.objects.count(), 3)
+
+    def test_set_extract_dates(self):
+        IngestFileData.objects.filter(
+            ingest_parent_run=self.runs[1]).update(extract_date=None)
+        self.assertEqual(set_extract_dates(), 3)
+        self.assertEqual(set_extract_dates(), 0)
+        self.assertEqual(IngestFileData.objects.filter(
+            extract_date=date(2017, 2, 1)).count(), 3)
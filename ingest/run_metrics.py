@@ -0,0 +1,213 @@
+import json
+import resource
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from ingest.models import IngestFileRun
+from ingest.test_utils import IngestTestCase
+from storage.models import IngestFile
+
+FETCH = 'fetch'
+TOKENIZE = 'tokenize'
+RESOLVE = 'resolve'
+PERSIST = 'persist'
+PHASES = (FETCH, TOKENIZE, RESOLVE, PERSIST)
+COUNTERS = ('bytes', 'lines_read', 'lines_stored', 'rows_accepted',
+            'rows_ignored', 'rows_errored', 'queries', 'chunks_committed',
+            'chunks_retried')
+
+
+class QueryCounter:
+    """
+    Counts the queries run on the default connection while it is active, by
+    how many the connection logs. The log only keeps the last queries_limit
+    queries, so it is emptied once half full to keep the count right.
+    """
+
+    def __init__(self):
+        self.counted = 0
+        self.logged = 0
+
+    @property
+    def count(self):
+        logged = len(connection.queries_log)
+        self.counted += logged - self.logged
+        if logged >= connection.queries_limit // 2:
+            connection.queries_log.clear()
+            logged = 0
+        self.logged = logged
+        return self.counted
+
+    def __enter__(self):
+        self.force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        self.counted = 0
+        self.logged = len(connection.queries_log)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection.force_debug_cursor = self.force_debug_cursor
+
+
+def get_peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PhaseTimer:
+    """
+    Adds the seconds, and the queries, spent in its block to a phase of the
+    RunMetrics
+    """
+
+    def __init__(self, metrics, phase, query_counter=None):
+        self.metrics = metrics
+        self.phase = phase
+        self.query_counter = query_counter
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.queries = self.query_counter.count if self.query_counter else 0
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.seconds[self.phase] += time.perf_counter() - self.start
+        if self.query_counter:
+            self.metrics.counts['queries'] += \
+                self.query_counter.count - self.queries
+
+
+class RunMetrics:
+    """
+    The measurements of an ingest run, kept as JSON in IngestFileRun.metrics
+    """
+
+    def __init__(self, parser_name=None):
+        self.parser_name = parser_name
+        self.seconds = OrderedDict((phase, 0.0) for phase in PHASES)
+        self.counts = OrderedDict((counter, 0) for counter in COUNTERS)
+        self.peak_rss_kb = None
+
+    @classmethod
+    def from_json(cls, metrics_json, parser_name=None):
+        """
+        :return: RunMetrics carrying on from the metrics_json of a run, such
+                 as the fetch recorded before it was parsed
+        """
+        metrics = cls(parser_name)
+        if metrics_json:
+            values = json.loads(metrics_json)
+            for counter in COUNTERS:
+                metrics.counts[counter] = values.get(counter) or 0
+            for phase in PHASES:
+                metrics.seconds[phase] = \
+                    values.get('seconds', {}).get(phase) or 0.0
+        return metrics
+
+    def timer(self, phase, query_counter=None):
+        return PhaseTimer(self, phase, query_counter)
+
+    def add_fetch(self, fetched_file):
+        self.seconds[FETCH] += fetched_file.fetch_seconds
+        self.counts['bytes'] += fetched_file.size
+
+    def as_dict(self):
+        result = OrderedDict([('parser', self.parser_name)])
+        result.update(self.counts)
+        result['seconds'] = OrderedDict(
+            (phase, round(seconds, 6))
+            for phase, seconds in self.seconds.items())
+        result['peak_rss_kb'] = self.peak_rss_kb
+        return result
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+
+def get_throughput(days=30, parser_name=None):
+    """
+    Sums the metrics of the runs of the last days by day
+    :param parser_name: only sum the runs of this parser
+    :return: list of dictionaries, one per day with runs, with the totals of
+             the counters and phase seconds, lines per second and queries per
+             line
+    """
+    since = timezone.now() - timedelta(days=days)
+    runs = IngestFileRun.objects.filter(
+        process_date__gte=since, metrics__isnull=False).order_by(
+        'process_date').values_list('process_date', 'metrics')
+    totals = OrderedDict()
+    for process_date, metrics_json in runs.iterator():
+        metrics = json.loads(metrics_json)
+        if parser_name and metrics.get('parser') != parser_name:
+            continue
+        day = timezone.localtime(process_date).date().isoformat()
+        if day not in totals:
+            totals[day] = OrderedDict([('date', day), ('runs', 0)])
+            totals[day].update((counter, 0) for counter in COUNTERS)
+            totals[day]['seconds'] = OrderedDict(
+                (phase, 0.0) for phase in PHASES)
+        day_totals = totals[day]
+        day_totals['runs'] += 1
+        for counter in COUNTERS:
+            day_totals[counter] += metrics.get(counter) or 0
+        for phase in PHASES:
+            day_totals['seconds'][phase] += \
+                metrics.get('seconds', {}).get(phase) or 0
+    for day_totals in totals.values():
+        parse_seconds = sum(day_totals['seconds'][phase]
+                            for phase in PHASES if phase != FETCH)
+        day_totals['lines_per_second'] = round(
+            day_totals['lines_read'] / parse_seconds, 1) \
+            if parse_seconds else None
+        day_totals['queries_per_line'] = round(
+            day_totals['queries'] / day_totals['lines_read'], 4) \
+            if day_totals['lines_read'] else None
+    return list(totals.values())
+
+
+##########################################################
+#  Automated Tests
+##########################################################
+
+
+class RunMetricsTestCase(IngestTestCase):
+    def test_runs_are_summed_by_day(self):
+        ingest_file = IngestFile.objects.create(
+            url='http://localhost:8000/static/testFile', type='M',
+            source='MON', location=2, extract_date=timezone.now().date())
+        for parser_name in ('UOMComputeParser', 'UOMVaultParser'):
+            metrics = RunMetrics(parser_name)
+            metrics.counts['lines_read'] = 100
+            metrics.counts['queries'] = 10
+            metrics.seconds[TOKENIZE] = 0.5
+            metrics.seconds[PERSIST] = 0.5
+            IngestFileRun.objects.create(parent=ingest_file,
+                                         metrics=metrics.to_json())
+        IngestFileRun.objects.create(parent=ingest_file)
+        days = get_throughput()
+        self.assertEqual(len(days), 1)
+        self.assertEqual(days[0]['runs'], 2)
+        self.assertEqual(days[0]['lines_read'], 200)
+        self.assertEqual(days[0]['lines_per_second'], 100.0)
+        self.assertEqual(days[0]['queries_per_line'], 0.1)
+        self.assertEqual(get_throughput(parser_name='UOMVaultParser')[0][
+            'runs'], 1)
+
+    def test_timer_counts_queries(self):
+        metrics = RunMetrics()
+        with QueryCounter() as query_counter:
+            with metrics.timer(RESOLVE, query_counter):
+                IngestFileRun.objects.count()
+        self.assertEqual(metrics.counts['queries'], 1)
+        self.assertGreater(metrics.seconds[RESOLVE], 0)
+
+    def test_query_count_survives_a_full_log(self):
+        with QueryCounter() as query_counter:
+            for i in range(connection.queries_limit):
+                IngestFileRun.objects.exists()
+                if i % 1000 == 0:
+                    query_counter.count
+            self.assertEqual(query_counter.count, connection.queries_limit)
@@ -0,0 +1,36 @@
+from ingest.models import IngestFileData
+
+
+def record_error(data_record, error_msg):
+    if data_record.error and error_msg:
+        data_record.error = data_record.error + ', ' + error_msg
+    elif error_msg:
+        data_record.error = error_msg
+    # rows still buffered by an IngestFileDataWriter get their error written
+    # when the writer is flushed
+    if data_record.pk:
+        data_record.save()
+
+
+def store_file_row(count, line_text, ingest_file_record):
+    dataRecord = IngestFileData(
+        ingest_parent_run=ingest_file_record,
+        extract_date=ingest_file_record.parent.extract_date)
+    dataRecord.line_number = count
+    dataRecord.line_text = line_text
+    dataRecord.save()
+    return dataRecord
+
+
+def set_run_error(run_record, error):
+    if not run_record:
+        return  # TODO burying an unexpected state? At least log this
+    if isinstance(run_record, IngestFileData):
+        # the parsers also report row errors through here
+        record_error(run_record, error)
+        return
+    if run_record.run_error:
+        run_record.run_error = run_record.run_error + error
+    else:
+        run_record.run_error = error
+    run_record.save()
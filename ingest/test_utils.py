@@ -1,8 +1,13 @@
 import collections
 import sys
+from datetime import datetime
 
 from django.test import TestCase
 
+from ingest.models import IngestFileRun
+from storage.models import Label, StorageProduct, Collection, Request, \
+    Allocation, IngestFile
+
 
 class IngestTestCase(TestCase):
     fixtures = []
@@ -16,6 +21,12 @@ class IngestTestCase(TestCase):
     #     , 'test_fixtures/reports_fixtures.json'
     #     , 'test_fixtures/adhoc_fixtures.json']
 
+    def _pre_setup(self):
+        super(IngestTestCase, self)._pre_setup()
+        # the rows of the previous test were rolled back without a signal
+        from ingest.resolver_cache import invalidate
+        invalidate()
+
     def check(self, parse_val, parse_err, check_val, check_err, field_name,
               line_num):
         self.assertEqual(parse_val, check_val,
@@ -36,3 +47,50 @@ def print_error():
 def print_map_sorted_by_key(coll):
     for k in collections.OrderedDict(sorted(coll.items())):
         print(k, coll.get(k))
+
+
+def create_ingest_labels(product_names):
+    """
+    Creates the storage product and collection status labels the ingest
+    parsers look up
+    :return: a dictionary of the product labels, keyed by product name
+    """
+    root = Label.objects.create(value='Label', group=None)
+    root.group = root
+    root.save()
+    status_group = Label.objects.create(value='Collection Status', group=root)
+    for status in ('Allocation Approved', 'Provisioned', 'Ingesting'):
+        Label.objects.create(value=status, group=status_group)
+    product_group = Label.objects.create(value='Storage Product', group=root)
+    return {name: Label.objects.create(value=name, group=product_group)
+            for name in product_names}
+
+
+def create_storage_product(product_name, product_label=None):
+    label = product_label or Label.objects.create(value=product_name,
+                                                  group=None)
+    return StorageProduct.objects.create(product_name=label, scheme=label)
+
+
+def create_allocated_collection(name, application_code, storage_products):
+    collection = Collection.objects.create(name=name)
+    application = Request.objects.create(code=application_code)
+    for storage_product in storage_products:
+        Allocation.objects.create(collection=collection,
+                                  storage_product=storage_product,
+                                  application=application, size=1000)
+    return collection
+
+
+def get_next_ingest_run(ingest_file):
+    ingestFileRun = IngestFileRun(parent=ingest_file)
+    ingestFileRun.save()
+    return ingestFileRun
+
+
+def get_dummy_ingest_file():
+    url = 'http://localhost:8000/static/testFile'
+    extract_date = datetime.now().date()
+    return IngestFile.objects.create(url=url, type='M',
+                                     source='MON', location=2,
+                                     extract_date=extract_date)
@@ -1,8 +1,14 @@
 from django.conf.urls import url
 
-from ingest import file_parse
+from ingest import file_parse, ingest_job
 
 urlpatterns = [
     url(r'^(?P<fileSource>\w{3})/(?P<location>\d+)/(?P<fileType>\w{1})$',
         file_parse.ingest_file, name='ingest_file'),
+    url(r'^files/(?P<file_id>\d+)/lines$', file_parse.file_lines,
+        name='ingest_file_lines'),
+    url(r'^jobs/(?P<job_id>\d+)$', ingest_job.job_status,
+        name='ingest_job_status'),
+    url(r'^throughput$', file_parse.ingest_throughput,
+        name='ingest_throughput'),
 ]
@@ -1,7 +1,9 @@
 from datetime import datetime
 from enum import unique, Enum
 
-from storage.models import Label, StorageProduct, Collection
+import numpy
+
+from storage.models import Label, StorageProduct, Collection, Allocation
 
 
 def get_product_dict():
@@ -19,7 +21,16 @@ def get_product_dict():
 
 
 def get_collection_appl_id_map():
-    return {c.application_code: c for c in Collection.objects.all()}
+    return Collection.objects.get_application_code_maps()[0]
+
+
+def get_allocation_index():
+    """
+    :return: a set of the (collection id, storage product id) pairs that have
+             an allocation
+    """
+    return set(Allocation.objects.values_list('collection_id',
+                                              'storage_product_id'))
 
 
 def parse_float(str_value):
@@ -29,6 +40,38 @@ def parse_float(str_value):
         return None, 'Error parsing numeric value ' + str_value
 
 
+def parse_float_column(str_values, factor=1, negative_as_zero=False):
+    """
+    Parses a column of values the way parse_float parses a single one, with
+    NumPy
+    :param str_values: list of the strings of the column
+    :param factor: what the values are scaled by
+    :param negative_as_zero: whether negative values are replaced by 0
+    :return: tuple (list of the (value, error) tuples of the cells, list of
+             the indexes of the cells that are not numbers)
+    """
+    try:
+        values = numpy.array(str_values).astype(numpy.float64)
+        invalid = []
+    except ValueError:
+        # find the cells that are not numbers one by one
+        values = numpy.empty(len(str_values))
+        invalid = []
+        for index, str_value in enumerate(str_values):
+            value, error = parse_float(str_value)
+            if error:
+                invalid.append(index)
+                value = 0
+            values[index] = value
+    if negative_as_zero:
+        values[values < 0] = 0
+    values *= factor
+    results = [(value, None) for value in values.tolist()]
+    for index in invalid:
+        results[index] = parse_float(str_values[index])
+    return results, invalid
+
+
 def get_current_date():
     return datetime.now().date()
 
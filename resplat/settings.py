@@ -134,6 +134,100 @@ USE_L10N = True
 
 USE_TZ = True
 
+# How the raw lines of ingested files are kept: 'rows' stores each line as an
+# IngestFileData row, 'compressed' keeps each file once as a compressed
+# IngestFileContent and only stores the lines with errors as rows
+
+INGEST_RAW_LINE_STORAGE = 'rows'
+
+# The months of raw ingest data kept by the ingest_retention command, 0 keeps
+# everything
+
+INGEST_RAW_LINE_RETENTION_MONTHS = 0
+
+# How the daily readings of the collections are kept: 'daily' stores an
+# Ingest row for each collection, storage product and day, 'ranges' only
+# stores a reading when it differs from the day before, as an IngestReading
+# valid from one date to another. With 'ranges' the reports read the
+# applications_ingest_daily view (PostgreSQL only), which expands the ranges
+# back to days, and the ingest_compact_readings command moves the existing
+# Ingest rows into ranges.
+
+INGEST_READING_STORAGE = 'daily'
+
+# The seconds the ingest parsers reuse their collection and storage product
+# lookups for. Changes saved in the same process invalidate them at once,
+# this bounds how long changes made by other processes go unseen. 0 never
+# expires them.
+
+INGEST_RESOLVER_CACHE_SECONDS = 300
+
+# If True, the ingest parsers keep only a chunk of a file in memory, and the
+# errors of each parser are returned as counts by category with a sample of
+# INGEST_ERROR_SAMPLE_SIZE of them, instead of every line's tokens and every
+# error. The callers of the ingest url must expect that format before it is
+# turned on.
+
+INGEST_STREAMING_PARSE = False
+INGEST_ERROR_SAMPLE_SIZE = 20
+
+# The lines of an ingest file written in each transaction. A chunk the
+# database refuses is written again a row at a time, so that only the rows
+# at fault are reported as errors.
+
+INGEST_CHUNK_SIZE = 500
+
+# The seconds a running ingest job can go without reporting progress before
+# the ingest workers take its worker for dead and queue it again, 0 never
+# does. It has to be longer than the slowest fetch of a file. A job is failed
+# instead once it has been started INGEST_JOB_MAX_ATTEMPTS times.
+
+INGEST_JOB_STALE_SECONDS = 3600
+INGEST_JOB_MAX_ATTEMPTS = 3
+
+# The directories the ingest_watch command ingests the files of as they
+# arrive. The 'source' and 'location' of a directory apply to all of its
+# files. Each of its 'patterns' is a 'regex' matching file names, whose named
+# group 'date' is the extract date (in 'date_format', %Y%m%d by default),
+# with the 'type' of its files. The named groups 'source', 'type' and
+# 'location' of a regex override the values given for it. Market files
+# changed after they were ingested are not ingested again, as their rows are
+# added to those of the date; their jobs fail instead.
+
+INGEST_WATCH_DIRECTORIES = [
+    {
+        'path': '/mnt/sonasrpt/market/',
+        'source': 'MON',
+        'location': 1,
+        'patterns': [
+            {'regex': r'^market_(?P<date>\d{8})\.csv$', 'type': 'M'},
+        ],
+    },
+]
+
+# Where the ingest files of each file source are fetched from. 'fetcher' is
+# one of 'local', 'http' or 'swift', the other keys are its base_url,
+# timeout (seconds), retries and backoff (seconds before the first retry,
+# doubled for each one after it), and auth_token for 'swift'. The files of
+# other sources are fetched from this server's /static/market/.
+
+INGEST_SOURCES = {
+    'UOM': {
+        'fetcher': 'swift',
+        'base_url': 'https://swift.rc.nectar.org.au/v1/'
+                    'AUTH_c84359b1de24472bab55ac28607feae4/vicnode_report/',
+        'timeout': 60,
+        'retries': 3,
+        'backoff': 1.0,
+    },
+    'MON': {
+        'fetcher': 'local',
+        'base_url': 'file:///mnt/sonasrpt/market/',
+        'retries': 3,
+        'backoff': 1.0,
+    },
+}
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
@@ -30,6 +30,7 @@ urlpatterns = [
     url(r'^resplat/doc/', include('django.contrib.admindocs.urls')),
     url(r'^resplat/', admin.site.urls),
     url(r'^resplat/stats/', include('storage.urls')),
+    url(r'^ingest/', include('ingest.urls')),
     url(r'^$', views.index, name='index'),
     # from http://staticfiles.productiondjango.com/blog/failproof-favicons/
     url(r'^favicon.ico$', RedirectView.as_view(
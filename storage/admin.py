@@ -11,10 +11,12 @@ from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
 from storage.filters import RelatedDropDownFilter, FieldOfResearchFilter
-from storage.models.applications import AccessLayer, AccessLayerMember
+from storage.models.applications import AccessLayer, AccessLayerMember, \
+    get_daily_ingests
 from .models import Allocation, CollectionProfile, Custodian, Ingest, \
-    Request, Collection, StorageProduct, Suborganization, Contact, \
-    Organisation, IngestFile, LabelsAlias, Label, FieldOfResearch, Domain
+    IngestReading, Request, Collection, StorageProduct, Suborganization, \
+    Contact, Organisation, IngestFile, LabelsAlias, Label, FieldOfResearch, \
+    Domain
 
 logger = logging.getLogger(__name__)
 
@@ -163,6 +165,17 @@ class IngestAdmin(admin.ModelAdmin):
     readonly_fields = ('ingested_raw_tb',)
 
 
+class IngestReadingAdmin(admin.ModelAdmin):
+    list_display = ('storage_product', 'valid_from', 'valid_to',
+                    'collection', 'allocated_capacity', 'used_capacity')
+    list_display_links = ('storage_product', 'valid_from', 'collection',)
+    list_filter = [('collection', RelatedDropDownFilter),
+                   ('storage_product', RelatedDropDownFilter),
+                   'valid_from']
+    search_fields = ['collection__name']
+    ordering = ['collection', 'storage_product', '-valid_from']
+
+
 class IngestFileAdmin(admin.ModelAdmin):
     fields = ['source', 'location', 'type', 'extract_date', 'url']
     list_display = ('source', 'location', 'type', 'extract_date', 'url')
@@ -340,7 +353,8 @@ class CollectionAdmin(admin.ModelAdmin):
         'ingests', 'Ingests',
         query_string=lambda c: 'collection__id__exact={}'.format(c.pk))
     def ingests_link(self, ingest):
-        num = Ingest.objects.filter(collection__id=ingest.instance.id).count()
+        num = get_daily_ingests().filter(
+            collection__id=ingest.instance.id).count()
         return '{} for this collection'.format(num)
 
     @staticmethod
@@ -354,8 +368,10 @@ class CollectionAdmin(admin.ModelAdmin):
             request, object_id=object_id, form_url=form_url,
             extra_context=extra_context)
         try:
-            qs = response.context_data['original'].ingests.filter(
-                Q(used_capacity__gt=0)).order_by('extraction_date')
+            qs = get_daily_ingests().filter(
+                Q(used_capacity__gt=0),
+                collection=response.context_data['original']).order_by(
+                'extraction_date')
             if qs.count():
                 # can have multiple entries on the same date, as each storage
                 # product used will have a separate value.
@@ -446,6 +462,7 @@ class SuborganizationAdmin(admin.ModelAdmin):
 admin.site.register(AccessLayer, AccessLayerAdmin)
 admin.site.register(Allocation, AllocationAdmin)
 admin.site.register(Ingest, IngestAdmin)
+admin.site.register(IngestReading, IngestReadingAdmin)
 admin.site.register(Collection, CollectionAdmin)
 admin.site.register(Request, RequestAdmin)
 admin.site.register(StorageProduct, StorageProductAdmin)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0021_auto_20180814_0012'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestfile',
+            name='etag',
+            field=models.TextField(blank=True, help_text='the ETag header of the response the file was fetched in', null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestfile',
+            name='last_modified',
+            field=models.TextField(blank=True, help_text='the Last-Modified header of the response the file was fetched in', null=True),
+        ),
+        migrations.AddField(
+            model_name='ingestfile',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, help_text='the SHA-256 of the content fetched', max_length=64, null=True),
+        ),
+    ]
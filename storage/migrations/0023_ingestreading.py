@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 07:32
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the daily readings of the Ingest rows and of the IngestReading ranges
+DAILY_VIEW_SQL = """
+CREATE VIEW applications_ingest_daily AS
+SELECT id::bigint AS id, extraction_date, allocated_capacity, used_capacity,
+       used_replica, collection_id, storage_product_id
+FROM applications_ingest
+UNION ALL
+SELECT -(r.id::bigint * 100000 + (d.day::date - r.valid_from)) AS id,
+       d.day::date AS extraction_date, r.allocated_capacity, r.used_capacity,
+       r.used_replica, r.collection_id, r.storage_product_id
+FROM applications_ingest_reading r,
+     generate_series(r.valid_from, r.valid_to, interval '1 day') AS d(day)
+"""
+
+
+def create_daily_view(apps, schema_editor):
+    # generate_series is PostgreSQL only, the reports only read the view
+    # when the readings are stored as ranges
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DAILY_VIEW_SQL)
+
+
+def drop_daily_view(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP VIEW IF EXISTS applications_ingest_daily')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0022_ingestfile_fetch_headers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyIngest',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('extraction_date', models.DateField()),
+                ('allocated_capacity', models.DecimalField(decimal_places=2, max_digits=15, null=True)),
+                ('used_capacity', models.DecimalField(decimal_places=2, max_digits=15, null=True)),
+                ('used_replica', models.DecimalField(decimal_places=2, max_digits=15, null=True)),
+            ],
+            options={
+                'db_table': 'applications_ingest_daily',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='IngestReading',
+            fields=[
+                ('id', models.AutoField(help_text='the primary key', primary_key=True, serialize=False)),
+                ('valid_from', models.DateField(help_text='the first date this reading was read')),
+                ('valid_to', models.DateField(help_text='the last date this reading was read, every day from valid_from had the same reading')),
+                ('allocated_capacity', models.DecimalField(blank=True, decimal_places=2, help_text='the allocated capacity in GB', max_digits=15, null=True, verbose_name='allocated capacity in GB')),
+                ('used_capacity', models.DecimalField(blank=True, decimal_places=2, default=0, help_text='the ingested capacity in GB', max_digits=15, null=True, verbose_name='ingested capacity in GB')),
+                ('used_replica', models.DecimalField(blank=True, decimal_places=2, default=0, help_text='??', max_digits=15, null=True, verbose_name='the replica storage used (if any) in GB')),
+                ('collection', models.ForeignKey(help_text='the collection associated with this reading', on_delete=django.db.models.deletion.DO_NOTHING, related_name='readings', to='storage.Collection')),
+                ('storage_product', models.ForeignKey(help_text='the storage product holding the data', on_delete=django.db.models.deletion.DO_NOTHING, to='storage.StorageProduct')),
+            ],
+            options={
+                'db_table': 'applications_ingest_reading',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ingestreading',
+            index=models.Index(fields=['collection', 'storage_product', 'valid_to'], name='application_collect_91fb78_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingestreading',
+            unique_together=set([('collection', 'storage_product', 'valid_from')]),
+        ),
+        migrations.RunPython(create_daily_view, drop_daily_view),
+    ]
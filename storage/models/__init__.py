@@ -9,6 +9,8 @@ from .applications import Custodian
 from .applications import Domain
 from .applications import FieldOfResearch
 from .applications import Ingest
+from .applications import IngestReading
+from .applications import DailyIngest
 from .applications import Collection
 from .applications import Request
 from .applications import StorageProduct
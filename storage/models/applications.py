@@ -1,8 +1,10 @@
 import datetime
 from decimal import Decimal
 
+from django.conf import settings
 from django.db import models
-from django.db.models import Q, Sum
+from django.db.models import Q, Sum, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 
 from storage.models.labels import GroupDefaultLabel
 
@@ -364,6 +366,165 @@ class Ingest(models.Model):
             fields=['collection', 'storage_product', 'extraction_date'])]
 
 
+def stores_readings_as_ranges():
+    """
+    :return: True if the ingests record the readings that differ from the
+             day before as IngestReading ranges, instead of an Ingest row
+             for each day
+    """
+    return getattr(settings, 'INGEST_READING_STORAGE', 'daily') == 'ranges'
+
+
+def get_daily_ingests():
+    """
+    :return: a queryset of the daily readings for the reports. When readings
+             are stored as ranges it is over the DailyIngest view, which has
+             the Ingest rows as well as the ranges expanded to days.
+    """
+    if stores_readings_as_ranges():
+        return DailyIngest.objects.all()
+    return Ingest.objects.all()
+
+
+class IngestReadingManager(models.Manager):
+    def on_date(self, date):
+        """
+        :return: a queryset of the readings valid on date
+        """
+        return self.filter(valid_from__lte=date, valid_to__gte=date)
+
+    def daily(self, start_date, end_date):
+        """
+        :return: generator of an unsaved Ingest for each day from start_date
+                 to end_date (inclusive) covered by a reading of the queryset,
+                 ordered by collection, storage product and date
+        """
+        readings = self.get_queryset().filter(
+            valid_from__lte=end_date, valid_to__gte=start_date).order_by(
+            'collection_id', 'storage_product_id', 'valid_from')
+        for reading in readings.iterator():
+            day = max(reading.valid_from, start_date)
+            while day <= min(reading.valid_to, end_date):
+                yield reading.as_ingest(day)
+                day += datetime.timedelta(days=1)
+
+
+class IngestReading(models.Model):
+    """
+    The readings of how much storage on a given storage product is used by
+    the collection, recorded once for each run of days they stay the same
+    (see INGEST_READING_STORAGE)
+    """
+    id = models.AutoField(primary_key=True, help_text='the primary key')
+    valid_from = models.DateField(
+        help_text='the first date this reading was read')
+    valid_to = models.DateField(
+        help_text='the last date this reading was read, every day from '
+                  'valid_from had the same reading')
+    allocated_capacity = models.DecimalField(
+        max_digits=15, decimal_places=2, blank=True, null=True,
+        verbose_name='allocated capacity in GB',
+        help_text='the allocated capacity in GB')
+    used_capacity = models.DecimalField(
+        max_digits=15, decimal_places=2, default=0, blank=True, null=True,
+        verbose_name='ingested capacity in GB',
+        help_text='the ingested capacity in GB')
+    collection = models.ForeignKey(
+        'storage.Collection', models.DO_NOTHING,
+        related_name='readings',
+        help_text='the collection associated with this reading')
+    storage_product = models.ForeignKey(
+        'storage.StorageProduct', models.DO_NOTHING,
+        help_text='the storage product holding the data')
+    used_replica = models.DecimalField(
+        max_digits=15, decimal_places=2, default=0, blank=True, null=True,
+        verbose_name='the replica storage used (if any) in GB',
+        help_text='??')
+
+    objects = IngestReadingManager()
+
+    def as_ingest(self, date):
+        """
+        :return: an unsaved Ingest of the reading on date
+        """
+        return Ingest(extraction_date=date, collection_id=self.collection_id,
+                      storage_product_id=self.storage_product_id,
+                      allocated_capacity=self.allocated_capacity,
+                      used_capacity=self.used_capacity,
+                      used_replica=self.used_replica)
+
+    def __str__(self):
+        return '%s %s %s to %s' % (self.collection_id,
+                                   self.storage_product_id,
+                                   self.valid_from, self.valid_to)
+
+    class Meta:
+        db_table = 'applications_ingest_reading'
+        unique_together = ('collection', 'storage_product', 'valid_from')
+        indexes = [models.Index(
+            fields=['collection', 'storage_product', 'valid_to'])]
+
+
+class DailyIngest(models.Model):
+    """
+    The daily readings of the Ingest rows and of the IngestReading ranges,
+    one row for each day of a range, as kept by the applications_ingest_daily
+    view (PostgreSQL only). The rows of the ranges have negative ids.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    extraction_date = models.DateField()
+    allocated_capacity = models.DecimalField(max_digits=15, decimal_places=2,
+                                             null=True)
+    used_capacity = models.DecimalField(max_digits=15, decimal_places=2,
+                                        null=True)
+    collection = models.ForeignKey(
+        'storage.Collection', models.DO_NOTHING, related_name='daily_ingests')
+    storage_product = models.ForeignKey('storage.StorageProduct',
+                                        models.DO_NOTHING, related_name='+')
+    used_replica = models.DecimalField(max_digits=15, decimal_places=2,
+                                       null=True)
+
+    @property
+    def ingested_tb(self):
+        """The ingested amount in Terabytes"""
+        return self.used_capacity / 1000
+
+    class Meta:
+        managed = False
+        db_table = 'applications_ingest_daily'
+
+
+class CollectionManager(models.Manager):
+    # shown as the code of a collection without an application
+    NO_APPLICATION_CODE = ' '
+
+    def with_application_code(self):
+        """
+        :return: a queryset of the collections annotated with the code of the
+                 application of their first allocation, as shown by
+                 Collection.application_code, in the one query
+        """
+        first_allocation = Allocation.objects.filter(
+            collection=OuterRef('pk')).order_by('pk')
+        return self.annotate(first_application_code=Coalesce(
+            Subquery(first_allocation.values('application__code')[:1],
+                     output_field=models.CharField()),
+            Value(self.NO_APPLICATION_CODE)))
+
+    def get_application_code_maps(self):
+        """
+        :return: tuple of a dictionary of the collections keyed by their
+                 application code, and one of the application codes keyed
+                 by collection id
+        """
+        collections = {}
+        codes = {}
+        for collection in self.with_application_code():
+            collections[collection.first_application_code] = collection
+            codes[collection.id] = collection.first_application_code
+        return collections, codes
+
+
 class Collection(models.Model):
     """
     The collection the data stored belongs to.
@@ -408,6 +569,8 @@ class Collection(models.Model):
         default='', blank=True, null=True,
         help_text='a link to the collection')
 
+    objects = CollectionManager()
+
     def __str__(self):
         return self.name
 
@@ -419,6 +582,8 @@ class Collection(models.Model):
         """
         :return: the first application code to be shown as the collection code
         """
+        if hasattr(self, 'first_application_code'):
+            return self.first_application_code
         allocation = self.allocations.first()
         return allocation.application.code if allocation else ' '
 
@@ -462,12 +627,13 @@ class Collection(models.Model):
     def total_ingested(self):
         "Returns the total ingested for the collection"
         try:
-            last_extract_date = self.ingests.latest(
+            ingests = get_daily_ingests().filter(collection=self)
+            last_extract_date = ingests.latest(
                 'extraction_date').extraction_date
-            result = self.ingests.filter(
+            result = ingests.filter(
                 extraction_date=last_extract_date).aggregate(
                 Sum('used_capacity'))
-        except Ingest.DoesNotExist:
+        except (Ingest.DoesNotExist, DailyIngest.DoesNotExist):
             return 0
         amount = result['used_capacity__sum']
         if amount:
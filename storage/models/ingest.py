@@ -38,6 +38,16 @@ class IngestFile(models.Model):
                           help_text='where the file was fetched from')
     # following is not used...
     completed = models.BooleanField(default=False, null=False)
+    sha256 = models.CharField(
+        max_length=64, null=True, blank=True, db_index=True,
+        help_text='the SHA-256 of the content fetched')
+    etag = models.TextField(
+        null=True, blank=True,
+        help_text='the ETag header of the response the file was fetched in')
+    last_modified = models.TextField(
+        null=True, blank=True,
+        help_text='the Last-Modified header of the response the file was '
+                  'fetched in')
 
     objects = IngestFileManager()
 
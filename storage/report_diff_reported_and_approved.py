@@ -1,4 +1,5 @@
-from storage.models import Allocation, Ingest
+from storage.models import Allocation
+from storage.models.applications import get_daily_ingests
 
 __author__ = 'simonyu'
 
@@ -29,7 +30,7 @@ class DiffReportedAndApprovedResult(object):
 
 def _last_ingest_for_collection_and_storage_product(collection_id,
                                                     storage_product_id):
-    return Ingest.objects.filter(
+    return get_daily_ingests().filter(
         collection__id=collection_id,
         storage_product__id=storage_product_id).order_by(
         '-extraction_date').first()
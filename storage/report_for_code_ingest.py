@@ -2,7 +2,8 @@ import json
 from decimal import Decimal
 from operator import methodcaller
 
-from storage.models import StorageProduct, Ingest, Domain
+from storage.models import StorageProduct, Domain
+from storage.models.applications import get_daily_ingests
 
 
 class ForCodeReportOptions:
@@ -101,7 +102,7 @@ def report_for_code_ingest(org_type):
 
     collection_used_totals = {}
     # the latest Ingests based on the collection and storage product
-    ingests = Ingest.objects.filter(
+    ingests = get_daily_ingests().filter(
         storage_product__in=storage_products).values(
         'used_capacity', 'extraction_date', 'collection_id',
         'storage_product_id').order_by(
@@ -4,6 +4,7 @@ from decimal import Decimal
 from typing import Optional
 
 from storage.models import Collection, Label
+from storage.models.applications import get_daily_ingests
 
 
 def _get_label_sequence_tuple(label) -> (Optional[int], str):
@@ -154,7 +155,8 @@ class FundingReportForCollection(AbstractFundingReportBase):
             raise Exception('Collection is required')
 
     def get_ingest_query(self, storage_product):
-        qry = self.collection.ingests.filter(storage_product=storage_product)
+        qry = get_daily_ingests().filter(collection=self.collection,
+                                         storage_product=storage_product)
         return qry.values('collection', 'extraction_date',
                           'used_capacity').order_by('collection',
                                                     '-extraction_date')
@@ -5,7 +5,7 @@ from operator import methodcaller
 
 from django.db.models import Max, Min, Sum
 
-from storage.models import Ingest
+from storage.models.applications import get_daily_ingests
 
 
 class StorageProductIngests(object):
@@ -112,18 +112,18 @@ def _get_date_ordered_dict_with_zero_values(start, end):
 
 def _daily_ingests_grouped_by_storage_product():
     # get the id's and names of all of the known storage products
-    storage_products = Ingest.objects.values(
+    storage_products = get_daily_ingests().values(
         'storage_product__id',
         'storage_product__product_name__value').distinct('storage_product')
     if not storage_products:
         return None
 
     # find the dates of the first and last ingests
-    start_and_end = Ingest.objects.aggregate(Min('extraction_date'),
-                                             Max('extraction_date'))
+    start_and_end = get_daily_ingests().aggregate(Min('extraction_date'),
+                                                  Max('extraction_date'))
     results = []
     for storage_product in storage_products:
-        daily_ingest_storage_product_sum = Ingest.objects.filter(
+        daily_ingest_storage_product_sum = get_daily_ingests().filter(
             storage_product__id=storage_product['storage_product__id']).values(
             'extraction_date', 'storage_product_id').annotate(
             ingest_size=Sum('used_capacity')).order_by('extraction_date')
@@ -5,8 +5,9 @@ from decimal import Decimal
 
 from django.db import connection
 
-from storage.models import Ingest, Collection, Request, StorageProduct, \
+from storage.models import Collection, Request, StorageProduct, \
     CollectionProfile
+from storage.models.applications import get_daily_ingests
 
 
 class RedsReportOptions:
@@ -135,7 +136,7 @@ def _latest_data_from_ingests(storage_products):
     result = OrderedDict()
     # find the set of Ingests based on the storage product list ordered latest
     # to earliest, distinct by collection id and storage product id
-    ingests = Ingest.objects.filter(
+    ingests = get_daily_ingests().filter(
         storage_product__in=storage_products).order_by(
         'collection_id', 'storage_product_id', '-extraction_date').distinct(
         'collection_id', 'storage_product_id')
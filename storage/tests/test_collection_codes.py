@@ -0,0 +1,39 @@
+from django.test import TestCase
+
+from storage.models import Allocation, Collection, Label, Request, \
+    StorageProduct
+
+
+class CollectionCodeTestCase(TestCase):
+    def setUp(self):
+        label = Label.objects.create(value='Market.Melbourne', group=None)
+        product = StorageProduct.objects.create(product_name=label,
+                                                scheme=label)
+        self.first = Collection.objects.create(name='first')
+        self.second = Collection.objects.create(name='second')
+        self.unallocated = Collection.objects.create(name='unallocated')
+        for collection, code in ((self.first, 'CODE1'), (self.first, 'CODE2'),
+                                 (self.second, 'CODE3')):
+            Allocation.objects.create(
+                collection=collection, storage_product=product, size=1000,
+                application=Request.objects.create(code=code))
+
+    def test_codes_match_the_first_allocation(self):
+        with self.assertNumQueries(1):
+            collections, codes = \
+                Collection.objects.get_application_code_maps()
+        self.assertEqual(collections, {'CODE1': self.first,
+                                       'CODE3': self.second,
+                                       ' ': self.unallocated})
+        self.assertEqual(codes, {self.first.id: 'CODE1',
+                                 self.second.id: 'CODE3',
+                                 self.unallocated.id: ' '})
+        for collection in Collection.objects.all():
+            self.assertEqual(collection.application_code,
+                             codes[collection.id])
+
+    def test_annotated_code_needs_no_query(self):
+        collection = Collection.objects.with_application_code().get(
+            name='second')
+        with self.assertNumQueries(0):
+            self.assertEqual(collection.application_code, 'CODE3')
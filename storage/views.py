@@ -10,9 +10,10 @@ from django.shortcuts import render, get_object_or_404
 
 from storage.csv_streamer import csv_stream
 from storage.forms import CollectionsSearchForm
-from storage.models import Ingest, StorageProduct, Collection, \
+from storage.models import StorageProduct, Collection, \
     CollectionProfile, Allocation, Request, Contact
-from storage.models.applications import AccessLayerMember
+from storage.models.applications import AccessLayerMember, \
+    get_daily_ingests
 from storage.report_demographics import demographics_report
 from storage.report_diff_reported_and_approved import \
     get_difference_between_approved_and_reported
@@ -41,8 +42,9 @@ def _date_in_past(from_date, go_back_days):
 def _ingest_counts_for_date(ingest_date, storage_products):
     ingested = {}
     for name, storage_product in storage_products.items():
-        count = Ingest.objects.filter(storage_product=storage_product,
-                                      extraction_date=ingest_date).count()
+        count = get_daily_ingests().filter(
+            storage_product=storage_product,
+            extraction_date=ingest_date).count()
         ingested[name] = count > 0
     return {
         'ingested': ingested,
@@ -79,7 +81,8 @@ def _fetch_collection_status_data():
     result = []
     last_status = None
     current_status_collection_list = []
-    for collection in Collection.objects.all().order_by('status'):
+    for collection in Collection.objects.with_application_code().order_by(
+            'status'):
         if last_status != collection.status:
             if not last_status and len(current_status_collection_list):
                 # we have a list of collections with no status set on them
@@ -223,8 +226,8 @@ def application_detail(request, application_code):
 def contact_detail(request, contact_id):
     collections = []
     contact = get_object_or_404(Contact, pk=contact_id)
-    for collection in Collection.objects.filter(
-            custodians__person=contact).all():
+    for collection in Collection.objects.with_application_code().filter(
+            custodians__person=contact):
         if collection not in collections:
             collections.append(collection)
     return render(request, 'contact_detail.html',